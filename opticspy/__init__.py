@@ -9,8 +9,21 @@
  *  Copyright (c) 2014-2015 Xing fan
 """
 from __future__ import division as __division__
-from . import aperture, interferometer_seidel, interferometer_zenike
-from . import seidel, seidel2, zernike, test, tools, diffraction, jones, gauss
-from . import phaseunwrap, lens, asphere, mplot3d, zernike_rec
+import importlib as __importlib__
 import warnings as __warnings__
-__warnings__.filterwarnings("ignore")
\ No newline at end of file
+__warnings__.filterwarnings("ignore")
+
+# Submodules are imported on first attribute access (PEP 562), so that
+# "import opticspy" does not pull in matplotlib, the vendored mplot3d or
+# unwrap until they are used, e.g. by headless ray tracing jobs.
+__all__ = ['aperture', 'interferometer_seidel', 'interferometer_zenike',
+           'seidel', 'seidel2', 'zernike', 'test', 'tools', 'diffraction', 'jones', 'gauss',
+           'phaseunwrap', 'lens', 'asphere', 'mplot3d', 'zernike_rec', 'ray_tracing']
+
+def __getattr__(name):
+    if name in __all__:
+        return __importlib__.import_module('.' + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
\ No newline at end of file
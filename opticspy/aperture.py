@@ -1,6 +1,7 @@
 import numpy as __np__
 
 from . import diffraction as __diffraction__
+from . import fft_tools as __fft__
 from . import tools as __tools__
 
 class Aperture():
@@ -52,8 +53,8 @@ class Aperture():
 		Compute an aperture's otf
 		"""
 		print("-------------OTF---------------")
-		aperfft = __np__.fft.fftshift(__np__.fft.fft2(self.__aper__))**2
-		aper_OTF = __np__.fft.fftshift(__np__.fft.fft2(aperfft))
+		aperfft = __fft__.fftshift(__fft__.fft2(self.__aper__))**2
+		aper_OTF = __fft__.fftshift(__fft__.fft2(aperfft))
 		__tools__.__apershow__(aper_OTF,extent = 0)
 		return 0
 
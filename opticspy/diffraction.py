@@ -1,4 +1,5 @@
 import numpy as __np__
+from . import fft_tools as __fft__
 from . import tools as __tools__
 
 def fresnel(aperture,z = 2,lambda1 = 660*10**(-9)):
@@ -21,7 +22,7 @@ def fresnel(aperture,z = 2,lambda1 = 660*10**(-9)):
 	[x,y] = __np__.meshgrid(x1,x1)
 	# Single-DFT
 	e1 = __np__.exp(1j*2*__np__.pi/lambda1*(x**2+y**2)/2/z*((scale)**2))
-	diffraction = __np__.fft.fftshift(__np__.fft.fft2(aperture.__aper__*e1))
+	diffraction = __fft__.fftshift(__fft__.fft2(aperture.__aper__*e1))
 
 	extent = n*scale
 	__tools__.__apershow__(diffraction, extent = extent)
@@ -31,7 +32,7 @@ def fraunhofer(aperture, z = 2, lambda1 = 660*10**(-9)):
 	"""
 	Fraunhofer diffraction
 	"""
-	diffraction = 1j*__np__.exp(1j*2*__np__.pi/lambda1*z)/lambda1/z*__np__.fft.fftshift(__np__.fft.fft2(aperture.__aper__))
+	diffraction = 1j*__np__.exp(1j*2*__np__.pi/lambda1*z)/lambda1/z*__fft__.fftshift(__fft__.fft2(aperture.__aper__))
 
 	extent = aperture.__background__*aperture.__scale__
 	__tools__.__apershow__(diffraction, extent)
@@ -0,0 +1,129 @@
+"""
+FFT service shared by the PSF, OTF, MTF and diffraction code
+
+The backend is pyFFTW (through its scipy.fft interface) when installed,
+else scipy.fft, else numpy.fft. This module keeps no FFT plans, scipy.fft
+has its own internal plan cache and pyFFTW's interface cache is switched
+on. scipy.fft and pyFFTW run with workers threads; numpy.fft is single
+threaded. rfft2/irfft2 are the real to complex transforms for callers
+that use the half spectrum. The last few zero padded scratch arrays are
+kept per thread, so sweeps of many transforms of one size allocate
+nothing new.
+"""
+from __future__ import division as __division__
+import threading
+import numpy as __np__
+
+__backend__ = {}
+# scratch arrays of padded(), one dict per thread, at most MAX_BUFFERS
+# of them and MAX_BUFFER_BYTES together in every thread
+__local__ = threading.local()
+MAX_BUFFERS = 4
+MAX_BUFFER_BYTES = 64*2**20
+
+# threads of scipy.fft / pyFFTW, None is the library default (1), -1 all cores
+WORKERS = None
+
+def set_workers(n):
+	global WORKERS
+	WORKERS = n
+
+def set_backend(name=None):
+	"""
+	choose the FFT backend: 'pyfftw', 'scipy', 'numpy',
+	or None for the best one installed
+	"""
+	names = ['pyfftw', 'scipy', 'numpy'] if name is None else [name]
+	for name in names:
+		try:
+			if name == 'pyfftw':
+				import pyfftw
+				import pyfftw.interfaces.scipy_fft as module
+				pyfftw.interfaces.cache.enable()
+			elif name == 'scipy':
+				import scipy.fft as module
+			elif name == 'numpy':
+				import numpy.fft as module
+			else:
+				raise Exception('No this FFT backend: %s, use pyfftw, scipy or numpy' % name)
+		except ImportError:
+			continue
+		__backend__['name'] = name
+		__backend__['module'] = module
+		return name
+	raise Exception('FFT backend %s is not installed' % names[0])
+
+def backend():
+	if not __backend__:
+		set_backend()
+	return __backend__['module']
+
+def __transform__(func, a, s, axes, workers):
+	module = backend()
+	if __backend__['name'] == 'numpy':
+		return getattr(module, func)(a, s=s, axes=axes)
+	return getattr(module, func)(a, s=s, axes=axes, workers=WORKERS if workers is None else workers)
+
+def fft2(a, s=None, axes=(-2, -1), workers=None):
+	return __transform__('fft2', a, s, axes, workers)
+
+def ifft2(a, s=None, axes=(-2, -1), workers=None):
+	return __transform__('ifft2', a, s, axes, workers)
+
+def rfft2(a, s=None, axes=(-2, -1), workers=None):
+	return __transform__('rfft2', a, s, axes, workers)
+
+def irfft2(a, s=None, axes=(-2, -1), workers=None):
+	return __transform__('irfft2', a, s, axes, workers)
+
+fftshift = __np__.fft.fftshift
+ifftshift = __np__.fft.ifftshift
+
+def next_fast_len(n, even=False):
+	"""
+	smallest 5-smooth size (2**a * 3**b * 5**c) >= n, even if asked
+	"""
+	n = max(int(n), 1)
+	best = None
+	p5 = 1
+	while p5 < 2*n:
+		p35 = p5
+		while p35 < 2*n:
+			size = p35
+			while size < n or (even and size % 2):
+				size *= 2
+			if best is None or size < best:
+				best = size
+			p35 *= 3
+		p5 *= 5
+	return best
+
+def padded(a, s, key=None):
+	"""
+	a copied into the corner of a zero array of shape s (last axes),
+	cached and reused by the next call of the same thread with the same
+	shapes, dtype and key, copy the result to keep it. Arrays above
+	MAX_BUFFER_BYTES are new on every call.
+	"""
+	a = __np__.asarray(a)
+	s = tuple(s)
+	shape = a.shape[:-len(s)] + s
+	index = (key, a.shape, shape, a.dtype.str)
+	buffers = __buffers__()
+	out = buffers.get(index)
+	if out is None:
+		out = __np__.zeros(shape, dtype=a.dtype)
+		if out.nbytes <= MAX_BUFFER_BYTES:
+			buffers[index] = out
+			while len(buffers) > MAX_BUFFERS or sum(b.nbytes for b in buffers.values()) > MAX_BUFFER_BYTES:
+				del buffers[next(iter(buffers))]
+	out[tuple(slice(0, i) for i in a.shape)] = a
+	return out
+
+def __buffers__():
+	if not hasattr(__local__, 'buffers'):
+		__local__.buffers = {}
+	return __local__.buffers
+
+def clear_buffers():
+	__buffers__().clear()
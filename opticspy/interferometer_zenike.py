@@ -3,11 +3,8 @@ import numpy as __np__
 from numpy import cos as __cos__
 from numpy import sin as __sin__
 from numpy import sqrt as __sqrt__
-import matplotlib.pyplot as __plt__
-from matplotlib import cm as __cm__
 
 from . import tools as __tools__
-from .phaseunwrap import unwrap2D as __unwrap2D__
 
 def __zernikecartesian__(coefficient,x,y):
 	"""
@@ -68,6 +65,68 @@ def __zernikecartesian__(coefficient,x,y):
 			Z30+ Z31+ Z32+ Z33+ Z34+ Z35+ Z36+ Z37
 	return ZW
 
+# Zernike polynomials Z1..Z37 in polar coordinates, radial part R(r)
+# and angular order m, Zj = R(r)*cos(m*u) or R(r)*sin(m*u)
+__polarterms__ = [
+	(lambda r: __np__.ones_like(r), 0, None),	# Z1
+	(lambda r: 2*r, 1, 'cos'),	# Z2
+	(lambda r: 2*r, 1, 'sin'),	# Z3
+	(lambda r: __sqrt__(3)*(2*r**2-1), 0, None),	# Z4
+	(lambda r: __sqrt__(6)*r**2, 2, 'sin'),	# Z5
+	(lambda r: __sqrt__(6)*r**2, 2, 'cos'),	# Z6
+	(lambda r: __sqrt__(8)*(3*r**2-2)*r, 1, 'sin'),	# Z7
+	(lambda r: __sqrt__(8)*(3*r**2-2)*r, 1, 'cos'),	# Z8
+	(lambda r: __sqrt__(8)*r**3, 3, 'sin'),	# Z9
+	(lambda r: __sqrt__(8)*r**3, 3, 'cos'),	# Z10
+	(lambda r: __sqrt__(5)*(1-6*r**2+6*r**4), 0, None),	# Z11
+	(lambda r: __sqrt__(10)*(4*r**2-3)*r**2, 2, 'cos'),	# Z12
+	(lambda r: __sqrt__(10)*(4*r**2-3)*r**2, 2, 'sin'),	# Z13
+	(lambda r: __sqrt__(10)*r**4, 4, 'cos'),	# Z14
+	(lambda r: __sqrt__(10)*r**4, 4, 'sin'),	# Z15
+	(lambda r: __sqrt__(12)*(10*r**4-12*r**2+3)*r, 1, 'cos'),	# Z16
+	(lambda r: __sqrt__(12)*(10*r**4-12*r**2+3)*r, 1, 'sin'),	# Z17
+	(lambda r: __sqrt__(12)*(5*r**2-4)*r**3, 3, 'cos'),	# Z18
+	(lambda r: __sqrt__(12)*(5*r**2-4)*r**3, 3, 'sin'),	# Z19
+	(lambda r: __sqrt__(12)*r**5, 5, 'cos'),	# Z20
+	(lambda r: __sqrt__(12)*r**5, 5, 'sin'),	# Z21
+	(lambda r: __sqrt__(7)*(20*r**6-30*r**4+12*r**2-1), 0, None),	# Z22
+	(lambda r: __sqrt__(14)*(15*r**4-20*r**2+6)*r**2, 2, 'sin'),	# Z23
+	(lambda r: __sqrt__(14)*(15*r**4-20*r**2+6)*r**2, 2, 'cos'),	# Z24
+	(lambda r: __sqrt__(14)*(6*r**2-5)*r**4, 4, 'sin'),	# Z25
+	(lambda r: __sqrt__(14)*(6*r**2-5)*r**4, 4, 'cos'),	# Z26
+	(lambda r: __sqrt__(14)*r**6, 6, 'sin'),	# Z27
+	(lambda r: __sqrt__(14)*r**6, 6, 'cos'),	# Z28
+	(lambda r: 4*(35*r**6-60*r**4+30*r**2-4)*r, 1, 'sin'),	# Z29
+	(lambda r: 4*(35*r**6-60*r**4+30*r**2-4)*r, 1, 'cos'),	# Z30
+	(lambda r: 4*(21*r**4-30*r**2+10)*r**3, 3, 'sin'),	# Z31
+	(lambda r: 4*(21*r**4-30*r**2+10)*r**3, 3, 'cos'),	# Z32
+	(lambda r: 4*(7*r**2-6)*r**5, 5, 'sin'),	# Z33
+	(lambda r: 4*(7*r**2-6)*r**5, 5, 'cos'),	# Z34
+	(lambda r: 4*r**7, 7, 'sin'),	# Z35
+	(lambda r: 4*r**7, 7, 'cos'),	# Z36
+	(lambda r: 3*(70*r**8-140*r**6+90*r**4-20*r**2+1), 0, None),	# Z37
+]
+
+def __zernikepolarterm__(j,r,u,angular=None):
+	"""
+	Zernike polynomial Z(j+1) at r,u, angular: dict shared by the calls
+	on the same r,u to keep cos(m*u)+i*sin(m*u), built by multiplication
+	from exp(i*u) instead of one cos or sin per term
+	"""
+	radial,m,trig = __polarterms__[j]
+	if m == 0:
+		return radial(r)
+	if angular is None:
+		angular = {}
+	if 1 not in angular:
+		angular[1] = __np__.exp(1j*__np__.asarray(u))
+	for k in range(2,m+1):
+		if k not in angular:
+			angular[k] = angular[k-1]*angular[1]
+	if trig == 'cos':
+		return radial(r)*angular[m].real
+	return radial(r)*angular[m].imag
+
 def __zernikepolar__(coefficient,r,u):
 	"""
 	------------------------------------------------
@@ -83,50 +142,12 @@ def __zernikepolar__(coefficient,r,u):
 
 	------------------------------------------------
 	"""
-	Z = [0]+coefficient
-	Z1  =  Z[1]  * 1*(__cos__(u)**2+__sin__(u)**2)
-	Z2  =  Z[2]  * 2*r*__cos__(u)
-	Z3  =  Z[3]  * 2*r*__sin__(u)
-	Z4  =  Z[4]  * __sqrt__(3)*(2*r**2-1)
-	Z5  =  Z[5]  * __sqrt__(6)*r**2*__sin__(2*u)
-	Z6  =  Z[6]  * __sqrt__(6)*r**2*__cos__(2*u)
-	Z7  =  Z[7]  * __sqrt__(8)*(3*r**2-2)*r*__sin__(u)
-	Z8  =  Z[8]  * __sqrt__(8)*(3*r**2-2)*r*__cos__(u)
-	Z9  =  Z[9]  * __sqrt__(8)*r**3*__sin__(3*u)
-	Z10 =  Z[10] * __sqrt__(8)*r**3*__cos__(3*u)
-	Z11 =  Z[11] * __sqrt__(5)*(1-6*r**2+6*r**4)
-	Z12 =  Z[12] * __sqrt__(10)*(4*r**2-3)*r**2*__cos__(2*u)
-	Z13 =  Z[13] * __sqrt__(10)*(4*r**2-3)*r**2*__sin__(2*u)
-	Z14 =  Z[14] * __sqrt__(10)*r**4*__cos__(4*u)
-	Z15 =  Z[15] * __sqrt__(10)*r**4*__sin__(4*u)
-	Z16 =  Z[16] * __sqrt__(12)*(10*r**4-12*r**2+3)*r*__cos__(u)
-	Z17 =  Z[17] * __sqrt__(12)*(10*r**4-12*r**2+3)*r*__sin__(u)
-	Z18 =  Z[18] * __sqrt__(12)*(5*r**2-4)*r**3*__cos__(3*u)
-	Z19 =  Z[19] * __sqrt__(12)*(5*r**2-4)*r**3*__sin__(3*u)
-	Z20 =  Z[20] * __sqrt__(12)*r**5*__cos__(5*u)
-	Z21 =  Z[21] * __sqrt__(12)*r**5*__sin__(5*u)
-	Z22 =  Z[22] * __sqrt__(7)*(20*r**6-30*r**4+12*r**2-1)
-	Z23 =  Z[23] * __sqrt__(14)*(15*r**4-20*r**2+6)*r**2*__sin__(2*u)
-	Z24 =  Z[24] * __sqrt__(14)*(15*r**4-20*r**2+6)*r**2*__cos__(2*u)
-	Z25 =  Z[25] * __sqrt__(14)*(6*r**2-5)*r**4*__sin__(4*u)
-	Z26 =  Z[26] * __sqrt__(14)*(6*r**2-5)*r**4*__cos__(4*u)
-	Z27 =  Z[27] * __sqrt__(14)*r**6*__sin__(6*u)
-	Z28 =  Z[28] * __sqrt__(14)*r**6*__cos__(6*u)
-	Z29 =  Z[29] * 4*(35*r**6-60*r**4+30*r**2-4)*r*__sin__(u)
-	Z30 =  Z[30] * 4*(35*r**6-60*r**4+30*r**2-4)*r*__cos__(u)
-	Z31 =  Z[31] * 4*(21*r**4-30*r**2+10)*r**3*__sin__(3*u)
-	Z32 =  Z[32] * 4*(21*r**4-30*r**2+10)*r**3*__cos__(3*u)
-	Z33 =  Z[33] * 4*(7*r**2-6)*r**5*__sin__(5*u)
-	Z34 =  Z[34] * 4*(7*r**2-6)*r**5*__cos__(5*u)
-	Z35 =  Z[35] * 4*r**7*__sin__(7*u)
-	Z36 =  Z[36] * 4*r**7*__cos__(7*u)
-	Z37 =  Z[37] * 3*(70*r**8-140*r**6+90*r**4-20*r**2+1)
-
-
-	Z = Z1 + Z2 +  Z3+  Z4+  Z5+  Z6+  Z7+  Z8+  Z9+ \
-		Z10+ Z11+ Z12+ Z13+ Z14+ Z15+ Z16+ Z17+ Z18+ Z19+ \
-		Z20+ Z21+ Z22+ Z23+ Z24+ Z25+ Z26+ Z27+ Z28+ Z29+ \
-		Z30+ Z31+ Z32+ Z33+ Z34+ Z35+ Z36+ Z37
+	Z = __np__.zeros(__np__.broadcast(r,u).shape)
+	angular = {}
+	# zero coefficients are skipped, only the terms in use are evaluated
+	for j,c in enumerate(coefficient[:len(__polarterms__)]):
+		if c != 0:
+			Z = Z + c*__zernikepolarterm__(j,r,u,angular)
 	return Z
 
 
@@ -149,6 +170,8 @@ def twyman_green(coefficients, lambda_1 = 632, PR = 1):
 	----------------------------------------------
 	Interferogram of aberration
 	"""
+	import matplotlib.pyplot as __plt__
+	from matplotlib import cm as __cm__
 	lambda_1 = lambda_1*(10**-9)
 	coefficients = coefficients.__coefficients__
 	r = __np__.linspace(-PR, PR, 400)
@@ -203,23 +226,51 @@ def phase_shift(coefficients, lambda_1 = 632, PR = 1, type = '4-step', noise = 0
 	----------------------------------------------
 	Interferogram of aberration
 	"""
-	lambda_1 = lambda_1*(10**-9)
-	coefficients = coefficients.__coefficients__
+	import matplotlib.pyplot as __plt__
+	from matplotlib import cm as __cm__
+	if type == "4-step":
+		OPD = __phaseshiftopd__(coefficients.__coefficients__, PR, sample)
+		surface = OPD.copy()
+		__tools__.makecircle_boundary(surface, __np__.linspace(-PR, PR, sample), PR, 0)
+		im = __plt__.imshow(surface,extent=[-PR,PR,-PR,PR],cmap=__cm__.RdYlGn)
+		__plt__.colorbar()
+		__plt__.title('Surface figure',fontsize=16)
+		__plt__.show()
+		I,PR,M,sample = phase_shift_matrix(coefficients, lambda_1, PR, type, noise, sample, OPD=OPD)
+		__tools__.phase_shift_figure(I,PR,type = "4-step")
+
+		# fig = __plt__.figure(figsize=(8, 6), dpi=80)
+		# im = __plt__.pcolormesh(M,cmap=__cm__.RdYlGn)
+		# __plt__.title('Phase value map',fontsize=16)
+		# __plt__.colorbar()
+		# __plt__.show()
+
+		return [I,PR,M,sample]
+	else:
+		print("No this type of PSI")
+
+def __phaseshiftopd__(coefficients, PR, sample):
+	"""
+	OPD map of the phase shift interferogram over the whole sample grid
+	"""
 	r = __np__.linspace(-PR, PR, sample)
 	x, y = __np__.meshgrid(r,r)
-	rr = __np__.sqrt(x**2 + y**2)
-	OPD = __zernikecartesian__(coefficients,x,y)*2/PR
+	return __zernikecartesian__(coefficients,x,y)*2/PR
+
+def phase_shift_matrix(coefficients, lambda_1 = 632, PR = 1, type = '4-step', noise = 0, sample = 200, OPD = None):
+	"""
+	Same as phase_shift, return [I,PR,M,sample] without any figure,
+	OPD: the map of __phaseshiftopd__ if already computed
+	"""
+	lambda_1 = lambda_1*(10**-9)
+	r = __np__.linspace(-PR, PR, sample)
+	if OPD is None:
+		OPD = __phaseshiftopd__(coefficients.__coefficients__, PR, sample)
 	Ia = 1
 	Ib = 1
 	ph = 2 * __np__.pi * OPD
 
 	if type == "4-step":
-		__tools__.makecircle_boundary(OPD, r, PR, 0)
-		im = __plt__.imshow(OPD,extent=[-PR,PR,-PR,PR],cmap=__cm__.RdYlGn)
-		__plt__.colorbar()
-		__plt__.title('Surface figure',fontsize=16)
-		__plt__.show()
-
 		I1 = Ia + Ib + 2 * __np__.sqrt(Ia*Ib) * __np__.cos(ph)
 		I2 = Ia + Ib + 2 * __np__.sqrt(Ia*Ib) * __np__.cos(ph+90.0/180*__np__.pi)
 		I3 = Ia + Ib + 2 * __np__.sqrt(Ia*Ib) * __np__.cos(ph+180.0/180*__np__.pi)
@@ -235,16 +286,8 @@ def phase_shift(coefficients, lambda_1 = 632, PR = 1, type = '4-step', noise = 0
 		__tools__.makecircle_boundary(I3, r, PR, 0)
 		__tools__.makecircle_boundary(I4, r, PR, 0)
 		I = [I1,I2,I3,I4]
-		__tools__.phase_shift_figure(I,PR,type = "4-step")
 		M = __np__.ones([sample,sample])	 #map matrix, which is boundary
 		__tools__.makecircle_boundary(M, r, PR, 0)
-
-		# fig = __plt__.figure(figsize=(8, 6), dpi=80)
-		# im = __plt__.pcolormesh(M,cmap=__cm__.RdYlGn)
-		# __plt__.title('Phase value map',fontsize=16)
-		# __plt__.colorbar()
-		# __plt__.show()
-
 		return [I,PR,M,sample]
 	else:
 		print("No this type of PSI")
@@ -263,6 +306,8 @@ def rebuild_surface(data, shifttype = "4-step", unwraptype = "unwrap2D", noise =
 	--------------------------------------------
 	rebuild surface matrix
 	"""
+	import matplotlib.pyplot as __plt__
+	from matplotlib import cm as __cm__
 	if shifttype == "4-step" and unwraptype == "simple" and noise == False:
 		I = data[0]
 		PR = data[1]
@@ -273,6 +318,7 @@ def rebuild_surface(data, shifttype = "4-step", unwraptype = "unwrap2D", noise =
 		__plt__.colorbar()
 		__plt__.show()
 		#-----------------------Phase unwrap-------------------------
+		from .phaseunwrap import unwrap2D as __unwrap2D__
 		rebuild_ph = __unwrap2D__(ph,type = "simple")
 		rebuild_surface = rebuild_ph/2/__np__.pi*PR/2
 		#------------------------------------------------------------
@@ -297,6 +343,7 @@ def rebuild_surface(data, shifttype = "4-step", unwraptype = "unwrap2D", noise =
 		__plt__.show()
 		#-----------------------Phase unwrap-------------------------
 		ph1 = [ph,M,s]
+		from .phaseunwrap import unwrap2D as __unwrap2D__
 		rebuild_ph = __unwrap2D__(ph1,noise = True)
 		rebuild_surface = rebuild_ph/2/__np__.pi*PR/2
 		__tools__.makecircle_boundary(rebuild_surface, r, PR, 0)
@@ -1 +1,13 @@
-from . import lens, trace, glass_function, draw, analysis, field, codev
\ No newline at end of file
+import importlib as __importlib__
+
+# Submodules are imported on first use, plotting modules (draw, analysis)
+# and matplotlib are never loaded by ray tracing alone.
+__all__ = ['lens', 'trace', 'glass_function', 'draw', 'analysis', 'field', 'codev']
+
+def __getattr__(name):
+    if name in __all__:
+        return __importlib__.import_module('.' + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,120 @@
+from __future__ import division as __division__
+import warnings
+import numpy as __np__
+from . import field, first_order_tools
+
+# Real ray aiming
+# rays are launched so that they hit the stop surface at the normalized
+# pupil coordinates times the stop radius, instead of being aimed at the
+# paraxial entrance pupil. The launch points are found by Newton
+# iteration with a finite difference Jacobian, all rays at once.
+# Solutions are cached in Lens.aim_cache per pupil grid, then per field
+# and wavelength; they are reused as long as the lens and its EPD do not
+# change and are the starting point of the iteration when they do. Only
+# the AIM_CACHE_GRIDS grids used last are kept, so streaming many one-off
+# pupil chunks does not grow the cache. Fields and wavelengths with rays
+# that did not converge (or were lost) raise a RuntimeWarning and are
+# never cached.
+
+AIM_CACHE_GRIDS = 8
+
+def stop_number(Lens):
+    for S in Lens.surface_list:
+        if S.STO == True:
+            return S.number
+    raise Exception('ray aiming needs a stop surface (STO)')
+
+def stop_radius(Lens):
+    '''
+    stop semi-diameter, paraxial marginal ray height on the stop
+    '''
+    return abs(first_order_tools.marginal_ray_heights(Lens)[stop_number(Lens)-2])
+
+def aim_rays(Lens,grid_list,angles,wave_num,tol=1e-9,max_iter=20):
+    '''
+    launch rays hitting the stop at the normalized pupil grid
+    ==========================================================
+    input:
+    Lens: Lens instance
+    grid_list: (P,2) normalized pupil coordinates on the stop
+    angles: (F,2) field XAN, YAN, see field.field_angles
+    wave_num: wavelength number, or (W,1,1) wavelength numbers
+    tol: stop miss distance relative to the stop radius
+    max_iter: Newton iterations
+    output:
+    Pos, KLM (W,F,P,3) launch position and direction, the last Newton
+    iterate (possibly nan) for rays that did not converge
+    '''
+    grid = __np__.asarray(grid_list,dtype=float).reshape(-1,2)
+    angles = __np__.asarray(angles,dtype=float).reshape(-1,2)
+    waves = __np__.asarray(wave_num,dtype=int).reshape(-1)
+    shape = (len(waves),len(angles),len(grid))
+    Pos,KLM = field.grid2launch(Lens,grid,angles[:,1],angles[:,0])
+    Pos = __np__.array(__np__.broadcast_to(Pos,shape+(3,)))
+    KLM = __np__.broadcast_to(KLM,shape+(3,))
+
+    # the stop radius and the launch grid scale with the EPD
+    lens_key = (Lens._lens_key(),Lens.EPD)
+    grid_key = (grid.shape,grid.tobytes())
+    solutions = Lens.aim_cache.pop(grid_key,{})
+    Lens.aim_cache[grid_key] = solutions
+    while len(Lens.aim_cache) > AIM_CACHE_GRIDS:
+        Lens.aim_cache.popitem(last=False)
+    keys = [[(tuple(a),int(w)) for a in angles] for w in waves]
+    cached = True
+    for i,row in enumerate(keys):
+        for j,key in enumerate(row):
+            entry = solutions.get(key)
+            if entry is None:
+                cached = False
+                continue
+            # warm start from the last solution of this field and wavelength
+            Pos[i,j,:,:2] = entry[1]
+            cached = cached and entry[0] == lens_key
+    if cached:
+        return Pos,KLM
+
+    r_stop = stop_radius(Lens)
+    converged = aim_newton(Lens,Pos,KLM,waves.reshape(-1,1,1),grid*r_stop,tol*r_stop,max_iter)
+    if not converged.all():
+        warnings.warn('ray aiming did not converge for %d of %d rays, their fields are not cached'
+                      %(converged.size - converged.sum(),converged.size),RuntimeWarning,stacklevel=3)
+    for i,row in enumerate(keys):
+        for j,key in enumerate(row):
+            if converged[i,j].all():
+                solutions[key] = (lens_key,Pos[i,j,:,:2].copy())
+    return Pos,KLM
+
+def aim_newton(Lens,Pos,KLM,wave_num,target,tol,max_iter):
+    '''
+    Newton iteration on the launch x,y in Pos (updated in place) until
+    the rays hit the stop at target (P,2)
+    return the (...) mask of the rays within tol of their target
+    '''
+    from . import trace
+    surface_num = stop_number(Lens)
+    # base rays, x step and y step traced together
+    h = 1e-6*max(Lens.EPD,1e-3)
+    batch = Pos.shape[:-1]
+    Pos3 = __np__.empty((3,)+Pos.shape)
+    KLM3 = __np__.broadcast_to(KLM,(3,)+Pos.shape)
+    Pos_out = __np__.empty((3,)+Pos.shape)
+    KLM_out = __np__.empty((3,)+Pos.shape)
+    work = trace.TraceWorkspace((3,)+batch)
+    for n in range(max_iter+1):
+        Pos3[:] = Pos
+        Pos3[1,...,0] += h
+        Pos3[2,...,1] += h
+        trace.trace_image(Lens,Pos3,KLM3,wave_num,Pos_out,KLM_out,work,surface_num)
+        F = Pos_out[0,...,:2] - target
+        # nan (lost rays) is not converged
+        converged = (__np__.abs(F) <= tol).all(axis=-1)
+        if n == max_iter or not __np__.nanmax(__np__.abs(F),initial=0) > tol:
+            break
+        # Jacobian [[a,b],[c,d]] of the stop x,y against the launch x,y
+        a,c = (Pos_out[1,...,0] - Pos_out[0,...,0])/h,(Pos_out[1,...,1] - Pos_out[0,...,1])/h
+        b,d = (Pos_out[2,...,0] - Pos_out[0,...,0])/h,(Pos_out[2,...,1] - Pos_out[0,...,1])/h
+        det = a*d - b*c
+        Pos[...,0] -= (d*F[...,0] - b*F[...,1])/det
+        Pos[...,1] -= (a*F[...,1] - c*F[...,0])/det
+    return converged
@@ -2,8 +2,8 @@ from __future__ import division as __division__
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.patches import Circle
-from . import cal_tools,trace, wavelength
-# All analysis functions
+from . import cal_tools, wavelength
+# All analysis plotting functions, the numbers come from cal_tools
 
 def spotdiagram(Lens, field_plot=None, wave_plot=None, surface_plot=-1, n=12, grid_type='grid', wl_colors=True):
     '''
@@ -17,7 +17,7 @@ def spotdiagram(Lens, field_plot=None, wave_plot=None, surface_plot=-1, n=12, gr
         field_plot = list(range(1, len(Lens.field_angle_list)+1))
     if wave_plot is None: # plot all wavelengths
         wave_plot = list(range(1, len(Lens.wavelength_list)+1))
-    trace.trace_spotdiagram(Lens,n,grid_type)
+    spot = cal_tools.spot_diagram(Lens,n,grid_type,surface_plot)
     field_plot_length = len(field_plot)
     wavelengths = [Lens.wavelength_list[j-1] for j in wave_plot]
 
@@ -40,7 +40,7 @@ def spotdiagram(Lens, field_plot=None, wave_plot=None, surface_plot=-1, n=12, gr
         for m, wave_num in enumerate(wave_plot):
             ax_kwargs = dict(marker=marker_list[m], color=c_list[m])
             fig, ax, wl_label = plot_spotdiagram_field_wave(Lens,field_num,wave_num, surface_num=surface_plot,
-                                        ax=ax, annotate=False, **ax_kwargs)
+                                        ax=ax, annotate=False, spot=spot, **ax_kwargs)
             label2.append(wl_label)
 
 
@@ -58,31 +58,29 @@ def spotdiagram(Lens, field_plot=None, wave_plot=None, surface_plot=-1, n=12, gr
 def spotdiamgram_field_wave(Lens,field_num,wave_num, surface_num=-1):
     if surface_num == -1:
         surface_num = len(Lens.surface_list)
-    all_field_ray_dict_list = Lens.field_trace_info
-    rays_dict = all_field_ray_dict_list[wave_num-1][field_num-1]
-    xy_list = []
-    for ray_dict in rays_dict:
-        xy_list.append([ray_dict['X'][surface_num-1],ray_dict['Y'][surface_num-1]])
-    xy_list = np.asarray(xy_list)
-    xy_list = np.transpose(xy_list)
-    return xy_list
+    ray_bundle = Lens.field_trace_info.wave(wave_num).field(field_num)
+    return ray_bundle.xy(surface_num)
 
-def plot_spotdiagram_field_wave(Lens,field_num,wave_num, surface_num=-1, ax=None, annotate=True, **kwargs):
+def plot_spotdiagram_field_wave(Lens,field_num,wave_num, surface_num=-1, ax=None, annotate=True, spot=None, **kwargs):
+    '''
+    spot: cal_tools.SpotDiagram, default computed from Lens.field_trace_info
+    '''
+    if spot is None:
+        spot = cal_tools.SpotDiagram(Lens, Lens.field_trace_info, surface_num)
     if ax is None:
         fig, ax = plt.subplots(1, 1, figsize=(5, 5), dpi=80,)
     else:
         fig = ax.figure
-    xy_list = spotdiamgram_field_wave(Lens,field_num,wave_num, surface_num=surface_num)
+    xy_list = spot.xy(field_num,wave_num)
     wl = Lens.wavelength_list[wave_num-1]
     ax_kwargs = dict(ls='', marker='o', color=None, mfc='none', label='{:.2f}'.format(wl))
     ax_kwargs.update(kwargs)
     ax.plot(xy_list[0],xy_list[1], **ax_kwargs)
-    airy = 1.22 * wl*1e-6 * Lens.FNO
-    rms = cal_tools.rms(xy_list)
-    r = np.hypot(*xy_list)
-    frac_inside = np.count_nonzero(r <= airy)/len(r)
-    # c = Circle((xy_list[0].mean(), xy_list[1].mean()), radius=airy, ec=ax_kwargs['color'], fc='none', lw=2)
-    c = Circle((xy_list[0].mean(), xy_list[1].mean()), radius=airy, color=ax_kwargs['color'], alpha=0.4, lw=2)
+    airy = spot.airy[wave_num-1]
+    rms = spot.rms[wave_num-1,field_num-1]
+    frac_inside = spot.frac_inside[wave_num-1,field_num-1]
+    # c = Circle(spot.centroid[wave_num-1,field_num-1], radius=airy, ec=ax_kwargs['color'], fc='none', lw=2)
+    c = Circle(spot.centroid[wave_num-1,field_num-1], radius=airy, color=ax_kwargs['color'], alpha=0.4, lw=2)
     ax.add_patch(c)
     ax.set_aspect('equal', 'datalim')
     L = max(ax.get_xlim()[1], 1.1*airy)
@@ -100,8 +98,7 @@ def Ray_fan(Lens,field_plot,wave_plot):
     '''
     Plot ray fan
     '''
-    trace.trace_Y_fan(Lens)
-    trace.trace_X_fan(Lens)
+    fan = cal_tools.ray_fan(Lens)
     field_plot_length = len(field_plot)
     wave_plot_length = len(wave_plot)
     c_list = ['b','g','r','c','m','y','k','w']
@@ -109,24 +106,22 @@ def Ray_fan(Lens,field_plot,wave_plot):
     fig.canvas.set_window_title('Ray aberration')
     fig.suptitle("Ray aberration: "+Lens.lens_name, fontsize="x-large")
     m = 0
-    Py = np.linspace(-1,1,25)
-    Px = np.linspace(0,1,20)
+    Py = fan.Py
+    Px = fan.Px
     max_E = 0
     for wave_num in wave_plot:
         n = field_plot_length
         for field_num in field_plot:
             #plot y fan
             plt.subplot(field_plot_length, 2, n*2-1)
-            xy_list = Y_fan_field_wave(Lens,field_num,wave_num)
-            Ey = xy_list[1]-xy_list[1][12]
+            Ey = fan.Ey[wave_num-1,field_num-1]
             plt.plot(Py,Ey,c=c_list[m])
             max_tmp = max(abs(Ey))
             if max_tmp > max_E:
                 max_E = max_tmp
             #plot x fan
             plt.subplot(field_plot_length, 2, n*2)
-            xy_list = X_fan_field_wave(Lens,field_num,wave_num)
-            Ex = xy_list[0]-xy_list[0][0]
+            Ex = fan.Ex[wave_num-1,field_num-1]
             max_tmp = max(abs(Ex))
             if max_tmp > max_E:
                 max_E = max_tmp
@@ -164,13 +159,37 @@ def Ray_fan(Lens,field_plot,wave_plot):
 
         n = n - 1
     plt.show()
-    return 0
+    return fig
+
+def mtf(Lens, field_plot=None, frequency=None, n=64, wave_weights=None, defocus=0):
+    '''
+    Plot polychromatic diffraction MTF, tangential solid, sagittal dashed
+    input:
+    Lens: Lens Class
+    field_plot: list [1,2,3]
+    frequency: spatial frequencies in cycles/mm, default up to the cutoff
+    '''
+    if field_plot is None: # plot all fields
+        field_plot = list(range(1, len(Lens.field_angle_list)+1))
+    result = cal_tools.diffraction_mtf(Lens, frequency, n, wave_weights, defocus=defocus)
+    fig, ax = plt.subplots(figsize=(8, 6), dpi=80)
+    title = '%s diffraction MTF'%Lens.lens_name
+    fig.suptitle(title, fontsize="x-large")
+    for m, field_num in enumerate(field_plot):
+        c = 'C%d'%m
+        ax.plot(result.frequency, result.tan[field_num-1], c=c, label='Field %d T'%field_num)
+        ax.plot(result.frequency, result.sag[field_num-1], c=c, ls='--', label='Field %d S'%field_num)
+    ax.set_xlabel('Spatial frequency (cycles/mm)')
+    ax.set_ylabel('Modulation')
+    ax.set_ylim([0, 1.05])
+    ax.legend(loc='upper right')
+    return fig, ax
 
 def Y_fan(Lens,field_plot,wave_plot):
     '''
     Tangential fan,plot Ey vs Py
     '''
-    trace.trace_Y_fan(Lens)
+    fan = cal_tools.ray_fan(Lens,X=False)
     field_plot_length = len(field_plot)
     wave_plot_length = len(wave_plot)
 
@@ -180,16 +199,14 @@ def Y_fan(Lens,field_plot,wave_plot):
     fig.suptitle("Ray aberration", fontsize="x-large")
 
     m = 0
-    Py = np.linspace(-1,1,25)
+    Py = fan.Py
     max_Ey = 0
     for wave_num in wave_plot:
         n = field_plot_length
         for field_num in field_plot:
             plt.subplot(field_plot_length, 1, n)
-            xy_list = Y_fan_field_wave(Lens,field_num,wave_num)
-            Ey = xy_list[1]-xy_list[1][12]
+            Ey = fan.Ey[wave_num-1,field_num-1]
             plt.plot(Py,Ey,c=c_list[m])
-            #xy_list[1][12] is the Ey generate by Py=0
             max_tmp = max(abs(Ey))
             if max_tmp > max_Ey:
                 max_Ey = max_tmp
@@ -208,25 +225,18 @@ def Y_fan(Lens,field_plot,wave_plot):
         n = n - 1
 
     plt.show()
-    return 0
+    return fig
 
 def Y_fan_field_wave(Lens,field_num,wave_num):
-    all_Y_fan_ray_dict_list = Lens.Y_fan_info
-    n = len(Lens.surface_list)-1
-    rays_dict = all_Y_fan_ray_dict_list[wave_num-1][field_num-1]
-    xy_list = []
-    for ray_dict in rays_dict:
-        xy_list.append([ray_dict['X'][n],ray_dict['Y'][n]])
-    xy_list = np.asarray(xy_list)
-    xy_list = np.transpose(xy_list)
-    return xy_list
+    ray_bundle = Lens.Y_fan_info.wave(wave_num).field(field_num)
+    return ray_bundle.xy(-1)
 
 
 def X_fan(Lens,field_plot,wave_plot):
     '''
     Sagittal fan,plot Ex vs Px
     '''
-    trace.trace_X_fan(Lens)
+    fan = cal_tools.ray_fan(Lens,Y=False)
     field_plot_length = len(field_plot)
     wave_plot_length = len(wave_plot)
 
@@ -235,19 +245,17 @@ def X_fan(Lens,field_plot,wave_plot):
     fig.canvas.set_window_title('Ray aberration')
     fig.suptitle("Ray aberration", fontsize="x-large")
     m = 0
-    Px = np.linspace(0,1,20)
+    Px = fan.Px
     max_Ex = 0
     for wave_num in wave_plot:
         n = field_plot_length
         for field_num in field_plot:
             plt.subplot(field_plot_length, 1, n)
-            xy_list = X_fan_field_wave(Lens,field_num,wave_num)
-            Ex = xy_list[0]-xy_list[0][0]
+            Ex = fan.Ex[wave_num-1,field_num-1]
             max_tmp = max(abs(Ex))
             if max_tmp > max_Ex:
                 max_Ex = max_tmp
             plt.plot(Px,Ex,c=c_list[m])
-            #xy_list[0][0] is the Ex generate by Px=0
             n = n - 1
         m = m + 1
 
@@ -262,15 +270,8 @@ def X_fan(Lens,field_plot,wave_plot):
         plt.plot([0,0],[-max_Ex,max_Ex],c='k')
         n = n - 1
     plt.show()
-    return 0
+    return fig
 
 def X_fan_field_wave(Lens,field_num,wave_num):
-    all_X_fan_ray_dict_list = Lens.X_fan_info
-    n = len(Lens.surface_list)-1
-    rays_dict = all_X_fan_ray_dict_list[wave_num-1][field_num-1]
-    xy_list = []
-    for ray_dict in rays_dict:
-        xy_list.append([ray_dict['X'][n],ray_dict['Y'][n]])
-    xy_list = np.asarray(xy_list)
-    xy_list = np.transpose(xy_list)
-    return xy_list
+    ray_bundle = Lens.X_fan_info.wave(wave_num).field(field_num)
+    return ray_bundle.xy(-1)
@@ -1,12 +1,450 @@
 # calculation tools
 from __future__ import division as __division__
 import numpy as np
+from . import trace, pupil, opd
 
 # spot diagram rms calculator
 
 def rms(xy_list):
-	x = xy_list[0] - np.mean(xy_list[0])
-	y = xy_list[1] - np.mean(xy_list[1])
-	# rms = np.sqrt(sum(x**2+y**2)/len(xy_list))
-	rms = np.hypot(x, y).mean()
-	return rms
+	'''
+	root mean square spot radius around the centroid, the same as the
+	streaming RMSRadius
+	xy_list: (2,...,N) spot x,y, statistics over the last axis,
+	lost rays (nan) are left out
+	Earlier versions returned the mean radius around the centroid, which
+	is smaller: R/sqrt(2) instead of 2R/3 for a uniform disk of radius R.
+	'''
+	return RMSRadius().update(np.asarray(xy_list, dtype=float)).result()
+
+# headless analysis results, analysis.py plots them
+
+class SpotDiagram(object):
+	'''
+	spot diagram of all fields and wavelengths on one surface
+	------------------------------------
+	x, y: (W,F,N) ray position, wavelength and field axes in Lens order
+	centroid: (W,F,2)
+	rms: (W,F) spot size, see rms()
+	airy: (W,) Airy radius 1.22*lambda*FNO
+	frac_inside: (W,F) fraction of rays within the Airy radius
+	transmission: (W,F) fraction of rays not vignetted, the statistics
+	              above are over these rays only
+	'''
+	def __init__(self, Lens, ray_bundle, surface_num=-1):
+		xy = ray_bundle.xy(surface_num)
+		self.wavelength_list = list(Lens.wavelength_list)
+		self.field_angle_list = list(Lens.field_angle_list)
+		self.x = xy[0]
+		self.y = xy[1]
+		self.centroid = np.stack([np.nanmean(self.x, axis=-1), np.nanmean(self.y, axis=-1)], axis=-1)
+		self.rms = rms(xy)
+		self.airy = 1.22 * np.asarray(self.wavelength_list)*1e-6 * Lens.FNO
+		self.transmission = ray_bundle.transmission()
+		self.frac_inside = FractionWithin(self.airy[:,None]).update(xy).result()/self.transmission
+
+	def xy(self, field_num, wave_num):
+		return np.asarray([self.x[wave_num-1,field_num-1], self.y[wave_num-1,field_num-1]])
+
+def spot_diagram(Lens, n=12, grid_type='grid', surface_num=-1, backend='serial', n_workers=None):
+	'''
+	trace all fields and wavelengths, return SpotDiagram
+	only surface_num is kept, memory does not grow with the number of surfaces
+	'''
+	ray_bundle = trace.trace_spotdiagram(Lens,n,grid_type,backend=backend,n_workers=n_workers,
+	                                     surface_num=surface_num)
+	return SpotDiagram(Lens, ray_bundle, surface_num)
+
+class RayFan(object):
+	'''
+	tangential and sagittal ray aberration fans of all fields and wavelengths
+	------------------------------------
+	Py: (nY,) normalized pupil y, Ey: (W,F,nY) y error to the chief ray
+	Px: (nX,) normalized pupil x, Ex: (W,F,nX) x error to the chief ray
+	'''
+	def __init__(self, Y_fan_bundle=None, X_fan_bundle=None):
+		if Y_fan_bundle is not None:
+			y = Y_fan_bundle.xy(-1)[1]
+			self.Py = np.linspace(-1,1,y.shape[-1])
+			# the middle ray is Py = 0
+			self.Ey = y - y[...,y.shape[-1]//2,None]
+		if X_fan_bundle is not None:
+			x = X_fan_bundle.xy(-1)[0]
+			self.Px = np.linspace(0,1,x.shape[-1])
+			# the first ray is Px = 0
+			self.Ex = x - x[...,0,None]
+
+def ray_fan(Lens, n_Y=25, n_X=20, Y=True, X=True, backend='serial', n_workers=None):
+	'''
+	trace ray fans of all fields and wavelengths, return RayFan
+	'''
+	Y_fan_bundle = trace.trace_Y_fan(Lens,n_Y,backend=backend,n_workers=n_workers) if Y else None
+	X_fan_bundle = trace.trace_X_fan(Lens,n_X,backend=backend,n_workers=n_workers) if X else None
+	return RayFan(Y_fan_bundle, X_fan_bundle)
+
+class PupilQuadrature(object):
+	'''
+	pupil averaged spot and wavefront by Gaussian quadrature
+	------------------------------------
+	The pupil is sampled with Forbes rings x arms (pupil.gauss) plus the
+	chief ray, a few dozen rays per field and wavelength integrate smooth
+	aberrations to machine precision where a square grid needs thousands.
+	Buffers are allocated once, evaluate() can be called again after the
+	lens changed, e.g. inside a merit function.
+	------------------------------------
+	grid: (P,2) quadrature points, weights: (P,)
+	centroid: (W,F,2) weighted spot centroid
+	rms_spot: (W,F) root mean square spot radius around the centroid
+	rms_wavefront: (W,F) RMS wavefront error in waves, piston removed
+	transmission: (W,F) pupil weighted fraction of rays not vignetted,
+	              the averages above are over these rays only
+	'''
+	def __init__(self, Lens, n_rings=3, n_arms=None, wave_list=None, field_list=None):
+		if wave_list is None:
+			wave_list = range(1, len(Lens.wavelength_list)+1)
+		if field_list is None:
+			field_list = range(1, len(Lens.field_angle_list)+1)
+		self.Lens = Lens
+		self.grid, self.weights = pupil.gauss(n_rings, n_arms)
+		self.wave_num = np.asarray(wave_list, dtype=int).reshape(-1,1,1)
+		self.field_list = list(field_list)
+		# wavelength in lens units (mm)
+		self.wavelength = np.asarray([Lens.wavelength_list[w-1] for w in wave_list])[:,None,None]*1e-6
+		# chief ray first, then the quadrature points
+		shape = (len(self.wave_num), len(self.field_list), len(self.grid)+1)
+		self.Pos = np.empty(shape+(3,))
+		self.KLM = np.empty(shape+(3,))
+		self.OPL = np.empty(shape)
+		self.valid = np.empty(shape, dtype=bool)
+		self.work = trace.TraceWorkspace(shape)
+
+	def evaluate(self):
+		'''
+		trace the quadrature rays and update centroid, rms_spot and rms_wavefront
+		'''
+		Lens = self.Lens
+		Pos, KLM = trace.launch_rays(Lens, np.concatenate([[[0,0]], self.grid]), self.field_list, self.wave_num)
+		trace.trace_image(Lens, Pos, KLM, self.wave_num, self.Pos, self.KLM, self.work,
+		                  OPL_out=self.OPL, valid_out=self.valid)
+		valid = self.valid[...,1:]
+		w = self.weights
+		if not valid.all():
+			# vignetted rays get weight 0, the others are scaled up
+			w = np.where(valid, w, 0)
+			w = w/np.maximum(w.sum(axis=-1, keepdims=True), 1e-300)
+		self.transmission = np.where(valid, self.weights, 0).sum(axis=-1)
+		xy = np.where(valid[...,None], self.Pos[...,1:,:2], 0)
+		self.centroid = np.einsum('...pi,...p->...i', xy, np.broadcast_to(w, valid.shape))
+		d = xy - self.centroid[...,None,:]
+		self.rms_spot = np.sqrt(np.einsum('...pi,...pi,...p->...', d, d, np.broadcast_to(w, valid.shape)))
+		W = np.where(valid, self.wavefront(), 0)
+		W = W - (W*w).sum(axis=-1, keepdims=True)
+		self.rms_wavefront = np.sqrt((W**2*w).sum(axis=-1))
+		return self
+
+	def wavefront(self):
+		'''
+		(W,F,P) wavefront error in waves of the quadrature points,
+		OPL of the chief ray minus OPL of the ray, both measured to the
+		reference sphere centered on the chief ray image point through
+		the center of the exit pupil
+		'''
+		n = np.asarray(self.Lens.surface_list[-2].indexlist)[self.wave_num-1]
+		OPL = opd.reference_opl(self.Lens, self.Pos, self.KLM, self.OPL, n, self.Pos[...,:1,:])
+		return (OPL[...,:1] - OPL[...,1:])/self.wavelength
+
+def pupil_quadrature(Lens, n_rings=3, n_arms=None):
+	'''
+	RMS spot, centroid and RMS wavefront of all fields and wavelengths
+	from Gaussian pupil quadrature, return PupilQuadrature
+	'''
+	return PupilQuadrature(Lens, n_rings, n_arms).evaluate()
+
+class DiffractionMTF(object):
+	'''
+	diffraction MTF of every field from the traced OPD
+	------------------------------------
+	The OTF is the autocorrelation of the pupil function exp(2*pi*i*W),
+	computed as the transform of the PSF: fft2 of the zero padded pupil,
+	squared modulus, then a real to complex rfft2. A shift of one grid
+	point is cutoff/n cycles/mm, the OTF is interpolated
+	at the requested frequencies, the complex OTFs of the wavelengths are
+	summed with their weights for the polychromatic MTF.
+	------------------------------------
+	frequency: (K,) spatial frequency in cycles/mm
+	tan, sag: (F,K) polychromatic MTF, tangential (y) and sagittal (x)
+	tan_wave, sag_wave: (W,F,K) MTF of every wavelength
+	cutoff: (W,F,2) x, y cutoff frequency in cycles/mm
+	pad: PSF size over pupil size, at least 2 so that the OTF up to the
+	     cutoff does not wrap around
+	'''
+	def __init__(self, opd_map, frequency=None, wave_weights=None, pad=2):
+		if pad < 2:
+			raise ValueError('DiffractionMTF needs pad >= 2, got %s' % pad)
+		self.opd_map = opd_map
+		self.cutoff = opd_map.cutoff()
+		if frequency is None:
+			frequency = np.linspace(0, self.cutoff.max(), 61)
+		self.frequency = np.asarray(frequency, dtype=float)
+		if wave_weights is None:
+			wave_weights = np.ones(len(opd_map.wave_list))
+		wave_weights = np.asarray(wave_weights, dtype=float)/np.sum(wave_weights)
+		from .. import fft_tools
+		n = opd_map.n
+		otf = fft_tools.rfft2(opd_map.psf(pad, centered=False)[0])
+		otf /= otf[...,:1,:1]
+		# shifts along y (tangential) and x (sagittal), up to the cutoff
+		k = self.frequency/(self.cutoff/n)[...,None]
+		otf_tan = _interp_shift(otf[...,:n+1,0], k[...,1,:])
+		otf_sag = _interp_shift(otf[...,0,:n+1], k[...,0,:])
+		self.tan_wave = np.abs(otf_tan)
+		self.sag_wave = np.abs(otf_sag)
+		self.tan = np.abs(np.einsum('w,wfk->fk', wave_weights, otf_tan))
+		self.sag = np.abs(np.einsum('w,wfk->fk', wave_weights, otf_sag))
+
+def _interp_shift(line, k):
+	'''
+	linear interpolation of line (...,n+1) at fractional indices k (...,K),
+	0 beyond the last point
+	'''
+	n = line.shape[-1] - 1
+	i = np.clip(np.floor(k).astype(int), 0, n-1)
+	t = k - i
+	value = np.take_along_axis(line, i, -1)*(1-t) + np.take_along_axis(line, i+1, -1)*t
+	return np.where((k >= 0) & (k <= n), value, 0)
+
+def diffraction_mtf(Lens, frequency=None, n=64, wave_weights=None, pad=2, defocus=0):
+	'''
+	trace the OPD of an n x n pupil grid for all fields and wavelengths,
+	return DiffractionMTF at frequency (cycles/mm)
+	'''
+	return DiffractionMTF(opd.trace_opd(Lens, n, defocus=defocus), frequency, wave_weights, pad)
+
+# online reducers for trace.trace_stream
+# update(xy) takes one traced chunk, xy (2,...,N), statistics are kept
+# separately for the leading axes (e.g. wavelength, field) over the
+# ray axis N, so the rays themselves are never stored.
+# merge(other) adds the rays seen by another reducer of the same kind,
+# e.g. one per worker process, update and merge return the reducer.
+
+class Welford(object):
+	'''
+	running mean and variance of x and y (Welford / Chan et al.)
+	------------------------------------
+	n: number of rays, (...) when rays were lost
+	mean: (2,...) mean x, y
+	M2: (2,...) sum of squared deviations from the mean
+	'''
+	def __init__(self):
+		self.n = 0
+		self.mean = 0
+		self.M2 = 0
+
+	def update(self, xy):
+		ok = np.isfinite(xy).all(axis=0)
+		if ok.all():
+			mean = xy.mean(axis=-1)
+			M2 = ((xy - mean[...,None])**2).sum(axis=-1)
+			return self._combine(xy.shape[-1], mean, M2)
+		# lost rays (nan) are left out, n differs between spots
+		n = ok.sum(axis=-1)
+		mean = np.where(ok, xy, 0).sum(axis=-1)/np.maximum(n, 1)
+		M2 = np.where(ok, (xy - mean[...,None])**2, 0).sum(axis=-1)
+		return self._combine(n, mean, M2)
+
+	def merge(self, other):
+		return self._combine(other.n, other.mean, other.M2)
+
+	def _combine(self, n, mean, M2):
+		if np.all(n == 0):
+			return self
+		if np.all(self.n == 0):
+			self.n, self.mean, self.M2 = n, mean, M2
+			return self
+		total = self.n + n
+		delta = mean - self.mean
+		self.mean = self.mean + delta*n/np.maximum(total, 1)
+		self.M2 = self.M2 + M2 + delta**2*self.n*n/np.maximum(total, 1)
+		self.n = total
+		return self
+
+	def variance(self):
+		return self.M2/self.n
+
+class Centroid(Welford):
+	'''
+	result: (...,2) spot centroid
+	'''
+	def result(self):
+		return np.moveaxis(self.mean, 0, -1)
+
+class RMSRadius(Welford):
+	'''
+	result: (...) root mean square spot radius around the centroid,
+	rms() and SpotDiagram.rms for rays streamed in chunks
+	'''
+	def result(self):
+		return np.sqrt(self.variance().sum(axis=0))
+
+def _radius(xy, center):
+	if center is None:
+		return np.hypot(xy[0], xy[1])
+	return np.hypot(xy[0] - center[0][...,None], xy[1] - center[1][...,None])
+
+def _check_center(a, b):
+	if not np.array_equal(a.center, b.center):
+		raise Exception('cannot merge reducers with different centers')
+
+class MaxRadius(object):
+	'''
+	result: (...) largest distance of a ray from center
+	center: (2,...) fixed center, default the origin
+	'''
+	def __init__(self, center=None):
+		self.center = None if center is None else np.asarray(center, dtype=float)
+		self.max = -np.inf
+
+	def update(self, xy):
+		# fmax leaves the lost rays (nan) out
+		self.max = np.fmax(self.max, np.fmax.reduce(_radius(xy, self.center), axis=-1))
+		return self
+
+	def merge(self, other):
+		_check_center(self, other)
+		self.max = np.fmax(self.max, other.max)
+		return self
+
+	def result(self):
+		return self.max
+
+class FractionWithin(object):
+	'''
+	result: (...) fraction of rays within radius of center
+	radius: circle radius, broadcasting against the leading axes,
+	        e.g. the Airy radius of every wavelength airy[:,None]
+	center: (2,...) fixed center, default the origin
+	'''
+	def __init__(self, radius, center=None):
+		self.radius = np.asarray(radius, dtype=float)
+		self.center = None if center is None else np.asarray(center, dtype=float)
+		self.n = 0
+		self.count = 0
+
+	def update(self, xy):
+		r = _radius(xy, self.center)
+		self.count = self.count + np.count_nonzero(r <= self.radius[...,None], axis=-1)
+		self.n += r.shape[-1]
+		return self
+
+	def merge(self, other):
+		_check_center(self, other)
+		self.count = self.count + other.count
+		self.n += other.n
+		return self
+
+	def result(self):
+		return self.count/self.n
+
+class EncircledEnergy(object):
+	'''
+	fraction of rays inside a circle around center
+	------------------------------------
+	r_max: largest radius of the histogram
+	n_bins: number of radius bins
+	center: (2,...) circle center, required so that every chunk and
+	        worker bins around the same point, e.g. the Centroid result
+	        of a first pass moved to the front axis
+	result: radius (n_bins,), fraction (...,n_bins) of rays within radius
+	'''
+	def __init__(self, r_max, n_bins=100, center=None):
+		if center is None:
+			raise Exception('EncircledEnergy needs a center, e.g. the centroid of a first pass')
+		self.edges = np.linspace(0, r_max, n_bins+1)
+		self.center = np.asarray(center, dtype=float)
+		self.n = 0
+		self.counts = 0
+
+	def update(self, xy):
+		r = _radius(xy, self.center)
+		n_bins = len(self.edges) - 1
+		# rays beyond r_max only count in the total
+		i = np.minimum(np.searchsorted(self.edges, r, side='left') - 1, n_bins)
+		i = np.maximum(i, 0)
+		lead = np.arange(int(np.prod(r.shape[:-1]))).reshape(r.shape[:-1]+(1,))
+		counts = np.bincount((lead*(n_bins+1) + i).ravel(), minlength=lead.size*(n_bins+1))
+		self.counts = self.counts + counts.reshape(r.shape[:-1]+(n_bins+1,))
+		self.n += r.shape[-1]
+		return self
+
+	def merge(self, other):
+		_check_center(self, other)
+		if not np.array_equal(self.edges, other.edges):
+			raise Exception('cannot merge encircled energy with different bins')
+		self.counts = self.counts + other.counts
+		self.n += other.n
+		return self
+
+	def result(self):
+		return self.edges[1:], np.cumsum(self.counts[...,:-1], axis=-1)/self.n
+
+class Irradiance(object):
+	'''
+	ray density binned on the image plane
+	------------------------------------
+	extent: (xmin, xmax, ymin, ymax)
+	bins: (nx, ny) number of pixels
+	result: (...,ny,nx) fraction of rays per unit area, x edges, y edges
+	'''
+	def __init__(self, extent, bins=(64, 64)):
+		xmin, xmax, ymin, ymax = extent
+		self.x_edges = np.linspace(xmin, xmax, bins[0]+1)
+		self.y_edges = np.linspace(ymin, ymax, bins[1]+1)
+		self.n = 0
+		self.counts = 0
+
+	def update(self, xy):
+		nx, ny = len(self.x_edges) - 1, len(self.y_edges) - 1
+		ix = np.searchsorted(self.x_edges, xy[0], side='right') - 1
+		iy = np.searchsorted(self.y_edges, xy[1], side='right') - 1
+		inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+		lead = np.broadcast_to(np.arange(int(np.prod(xy.shape[1:-1]))).reshape(xy.shape[1:-1]+(1,)), inside.shape)
+		pixel = (lead*ny + iy)*nx + ix
+		counts = np.bincount(pixel[inside], minlength=int(np.prod(xy.shape[1:-1]))*nx*ny)
+		self.counts = self.counts + counts.reshape(xy.shape[1:-1]+(ny, nx))
+		self.n += xy.shape[-1]
+		return self
+
+	def merge(self, other):
+		if not (np.array_equal(self.x_edges, other.x_edges) and np.array_equal(self.y_edges, other.y_edges)):
+			raise Exception('cannot merge irradiance maps with different pixels')
+		self.counts = self.counts + other.counts
+		self.n += other.n
+		return self
+
+	def result(self):
+		area = np.diff(self.x_edges)[None,:]*np.diff(self.y_edges)[:,None]
+		return self.counts/self.n/area, self.x_edges, self.y_edges
+
+def reduce_stream(stream, reducers):
+	'''
+	feed every chunk (Pos, KLM) of trace.trace_stream to the reducers
+	return the reducers
+	Lost rays are nan, Centroid, RMSRadius and MaxRadius leave them
+	out, the ray counts of FractionWithin, EncircledEnergy and Irradiance
+	include them, so those give the energy relative to the launched rays.
+	'''
+	for Pos, KLM in stream:
+		xy = np.moveaxis(Pos[...,:2], -1, 0)
+		for reducer in reducers:
+			reducer.update(xy)
+	return reducers
+
+def merge_reducers(reducers_list):
+	'''
+	merge lists of reducers, e.g. one list per worker, in order
+	return the merged list (the first list, updated)
+	'''
+	merged = reducers_list[0]
+	for reducers in reducers_list[1:]:
+		for reducer, other in zip(merged, reducers):
+			reducer.merge(other)
+	return merged
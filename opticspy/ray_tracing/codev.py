@@ -1,3 +1,4 @@
+import numpy as np
 from . import lens
 '''
 CodeV seq file convertor
@@ -17,6 +18,7 @@ def readseq(filename,output=False):
     file = open(filename)
     lines = []
     surface_data = []
+    apertures = {}
     lens_dict = {'Name':'','EPD': 0, 'XAN': [], 'YAN': [], 'Surface':[], 'WL':[],'FNO':0,'NA':0}
     while 1:
         line = file.readline()
@@ -41,6 +43,9 @@ def readseq(filename,output=False):
             surface_data.append(line)
         elif line[0] == 'STO':
             surface_data[-1].append('STO')
+        # circular clear aperture of the last surface
+        elif line[0] == 'CIR' and len(line) == 2:
+            apertures[len(surface_data)] = float(line[1].rstrip(';'))
     lens_dict['Surface'] = surface_data
     file.close()
     # Generate Lens class
@@ -48,8 +53,13 @@ def readseq(filename,output=False):
 
     for w in lens_dict['WL']:
         New_Lens.add_wavelength(wl = w)
-    for f in lens_dict['YAN']:
-        New_Lens.add_field_YAN(angle = f)
+    # XAN pairs with YAN field by field, missing XAN are 0
+    xan = list(lens_dict['XAN']) + [0]*(len(lens_dict['YAN']) - len(lens_dict['XAN']))
+    for x,f in zip(xan,lens_dict['YAN']):
+        if x == 0:
+            New_Lens.add_field_YAN(angle = f)
+        else:
+            New_Lens.add_field_XAN_YAN(xangle = x, yangle = f)
     n = 0
     for s in lens_dict['Surface']:
         n = n + 1
@@ -67,4 +77,45 @@ def readseq(filename,output=False):
         else:
             STOP = False
         New_Lens.add_surface(number=n,radius=r,thickness=t,glass=g,STO=STOP,output=output)
+        if n in apertures:
+            New_Lens.set_aperture(n,apertures[n])
     return New_Lens
+
+
+def readmtf(filename):
+    '''
+    read a CodeV diffraction MTF output (MTF.txt) for comparison
+    return dict with
+    frequency: (K,) spatial frequency in cycles/mm
+    limit: (F,K) diffraction limited MTF
+    rad, tan: (F,K) radial (sagittal) and tangential MTF
+    wave_weights: wavelength weights of the polychromatic MTF
+    '''
+    file = open(filename)
+    text = file.read()
+    file.close()
+    weights = []
+    for line in text.split('DIFFRACTION LIMIT')[0].splitlines():
+        a = line.split()
+        if 'NM' in a:
+            weights.append(float(a[a.index('NM')+1]))
+    mtf = {'frequency':[],'limit':[],'rad':[],'tan':[]}
+    for block in text.split('DIFFRACTION LIMIT')[1:]:
+        rows = []
+        for line in block.splitlines():
+            a = line.split()
+            if len(a) in [4,6] and a[0].isdigit() and a[1].startswith('.'):
+                rows.append([float(i) for i in a])
+            elif rows:
+                break
+        # on axis only one actual column, radial and tangential are equal
+        rows = [r[:3]+r[2:3]+r[3:]*2 if len(r) == 4 else r for r in rows]
+        frequency = [r[0] for r in rows]
+        mtf['limit'].append([r[1] for r in rows])
+        mtf['rad'].append([r[4] for r in rows])
+        mtf['tan'].append([r[5] for r in rows])
+    mtf['frequency'] = frequency
+    for key in mtf:
+        mtf[key] = np.asarray(mtf[key])
+    mtf['wave_weights'] = weights
+    return mtf
@@ -1,6 +1,6 @@
 from __future__ import division as __division__
 import numpy as __np__
-import matplotlib.pyplot as __plt__
+from . import pupil
 
 # Ray Class
 
@@ -16,6 +16,124 @@ class Ray(object):
         print("Ray Position :",self.Pos)
         print("Ray Direction:",self.KLM)
 
+class RayBundle(object):
+    '''
+    Structure-of-arrays container for traced rays
+    ==========================================================
+    Pos: (n_surfaces,...,3) float64 ray position on each surface
+    KLM: (n_surfaces,...,3) float64 ray direction on each surface
+    valid: (...) bool mask, False for vignetted or lost rays,
+           default the rays that are not nan on the last stored surface
+    axes: names of the batch axes between surface and xyz axis,
+          e.g. ('wave','field','ray')
+    surfaces: numbers of the stored surfaces, default all of them,
+              e.g. (n,) for a bundle traced to surface n only
+    Float64 arrays are stored as given, not copied, so the selections
+    below (select, wave, field, rays) are views on the same memory,
+    flat is a view unless the bundle itself is a strided selection.
+    '''
+    def __init__(self,Pos,KLM,valid=None,axes=None,surfaces=None):
+        self.Pos = __np__.asarray(Pos,dtype=float)
+        self.KLM = __np__.asarray(KLM,dtype=float)
+        if valid is None:
+            # the trace kernel sets lost rays to nan
+            valid = __np__.isfinite(self.Pos[-1]).all(axis=-1)
+        self.valid = __np__.asarray(valid,dtype=bool)
+        if axes is None:
+            axes = ('ray',) if self.Pos.ndim == 3 else \
+                   tuple('axis%d'%i for i in range(self.Pos.ndim-2))
+        self.axes = tuple(axes)
+        if surfaces is None:
+            surfaces = range(1,self.Pos.shape[0]+1)
+        self.surfaces = tuple(surfaces)
+
+    @property
+    def n_surfaces(self):
+        return self.Pos.shape[0]
+
+    @property
+    def shape(self):
+        return self.Pos.shape[1:-1]
+
+    @property
+    def n_rays(self):
+        return int(__np__.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.Pos.nbytes + self.KLM.nbytes + self.valid.nbytes
+
+    def surface(self,surface_num):
+        '''
+        ray position and direction on one surface, surface_num start from 1
+        -1 means the last stored surface, the image surface
+        '''
+        if surface_num == -1:
+            i = -1
+        elif surface_num in self.surfaces:
+            i = self.surfaces.index(surface_num)
+        else:
+            raise Exception('surface %s is not stored in this ray bundle'%surface_num)
+        return self.Pos[i],self.KLM[i]
+
+    def flat(self):
+        '''
+        (n_surfaces,n_rays,3) bundle, a view when the arrays are
+        contiguous, else a copy
+        '''
+        return RayBundle(self.Pos.reshape(self.n_surfaces,-1,3),
+                         self.KLM.reshape(self.n_surfaces,-1,3),
+                         self.valid.reshape(-1),axes=('ray',),surfaces=self.surfaces)
+
+    def select(self,axis,num):
+        '''
+        view on one entry of a named batch axis, num start from 1
+        '''
+        i = self.axes.index(axis)
+        index = (slice(None),)*(i+1) + (num-1,)
+        return RayBundle(self.Pos[index],self.KLM[index],self.valid[index[1:]],
+                         axes=self.axes[:i]+self.axes[i+1:],surfaces=self.surfaces)
+
+    def wave(self,wave_num):
+        return self.select('wave',wave_num)
+
+    def field(self,field_num):
+        return self.select('field',field_num)
+
+    def rays(self,start,stop):
+        '''
+        view on rays start:stop of the last batch axis
+        '''
+        return RayBundle(self.Pos[...,start:stop,:],self.KLM[...,start:stop,:],
+                         self.valid[...,start:stop],axes=self.axes,surfaces=self.surfaces)
+
+    def transmission(self):
+        '''
+        fraction of the rays not lost, over the last batch axis
+        '''
+        return self.valid.mean(axis=-1)
+
+    def xy(self,surface_num=-1):
+        '''
+        x,y of rays on one surface, shape (2,...)
+        '''
+        Pos = self.surface(surface_num)[0]
+        return __np__.moveaxis(Pos[...,:2],-1,0)
+
+    def to_dict_list(self):
+        '''
+        old style output, a list of ray dictionary for every ray
+        '''
+        bundle = self.flat()
+        Num = list(self.surfaces)
+        ray_dict_list = []
+        for j in range(bundle.n_rays):
+            P = bundle.Pos[:,j]
+            D = bundle.KLM[:,j]
+            ray_dict_list.append({'Num':Num,'X':list(P[:,0]),'Y':list(P[:,1]),'Z':list(P[:,2]),
+                                  'K':list(D[:,0]),'L':list(D[:,1]),'M':list(D[:,2])})
+        return ray_dict_list
+
 class Field(object):
     def __init__(self,Raylist):
         self.ray_list = []
@@ -31,6 +149,26 @@ def add_field_YAN(Lens,angle):
     Lens.field_angle_list.append(angle)
     print('Add field angle: '+str(angle)+' degree done')
 
+def add_field_XAN_YAN(Lens,xangle,yangle):
+    '''
+    Add field by x and y object angle, CodeV XAN and YAN
+    the field is stored as the tuple (xangle,yangle)
+    '''
+    Lens.field_angle_list.append((xangle,yangle))
+    print('Add field angle: XAN '+str(xangle)+', YAN '+str(yangle)+' degree done')
+
+def field_angles(field_angle_list):
+    '''
+    (F,2) XAN, YAN of a list of fields, a number is a YAN only field
+    '''
+    angles = __np__.zeros((len(field_angle_list),2))
+    for i,angle in enumerate(field_angle_list):
+        if __np__.ndim(angle) == 0:
+            angles[i,1] = angle
+        else:
+            angles[i] = angle
+    return angles
+
 
 def field_rays_generator(Lens,angle,n=12,grid_type='grid'):
     grid_list = grid_generator(n,grid_type)
@@ -38,22 +176,47 @@ def field_rays_generator(Lens,angle,n=12,grid_type='grid'):
     return field_rays_list
 
 def grid2rays(Lens,grid_list,angle):
+    Pos,KLM = grid2launch(Lens,grid_list,angle)
     field_rays_list = []
+    for P,D in zip(Pos,KLM):
+        field_rays_list.append(Ray(P,D))
+    return field_rays_list
+
+def grid2launch(Lens,grid_list,angle,xangle=0):
+    '''
+    ray start position and direction arrays for a normalized pupil grid,
+    aimed at the paraxial entrance pupil
+    angle: field angle (YAN), or an array of field angles
+    xangle: x field angle (XAN), or an array broadcasting against angle
+    output: Pos (...,N,3), KLM (...,N,3), ... is the shape of angle
+    '''
+    grid = __np__.asarray(grid_list,dtype=float).reshape(-1,2)
+    angle = __np__.asarray(angle,dtype=float)[...,None]
+    xangle = __np__.asarray(xangle,dtype=float)[...,None]
+    shape = __np__.broadcast_shapes(angle.shape,xangle.shape)[:-1]
     EPD = Lens.EPD
     EP = Lens.EP
-    field_rays_list = []
     l = __np__.sin(angle/180*__np__.pi)
     m = __np__.cos(angle/180*__np__.pi)
-    KLM = [0,l,m]
     Pos_z = Lens.surface_list[0].thickness
     Pos_y = -(Pos_z + EP)*__np__.tan(angle/180*__np__.pi)
-    for relative_ray in grid_list:
-        x = EPD/2 * relative_ray[0]
-        y = EPD/2 * relative_ray[1] + Pos_y
-        Pos = [x,y,0]
-        New_Ray = Ray(Pos,KLM)
-        field_rays_list.append(New_Ray)
-    return field_rays_list
+    Pos = __np__.zeros(shape+(len(grid),3))
+    Pos[...,0] = EPD/2 * grid[:,0]
+    Pos[...,1] = EPD/2 * grid[:,1] + Pos_y
+    KLM = __np__.zeros(shape+(len(grid),3))
+    if __np__.any(xangle):
+        # direction from the tangents of XAN and YAN
+        tx = __np__.tan(xangle/180*__np__.pi)
+        ty = __np__.tan(angle/180*__np__.pi)
+        Pos[...,0] += -(Pos_z + EP)*tx
+        m = 1/__np__.sqrt(1 + tx**2 + ty**2)
+        KLM[...,0] = tx*m
+        KLM[...,1] = ty*m
+        KLM[...,2] = m
+    else:
+        KLM[...,1] = l
+        KLM[...,2] = m
+    return Pos,KLM
 
 def grid_generator(n,grid_type,output = False):
     '''
@@ -68,35 +231,17 @@ def grid_generator(n,grid_type,output = False):
             ring 2 has 2*6 points on it,etc
             n = 4 ==> 60 points
         3. in random type, n means points in entrance pupil
+        4. hexapolar, gauss, fibonacci, halton, sobol, see pupil module
     type: grid, circular,quasi-random
+    output: (N,2) array, pupil.sample also gives the sample weights
     '''
-    grid_list = []
-    if grid_type == 'grid':
-        x1 = y1 = __np__.linspace(-1,1,n)
-        for x in x1:
-            for y in y1:
-                if x**2 + y**2 <= 1:
-                    grid_list.append([x,y])
-    elif grid_type == 'circular':
-        for i in range(n):
-            i = i + 1
-            theta = __np__.linspace(0,360-360/i/6,i*6)
-            r = 1/n*i
-            for theta_1 in theta:
-                x = r * __np__.cos(theta_1*__np__.pi/180)
-                y = r * __np__.sin(theta_1*__np__.pi/180)
-                grid_list.append([x,y])
-
-    elif grid_type == 'random':
-        r = __np__.sqrt(__np__.random.rand(n))    #sqrt(random(0--r^2)) get radius
-        theta = 2*__np__.pi*__np__.random.rand(n)  # random(0--2pi) get theta
-        for r_1,theta_1 in zip(r,theta):
-            x = r_1 * __np__.cos(theta_1)
-            y = r_1 * __np__.sin(theta_1)
-            grid_list.append([x,y])
+    if grid_type in pupil.SAMPLERS:
+        grid_list = pupil.sample(grid_type,n)[0]
     else:
         print('No this kind of grid!')
+        grid_list = __np__.zeros((0,2))
     if output == True:
+        import matplotlib.pyplot as __plt__
         fig = __plt__.figure(1,figsize = (5,5))
         ax = __plt__.gca()
         ax.plot(*zip(*grid_list), marker='o', color='r', ls='')
@@ -113,20 +258,64 @@ def grid_generator(n,grid_type,output = False):
 
 
 def Y_fan_rays_generator(Lens,n,angle):
-    grid_list = []
-    x = [0]*n
-    y = __np__.linspace(-1,1,n)
-    for x1,y1 in zip(x,y):
-        grid_list.append([x1,y1])
+    grid_list = Y_fan_grid(n)
     field_rays_list = grid2rays(Lens,grid_list,angle)
     return field_rays_list
 
 
 def X_fan_rays_generator(Lens,n,angle):
-    grid_list = []
-    x = __np__.linspace(0,1,n)
-    y = [0]*n
-    for x1,y1 in zip(x,y):
-        grid_list.append([x1,y1])
+    grid_list = X_fan_grid(n)
     field_rays_list = grid2rays(Lens,grid_list,angle)
     return field_rays_list
+
+def Y_fan_grid(n):
+    '''
+    tangential fan in normalized pupil, Py from -1 to 1
+    '''
+    grid = __np__.zeros((n,2))
+    grid[:,1] = __np__.linspace(-1,1,n)
+    return grid
+
+def X_fan_grid(n):
+    '''
+    sagittal fan in normalized pupil, Px from 0 to 1
+    '''
+    grid = __np__.zeros((n,2))
+    grid[:,0] = __np__.linspace(0,1,n)
+    return grid
+
+def random_pupil_grids(n_rays,chunk_size=100000,seed=None):
+    '''
+    uniform random points in the normalized pupil, in chunks
+    ========================================
+    n_rays: total number of points
+    chunk_size: points per chunk
+    seed: random seed, same seed same points
+    yield (chunk_size,2) grids, the last one may be shorter
+    '''
+    rng = __np__.random.default_rng(seed)
+    for start in range(0,n_rays,chunk_size):
+        n = min(chunk_size,n_rays-start)
+        r = __np__.sqrt(rng.random(n))
+        theta = 2*__np__.pi*rng.random(n)
+        yield __np__.stack([r*__np__.cos(theta),r*__np__.sin(theta)],axis=-1)
+
+def pupil_chunks(Lens,grids,field_list=None,wave_list=None):
+    '''
+    launch rays for a stream of normalized pupil grids
+    ========================================
+    grids: iterable of (P,2) pupil grids, e.g. random_pupil_grids
+    field_list, wave_list: field and wavelength numbers, default all
+    yield (Pos,KLM,wave_num) for trace.trace_stream, Pos and KLM are
+    (F,P,3) ((W,F,P,3) with ray aiming), wave_num (W,1,1),
+    traced rays have shape (W,F,P,3)
+    '''
+    from . import trace
+    if wave_list is None:
+        wave_list = range(1,len(Lens.wavelength_list)+1)
+    if field_list is None:
+        field_list = range(1,len(Lens.field_angle_list)+1)
+    wave_num = __np__.asarray(wave_list,dtype=int).reshape(-1,1,1)
+    for grid in grids:
+        Pos,KLM = trace.launch_rays(Lens,grid,field_list,wave_num)
+        yield Pos,KLM,wave_num
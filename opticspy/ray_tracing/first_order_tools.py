@@ -1,7 +1,6 @@
 # first order tools, find EPD, calculate system power, etc
 from __future__ import division as __division__
 import numpy as __np__
-import matplotlib.pyplot as __plt__
 
 def print_verbose(*args, verbose=False):
 	if verbose:
@@ -53,35 +52,124 @@ def ABCD_start_end(Lens,start_surface=0,end_surface=0, verbose=False):
 	input: Lens Class,start_surface,end_surface
 	output: ABCD matrix
 	'''
-	s = Lens.surface_list
 	start,end = start_end(Lens,start_surface,end_surface, verbose)
-	R_matrix = []
-	T_matrix = []
-	RT_matrix = []
-	for i in range(start,end+1):
-		i = i - 1
-		# print 'i:',i
-		# print 'surface_num',s[i].number
-		c = 1/s[i].radius
-		# now use central wavelength as reference
-		n_left = s[i-1].indexlist[int(len(s[i-1].indexlist)/2)]
-		n_right = s[i].indexlist[int(len(s[i].indexlist)/2)]
-		t = s[i].thickness
-		R1 = R(c,n_left,n_right)
-		T1 = T(t,n_right)
-		# print R1
-		# print T1
-		RT_matrix.append(R1)
-		if i+1 != end:
-			RT_matrix.append(T1)
-	# print '--------------------------------'
-	# for i in RT_matrix:
-	# 	print i
-	# print '--------------------------------'
-	A,B,C,D = ABCD(RT_matrix)
+	A,B,C,D = paraxial_system(Lens).ABCD(start,end)
 	return A,B,C,D
 
 
+class ParaxialSystem(object):
+	'''
+	R and T matrices of every surface for every wavelength, and their
+	prefix products, so that any sub-system matrix is O(1)
+	------------------------------------
+	R[w,k]: refraction matrix of surface index k (surface number k+1)
+	T[w,k]: transfer matrix from surface index k to k+1
+	P[w,k]: T[k]R[k]...T[1]R[1], P[w,0] = identity
+	all matrices have determinant 1, so the inverse of a product is
+	its adjugate
+	'''
+	def __init__(self,Lens):
+		s = Lens.surface_list
+		index = __np__.array([S.indexlist for S in s],dtype=float).T   # (W,n_surfaces)
+		c = __np__.array([1/S.radius for S in s])
+		t = __np__.array([S.thickness for S in s],dtype=float)
+		W,N = index.shape
+		# same neighbour as s[i-1] in the old loop, surface index 0 uses the last one
+		n_left = __np__.roll(index,1,axis=1)
+		self.index = index
+		self.R = __np__.zeros((W,N,2,2))
+		self.R[...,0,0] = 1
+		self.R[...,1,1] = 1
+		self.R[...,1,0] = -c*(index-n_left)
+		self.T = __np__.zeros((W,N,2,2))
+		self.T[...,0,0] = 1
+		self.T[...,1,1] = 1
+		self.T[...,0,1] = t/index
+		self.P = __np__.empty((W,N,2,2))
+		self.P[:,0] = __np__.eye(2)
+		for k in range(1,N):
+			self.P[:,k] = self.T[:,k] @ self.R[:,k] @ self.P[:,k-1]
+		self.reference = int(W/2)   # central wavelength as reference
+
+	def matrix(self,start,end):
+		'''
+		system matrix from surface number start to end (refraction at end
+		included, transfer after end excluded), shape (W,2,2), one per wavelength
+		'''
+		return self._product(slice(None),start,end)
+
+	def ABCD(self,start,end,wave_num=None):
+		'''
+		A,B,C,D from surface number start to end,
+		wave_num: wavelength number, default the central wavelength
+		'''
+		w = self.reference if wave_num is None else wave_num-1
+		M = self._product(w,start,end)
+		return M[0,0],M[0,1],M[1,0],M[1,1]
+
+	def _product(self,w,start,end):
+		if not 1 <= start <= end <= self.R.shape[1]:
+			raise ValueError('surface numbers must satisfy 1 <= start <= end <= %d, got %s, %s'
+				% (self.R.shape[1],start,end))
+		M = self.R[w,end-1]
+		if start >= 2:
+			return M @ self.P[w,end-2] @ adjugate(self.P[w,start-2])
+		# surface number 1 is not part of the prefix products
+		if end == 1:
+			return M
+		return M @ self.P[w,end-2] @ self.T[w,0] @ self.R[w,0]
+
+	def ray_heights(self,y,u,wave_num=None):
+		'''
+		paraxial ray height on every surface
+		y,u: ray height and angle on surface number 2 (first surface after
+		     the object), in object space
+		output: heights on surface number 2..n, shape (W,n-1) when
+		        wave_num == 'all', else (n-1,)
+		'''
+		n0 = self.index[:,0]
+		v = __np__.stack([y*__np__.ones_like(n0),n0*u],axis=-1)   # (W,2)
+		heights = __np__.einsum('wkij,wj->wki',self.P[:,:-1],v)[...,0]
+		if wave_num == 'all':
+			return heights
+		w = self.reference if wave_num is None else wave_num-1
+		return heights[w]
+
+
+def adjugate(M):
+	'''
+	adjugate of (...,2,2) matrices, the inverse when det == 1
+	'''
+	adj = __np__.empty_like(M)
+	adj[...,0,0] = M[...,1,1]
+	adj[...,1,1] = M[...,0,0]
+	adj[...,0,1] = -M[...,0,1]
+	adj[...,1,0] = -M[...,1,0]
+	return adj
+
+
+def paraxial_system(Lens):
+	'''
+	ParaxialSystem of a Lens, cached with the other first order data
+	'''
+	return Lens._first_order('paraxial_system', lambda: ParaxialSystem(Lens))
+
+
+def marginal_ray_heights(Lens,wave_num=None):
+	'''
+	paraxial marginal ray height on surface number 2..n, object at infinity
+	'''
+	return paraxial_system(Lens).ray_heights(Lens.EPD/2,0,wave_num)
+
+
+def chief_ray_heights(Lens,angle,wave_num=None):
+	'''
+	paraxial chief ray height on surface number 2..n for field angle (degree)
+	'''
+	u = __np__.tan(angle/180*__np__.pi)
+	return paraxial_system(Lens).ray_heights(-Lens.EP*u,u,wave_num)
+
+
 def list(Lens):
 	'''
 	List first order information of a lens system
@@ -1,8 +1,9 @@
 from __future__ import division as __division__
 import numpy as __np__
-import matplotlib.pyplot as __plt__
 import os
+import functools
 from . glass_function.refractiveIndex import *
+from . glass_function import glassIndex
 
 
 # glass related functions
@@ -26,13 +27,65 @@ def glass2indexlist(wavelength_list,glassname):
 		n = glassname.find('_')
 		glass_catalog_name = glassname[n+1:]
 		glass_name = glassname[:n]
-		catalog = RefractiveIndex()
 		for w in wavelength_list:
-			mat = catalog.getMaterial('glass', glass_catalog_name, glass_name) # shelf, book, page
-			n = mat.getRefractiveIndex(w)
+			n = glass_index(glass_catalog_name, glass_name, w)
 			lens_index_list.append(round(n,6))
 	return lens_index_list
 
+# Parsing library.yml and the material yml files is slow, materials are
+# read from the precompiled glass index (glassIndex.openIndex), built in
+# the cache directory and rebuilt when the database changes. The YAML
+# catalog is the fallback when the index cannot be written. Both are
+# loaded once per process, parsed materials and computed indices are cached.
+
+_catalog = None
+_glass_index = None
+
+def get_catalog():
+	'''
+	process wide RefractiveIndex catalog, library.yml is parsed only once
+	'''
+	global _catalog
+	if _catalog is None:
+		_catalog = RefractiveIndex()
+	return _catalog
+
+def get_glass_index():
+	'''
+	process wide GlassIndex, False if the index file cannot be built
+	'''
+	global _glass_index
+	if _glass_index is None:
+		try:
+			_glass_index = glassIndex.openIndex()
+		except (IOError, OSError):
+			_glass_index = False
+	return _glass_index
+
+@functools.lru_cache(maxsize=256)
+def get_material(book, page):
+	'''
+	parsed Material for a glass catalog (book) and glass name (page)
+	'''
+	index = get_glass_index()
+	if index and glassIndex.materialKey(book, page) in index:
+		return index.getMaterial(book, page)
+	return get_catalog().getMaterial('glass', book, page) # shelf, book, page
+
+@functools.lru_cache(maxsize=4096)
+def glass_index(book, page, wavelength):
+	'''
+	refractive index of a glass at wavelength (nm)
+	'''
+	return get_material(book, page).getRefractiveIndex(float(wavelength))
+
+def clear_cache():
+	global _catalog, _glass_index
+	_catalog = None
+	_glass_index = None
+	get_material.cache_clear()
+	glass_index.cache_clear()
+
 def output(wavelength_list,lens_index_list):
 	print('Lens wavelength vs index')
 	print('wavelength-----index---')
@@ -0,0 +1,207 @@
+"""
+Precompiled binary index of the refractiveindex.info database
+
+Parsing the YAML files is what makes loading a lens slow, so the whole
+database is compiled once into a single file:
+
+    magic (8 bytes) | header length (uint64) | JSON header | float64 data
+
+The JSON header holds the fingerprint of the database it was built from
+and maps 'book/page' (lower case, book is the directory name, page the
+file name) to the material records
+[kind, formula, rangeMin, rangeMax, offset, rows, columns], the
+coefficients and tables live in the float64 data block which is memory
+mapped, so looking up a material reads only its own numbers.
+
+The index is not shipped, openIndex builds it in the user cache
+directory (OPTICSPY_CACHE, default $XDG_CACHE_HOME/opticspy) on first
+use, and again whenever a YAML file of the database was added, removed
+or modified since. Build it ahead of time with:
+
+    python -m opticspy.ray_tracing.glass_function.glassIndex
+"""
+
+import os
+import json
+import struct
+import hashlib
+import tempfile
+import yaml
+import numpy
+
+from .refractiveIndex import Material, parseMaterialData
+
+MAGIC = b'OPYGLAS2'
+defaultDatabasePath = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                   os.path.normpath("../glass_database/"))
+
+
+def cacheDirectory():
+    return os.environ.get('OPTICSPY_CACHE') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'opticspy')
+
+
+def defaultIndexPath(databasePath=defaultDatabasePath):
+    """
+    index file of a database in the cache directory, one per database path
+    """
+    name = hashlib.sha1(os.path.realpath(databasePath).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cacheDirectory(), 'glass_index_{}.bin'.format(name))
+
+
+def databaseFingerprint(databasePath=defaultDatabasePath):
+    """
+    hash of the path, size and modification time of every YAML file
+
+    :param databasePath:
+    :return: hex digest, changes when the database is edited
+    """
+    digest = hashlib.sha1()
+    for root, subFolders, files in os.walk(databasePath):
+        subFolders.sort()
+        for f in sorted(files):
+            if f.endswith('.yml'):
+                stat = os.stat(os.path.join(root, f))
+                digest.update('{}|{}|{}\n'.format(os.path.relpath(os.path.join(root, f), databasePath),
+                                                  stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def materialKey(book, page):
+    return '{}/{}'.format(book.lower(), page.lower())
+
+
+def buildIndex(databasePath=defaultDatabasePath, filename=None):
+    """
+    Compile every material YAML file of the database into one index file
+
+    :param databasePath:
+    :param filename: default defaultIndexPath(databasePath)
+    :return: number of materials in the index
+    """
+    if filename is None:
+        filename = defaultIndexPath(databasePath)
+    fingerprint = databaseFingerprint(databasePath)
+    header = {}
+    blocks = []
+    offset = 0
+    bookRoots = {}
+    for root, subFolders, files in os.walk(databasePath):
+        subFolders.sort()
+        book = os.path.basename(root)
+        # same rule as RefractiveIndex.getBookDirectories, first book wins
+        if bookRoots.setdefault(book.lower(), root) != root:
+            continue
+        for f in sorted(files):
+            page, ext = os.path.splitext(f)
+            if ext != '.yml' or f == 'library.yml':
+                continue
+            with open(os.path.join(root, f)) as fid:
+                try:
+                    records = parseMaterialData(yaml.safe_load(fid)['DATA'])
+                except Exception:
+                    # broken or unsupported file, left to the YAML loader
+                    continue
+            entry = []
+            for kind, formula, rangeMin, rangeMax, values in records:
+                values = numpy.asarray(values, dtype=float).reshape(len(values), -1)
+                rows, columns = values.shape
+                entry.append([kind, formula, rangeMin, rangeMax, offset, rows, columns])
+                blocks.append(values.ravel())
+                offset += values.size
+            header[materialKey(book, page)] = entry
+    text = json.dumps({'fingerprint': fingerprint, 'materials': header}, separators=(',', ':')).encode('utf-8')
+    text += b' ' * (-(len(MAGIC) + 8 + len(text)) % 8)
+    directory = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # written aside and renamed, readers never see a partial file
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fid:
+            fid.write(MAGIC)
+            fid.write(struct.pack('<Q', len(text)))
+            fid.write(text)
+            if blocks:
+                numpy.concatenate(blocks).astype('<f8').tofile(fid)
+        os.replace(temporary, filename)
+    except Exception:
+        os.remove(temporary)
+        raise
+    return len(header)
+
+
+def openIndex(databasePath=defaultDatabasePath, filename=None):
+    """
+    GlassIndex of the database, (re)built when missing or out of date
+
+    :param databasePath:
+    :param filename: default defaultIndexPath(databasePath)
+    :return: GlassIndex
+    """
+    if filename is None:
+        filename = defaultIndexPath(databasePath)
+    fingerprint = databaseFingerprint(databasePath)
+    try:
+        index = GlassIndex(filename)
+        if index.fingerprint == fingerprint:
+            return index
+    except Exception:
+        # missing, or written by another version
+        pass
+    buildIndex(databasePath, filename)
+    return GlassIndex(filename)
+
+
+class GlassIndex:
+    """Memory mapped reader of an index file written by buildIndex"""
+
+    def __init__(self, filename):
+        """
+
+        :param filename:
+        """
+        with open(filename, 'rb') as fid:
+            if fid.read(len(MAGIC)) != MAGIC:
+                raise Exception('{} is not a glass index file'.format(filename))
+            length, = struct.unpack('<Q', fid.read(8))
+            header = json.loads(fid.read(length).decode('utf-8'))
+        self.fingerprint = header['fingerprint']
+        self.header = header['materials']
+        dataOffset = len(MAGIC) + 8 + length
+        if os.path.getsize(filename) > dataOffset:
+            self.data = numpy.memmap(filename, dtype='<f8', mode='r', offset=dataOffset)
+        else:
+            self.data = numpy.zeros(0)
+
+    def __contains__(self, key):
+        return key in self.header
+
+    def getRecords(self, book, page):
+        """
+
+        :param book:
+        :param page:
+        :return: records in the parseMaterialData format
+        """
+        records = []
+        for kind, formula, rangeMin, rangeMax, offset, rows, columns in self.header[materialKey(book, page)]:
+            values = numpy.array(self.data[offset:offset + rows * columns]).reshape(rows, columns)
+            if kind == 'formula':
+                values = values[:, 0]
+            records.append((kind, formula, rangeMin, rangeMax, values))
+        return records
+
+    def getMaterial(self, book, page):
+        """
+
+        :param book:
+        :param page:
+        :return: Material, raise KeyError when the material is not indexed
+        """
+        return Material(records=self.getRecords(book, page))
+
+
+if __name__ == "__main__":
+    n = buildIndex()
+    print('{} materials written to {}'.format(n, defaultIndexPath()))
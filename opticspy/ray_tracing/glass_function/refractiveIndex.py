@@ -38,6 +38,7 @@ class RefractiveIndex:
         # print(f)
         self.catalog = yaml.safe_load(f)
         f.close()
+        self._books = None
 
         # TODO: Do i NEED namedtuples, or am i just wasting time?
         # Shelf = collections.namedtuple('Shelf', ['SHELF', 'name', 'books'])
@@ -58,18 +59,32 @@ class RefractiveIndex:
         #         book.pages = pages
 
     def getMaterialFilename(self, shelf, book, page):
-        cwd = os.getcwd()
-        #rootdir = cwd + "/opticspy/ray_tracing/glass_database/"
-        glass_catalog = book
-        filename = page + '.yml'
-        for root, subFolders, files in os.walk(self.referencePath):
-            if root.endswith(glass_catalog):
-                break
-        for f in files:
-            if f == filename:
-                filepath = os.path.join(self.referencePath,root,filename)
-                break
-        return filepath
+        # book and page are matched case insensitively, e.g. N-SK16_SCHOTT
+        # in CodeV files is glass/schott/N-SK16.yml
+        glass_catalog = book.lower()
+        filename = page.lower() + '.yml'
+        books = self.getBookDirectories()
+        if glass_catalog not in books:
+            raise Exception('No material catalog {} in {}'.format(book, self.referencePath))
+        root, files = books[glass_catalog]
+        if filename not in files:
+            raise Exception('No material {} in catalog {}'.format(page, book))
+        return os.path.join(root, files[filename])
+
+    def getBookDirectories(self):
+        """
+        Walk the database once, map lower case directory name to
+        (directory path, {lower case file name: file name})
+        :return:
+        """
+        if self._books is None:
+            self._books = {}
+            for root, subFolders, files in os.walk(self.referencePath):
+                subFolders.sort()
+                key = os.path.basename(root).lower()
+                if key not in self._books:
+                    self._books[key] = (root, dict((f.lower(), f) for f in files))
+        return self._books
 
         # """
 
@@ -98,67 +113,54 @@ class RefractiveIndex:
 class Material:
     """ Material class"""
 
-    def __init__(self, filename):
+    def __init__(self, filename=None, records=None):
         """
 
-        :param filename:
+        :param filename: material YAML file
+        :param records: already parsed data records, see parseMaterialData
         """
         self.refractiveIndex = None
         self.extinctionCoefficient = None
 
-        f = open(filename)
-        material = yaml.safe_load(f)
-        f.close()
+        if records is None:
+            f = open(filename)
+            material = yaml.safe_load(f)
+            f.close()
+            records = parseMaterialData(material['DATA'])
 
-        for data in material['DATA']:
-            if (data['type'].split())[0] == 'tabulated':
-                rows = data['data'].split('\n')
-                splitrows = [c.split() for c in rows]
-                wavelengths = []
-                n = []
-                k = []
-                for s in splitrows:
-                    if len(s) > 0:
-                        wavelengths.append(float(s[0]))
-                        n.append(float(s[1]))
-                        if len(s) > 2:
-                            k.append(float(s[2]))
+        for kind, formula, rangeMin, rangeMax, values in records:
+            if kind == 'tabulated n':
 
-                if (data['type'].split())[1] == 'n':
-
-                    if self.refractiveIndex is not None:
-                        Exception('Bad Material YAML File')
+                if self.refractiveIndex is not None:
+                    Exception('Bad Material YAML File')
 
-                    self.refractiveIndex = RefractiveIndexData.setupRefractiveIndex(formula=-1,
-                                                                                    wavelengths=wavelengths,
-                                                                                    values=n)
-                elif (data['type'].split())[1] == 'k':
+                self.refractiveIndex = RefractiveIndexData.setupRefractiveIndex(formula=-1,
+                                                                                wavelengths=values[:, 0],
+                                                                                values=values[:, 1])
+            elif kind == 'tabulated k':
 
-                    self.extinctionCoefficient = ExtinctionCoefficientData.setupExtinctionCoefficient(wavelengths, n)
+                self.extinctionCoefficient = ExtinctionCoefficientData.setupExtinctionCoefficient(values[:, 0],
+                                                                                                  values[:, 1])
 
-                elif (data['type'].split())[1] == 'nk':
+            elif kind == 'tabulated nk':
 
-                    if self.refractiveIndex is not None:
-                        Exception('Bad Material YAML File')
+                if self.refractiveIndex is not None:
+                    Exception('Bad Material YAML File')
 
-                    self.refractiveIndex = RefractiveIndexData.setupRefractiveIndex(formula=-1,
-                                                                                    wavelengths=wavelengths,
-                                                                                    values=n)
-                    self.extinctionCoefficient = ExtinctionCoefficientData.setupExtinctionCoefficient(wavelengths, k)
-            elif (data['type'].split())[0] == 'formula':
+                self.refractiveIndex = RefractiveIndexData.setupRefractiveIndex(formula=-1,
+                                                                                wavelengths=values[:, 0],
+                                                                                values=values[:, 1])
+                self.extinctionCoefficient = ExtinctionCoefficientData.setupExtinctionCoefficient(values[:, 0],
+                                                                                                  values[:, 2])
+            elif kind == 'formula':
 
                 if self.refractiveIndex is not None:
                     Exception('Bad Material YAML File')
 
-                formula = int((data['type'].split())[1])
-                coefficents = [float(s) for s in data['coefficients'].split()]
-                rangeMin = float(data['range'].split()[0])
-                rangeMax = float(data['range'].split()[1])
-
                 self.refractiveIndex = RefractiveIndexData.setupRefractiveIndex(formula=formula,
                                                                                 rangeMin=rangeMin,
                                                                                 rangeMax=rangeMax,
-                                                                                coefficients=coefficents)
+                                                                                coefficients=list(values))
 
     def getRefractiveIndex(self, wavelength):
         """
@@ -183,6 +185,37 @@ class Material:
             return self.extinctionCoefficient.getExtinctionCoefficient(wavelength)
 
 
+def parseMaterialData(DATA):
+    """
+    Parse the DATA list of a material YAML file into records
+    (kind, formula, rangeMin, rangeMax, values), kind is 'formula',
+    'tabulated n', 'tabulated k' or 'tabulated nk', values is the
+    coefficient array or the (rows, columns) table
+
+    :param DATA:
+    :return:
+    """
+    records = []
+    for data in DATA:
+        if (data['type'].split())[0] == 'tabulated':
+            rows = data['data'].split('\n')
+            splitrows = [c.split() for c in rows]
+            table = [[float(c) for c in s] for s in splitrows if len(s) > 0]
+            kind = ' '.join(data['type'].split()[:2])
+            # short rows, e.g. n without k, are padded with 0
+            ncol = max(len(s) for s in table)
+            table = [s + [0.0] * (ncol - len(s)) for s in table]
+            table = numpy.asarray(table, dtype=float)
+            records.append((kind, -1, table[:, 0].min(), table[:, 0].max(), table))
+        elif (data['type'].split())[0] == 'formula':
+            formula = int((data['type'].split())[1])
+            coefficents = numpy.asarray([float(s) for s in data['coefficients'].split()])
+            rangeMin = float(data['range'].split()[0])
+            rangeMax = float(data['range'].split()[1])
+            records.append(('formula', formula, rangeMin, rangeMax, coefficents))
+    return records
+
+
 #
 # Refractive Index
 #
@@ -232,58 +265,41 @@ class FormulaRefractiveIndexData:
     def getRefractiveIndex(self, wavelength):
         """
 
-        :param wavelength:
-        :return: :raise Exception:
+        :param wavelength: wavelength in nm, scalar or array
+        :return: refractive index, same shape as wavelength :raise Exception:
         """
-        wavelength /= 1000.0
-        if self.rangeMin <= wavelength <= self.rangeMax:
-            formula_type = self.formula
-            coefficients = self.coefficients
-            n = 0
-            if formula_type == 1:  # Sellmeier
-                nsq = 1 + coefficients[0]
-                g = lambda c1, c2, w: c1 * (w ** 2) / (w ** 2 - c2 ** 2)
-                for i in range(1, len(coefficients), 2):
-                    nsq += g(coefficients[i], coefficients[i + 1], wavelength)
-                n = numpy.sqrt(nsq)
-            elif formula_type == 2:  # Sellmeier-2
-                nsq = 1 + coefficients[0]
-                g = lambda c1, c2, w: c1 * (w ** 2) / (w ** 2 - c2)
-                for i in range(1, len(coefficients), 2):
-                    nsq += g(coefficients[i], coefficients[i + 1], wavelength)
-                n = numpy.sqrt(nsq)
-            elif formula_type == 3:  # Polynomal
-                g = lambda c1, c2, w: c1 * w ** c2
-                nsq = coefficients[0]
-                for i in range(1, len(coefficients), 2):
-                    nsq += g(coefficients[i], coefficients[i + 1], wavelength)
-                n = numpy.sqrt(nsq)
-            elif formula_type == 4:  # RefractiveIndex.INFO
-                raise FormulaNotImplemented('RefractiveIndex.INFO formula not yet implemented')
-            elif formula_type == 5:  # Cauchy
-                g = lambda c1, c2, w: c1 * w ** c2
-                n = coefficients[0]
-                for i in range(1, len(coefficients), 2):
-                    n += g(coefficients[i], coefficients[i + 1], wavelength)
-            elif formula_type == 6:  # Gasses
-                n = 1 + coefficients[0]
-                g = lambda c1, c2, w: c1 / (c2 - w ** (-2))
-                for i in range(1, len(coefficients), 2):
-                    n += g(coefficients[i], coefficients[i + 1], wavelength)
-            elif formula_type == 7:  # Herzberger
-                raise FormulaNotImplemented('Herzberger formula not yet implemented')
-            elif formula_type == 8:  # Retro
-                raise FormulaNotImplemented('Retro formula not yet implemented')
-            elif formula_type == 9:  # Exotic
-                raise FormulaNotImplemented('Exotic formula not yet implemented')
-            else:
-                raise Exception('Bad formula type')
-
-            return n
+        wavelength = checkRange(wavelength, self.rangeMin, self.rangeMax)
+        formula_type = self.formula
+        coefficients = numpy.asarray(self.coefficients, dtype=float)
+        # coefficient pairs (c1, c2) along the last axis
+        c1 = coefficients[1::2]
+        c2 = coefficients[2::2]
+        w = wavelength[..., None]
+        if formula_type == 1:  # Sellmeier
+            nsq = 1 + coefficients[0] + numpy.sum(c1 * (w ** 2) / (w ** 2 - c2 ** 2), axis=-1)
+            n = numpy.sqrt(nsq)
+        elif formula_type == 2:  # Sellmeier-2
+            nsq = 1 + coefficients[0] + numpy.sum(c1 * (w ** 2) / (w ** 2 - c2), axis=-1)
+            n = numpy.sqrt(nsq)
+        elif formula_type == 3:  # Polynomal
+            nsq = coefficients[0] + numpy.sum(c1 * w ** c2, axis=-1)
+            n = numpy.sqrt(nsq)
+        elif formula_type == 4:  # RefractiveIndex.INFO
+            raise FormulaNotImplemented('RefractiveIndex.INFO formula not yet implemented')
+        elif formula_type == 5:  # Cauchy
+            n = coefficients[0] + numpy.sum(c1 * w ** c2, axis=-1)
+        elif formula_type == 6:  # Gasses
+            n = 1 + coefficients[0] + numpy.sum(c1 / (c2 - w ** (-2)), axis=-1)
+        elif formula_type == 7:  # Herzberger
+            raise FormulaNotImplemented('Herzberger formula not yet implemented')
+        elif formula_type == 8:  # Retro
+            raise FormulaNotImplemented('Retro formula not yet implemented')
+        elif formula_type == 9:  # Exotic
+            raise FormulaNotImplemented('Exotic formula not yet implemented')
         else:
-            raise Exception(
-                'Wavelength {} is out of bounds. Correct range(um): ({}, {})'.format(wavelength, self.rangeMin,
-                                                                                     self.rangeMax))
+            raise Exception('Bad formula type')
+
+        return n[()]
 
 
 class TabulatedRefractiveIndexData:
@@ -295,30 +311,37 @@ class TabulatedRefractiveIndexData:
         :param wavelengths:
         :param values:
         """
-        self.rangeMin = numpy.min(wavelengths)
-        self.rangeMax = numpy.max(wavelengths)
-
-        if self.rangeMin == self.rangeMax:
-            self.refractiveFunction = values[0]
-        else:
-            xvals = numpy.linspace(self.rangeMin,self.rangeMax,50)
-            self.refractiveFunction = numpy.interp(xvals, wavelengths, values)
+        order = numpy.argsort(wavelengths)
+        self.wavelengths = numpy.asarray(wavelengths, dtype=float)[order]
+        self.values = numpy.asarray(values, dtype=float)[order]
+        self.rangeMin = self.wavelengths[0]
+        self.rangeMax = self.wavelengths[-1]
 
     def getRefractiveIndex(self, wavelength):
         """
 
-        :param wavelength:
-        :return: :raise Exception:
+        :param wavelength: wavelength in nm, scalar or array
+        :return: refractive index, linear interpolation of the table :raise Exception:
         """
-        wavelength /= 1000.0
-        if self.rangeMin == self.rangeMax and self.rangeMin == wavelength:
-            return self.refractiveFunction
-        elif self.rangeMin <= wavelength <= self.rangeMax and self.rangeMin != self.rangeMax:
-            return self.refractiveFunction(wavelength)
-        else:
-            raise Exception(
-                'Wavelength {} is out of bounds. Correct range(um): ({}, {})'.format(wavelength, self.rangeMin,
-                                                                                     self.rangeMax))
+        wavelength = checkRange(wavelength, self.rangeMin, self.rangeMax)
+        return numpy.interp(wavelength, self.wavelengths, self.values)[()]
+
+
+def checkRange(wavelength, rangeMin, rangeMax):
+    """
+    Convert wavelength from nm to um, without touching the argument
+
+    :param wavelength:
+    :param rangeMin:
+    :param rangeMax:
+    :return: wavelength array in um :raise Exception:
+    """
+    wavelength = numpy.asarray(wavelength, dtype=float) / 1000.0
+    if numpy.any(wavelength < rangeMin) or numpy.any(wavelength > rangeMax):
+        raise Exception(
+            'Wavelength {} is out of bounds. Correct range(um): ({}, {})'.format(wavelength, rangeMin,
+                                                                                 rangeMax))
+    return wavelength
 
 
 #
@@ -343,24 +366,20 @@ class ExtinctionCoefficientData:
         :param wavelengths:
         :param coefficients:
         """
-        self.rangeMin = numpy.min(wavelengths)
-        self.rangeMax = numpy.max(wavelengths)
-        xvals = numpy.linspace(self.rangeMin,self.rangeMax,50)
-        self.extCoeffFunction = numpy.interp(xvals, wavelengths, coefficients)
+        order = numpy.argsort(wavelengths)
+        self.wavelengths = numpy.asarray(wavelengths, dtype=float)[order]
+        self.coefficients = numpy.asarray(coefficients, dtype=float)[order]
+        self.rangeMin = self.wavelengths[0]
+        self.rangeMax = self.wavelengths[-1]
 
     def getExtinctionCoefficient(self, wavelength):
         """
 
-        :param wavelength:
+        :param wavelength: wavelength in nm, scalar or array
         :return: :raise Exception:
         """
-        wavelength /= 1000.0
-        if self.rangeMin <= wavelength <= self.rangeMax:
-            return self.extCoeffFunction(wavelength)
-        else:
-            raise Exception(
-                'Wavelength {} is out of bounds. Correct range(um): ({}, {})'.format(wavelength, self.rangeMin,
-                                                                                     self.rangeMax))
+        wavelength = checkRange(wavelength, self.rangeMin, self.rangeMax)
+        return numpy.interp(wavelength, self.wavelengths, self.coefficients)[()]
 
 
 #
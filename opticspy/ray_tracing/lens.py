@@ -1,4 +1,5 @@
-from . import surface, field, analysis, wavelength, first_order_tools, draw
+from collections import OrderedDict
+from . import surface, field, wavelength, first_order_tools
 
 # Ray Class
 
@@ -21,10 +22,37 @@ class Lens(object):
 		self.image_plane_ray_list = []
 		self.field_trace_info = []
 		self.Y_fan_info = []
+		self.X_fan_info = []
+		self._first_order_key = None
+		self._first_order_cache = {}
+		# real ray aiming at the stop instead of the paraxial entrance pupil
+		self.ray_aiming = False
+		self.aim_cache = OrderedDict()
+
+	def _lens_key(self):
+		'''
+		changes when a surface radius, thickness, glass, STO flag or number,
+		the surface list or the object position changes
+		'''
+		return (tuple((S, S._revision, S.number) for S in self.surface_list), self.object_position)
+
+	def _first_order(self, name, func):
+		'''
+		cached first order quantity, computed once until a surface
+		radius, thickness, glass, STO flag or number, the surface list
+		or the object position changes
+		'''
+		key = self._lens_key()
+		if key != self._first_order_key:
+			self._first_order_key = key
+			self._first_order_cache = {}
+		if name not in self._first_order_cache:
+			self._first_order_cache[name] = func()
+		return self._first_order_cache[name]
 
 	@property
 	def EFL(self):
-		return first_order_tools.EFL(self, 0, 0)
+		return self._first_order('EFL', lambda: first_order_tools.EFL(self, 0, 0))
 
 	@property
 	def BFL(self):
@@ -32,15 +60,15 @@ class Lens(object):
 
 	@property
 	def OAL(self,):
-		return first_order_tools.OAL(self,)
+		return self._first_order('OAL', lambda: first_order_tools.OAL(self,))
 
 	@property
 	def image_position(self):
-		return first_order_tools.image_position(self)
+		return self._first_order('image_position', lambda: first_order_tools.image_position(self))
 
 	@property
 	def EP(self):
-		return first_order_tools.EP(self)
+		return self._first_order('EP', lambda: first_order_tools.EP(self))
 
 	@property
 	def EPD(self):
@@ -70,7 +98,7 @@ class Lens(object):
 
 	@property
 	def EX(self):
-		return first_order_tools.EX(self)
+		return self._first_order('EX', lambda: first_order_tools.EX(self))
 
 	def lens_info(self):
 		print(self.lens_name)
@@ -142,6 +170,13 @@ class Lens(object):
 		self.surface_list.append(S)
 		surface.print_add_surface(number,radius,thickness,glass,STO,output=output)
 
+	def set_aperture(self, surface_number, semi_diameter):
+		'''
+		clear aperture of a surface, surface_number start from 1,
+		rays outside semi_diameter are vignetted, None removes it
+		'''
+		self.surface_list[surface_number-1].aperture = semi_diameter
+
 	def print_surface_list(self):
 		surface.print_surface_list(self)
 
@@ -149,6 +184,9 @@ class Lens(object):
 	def add_field_YAN(self,angle):
 		field.add_field_YAN(self,angle)
 
+	def add_field_XAN_YAN(self,xangle,yangle):
+		field.add_field_XAN_YAN(self,xangle,yangle)
+
 # -----------------------Wavelength Fucntions---------------------
 	def add_wavelength(self,wl):
 		print('Add wavelength '+ str(wl) + ' nm done')
@@ -161,6 +199,7 @@ class Lens(object):
 
 # -----------------------Spotdiagram------------------------------
 	def spotdiagram(self):
+		from . import analysis
 		analysis.spotdiagram(self)
 
 	def list_image_ray_info(self):
@@ -0,0 +1,227 @@
+from __future__ import division as __division__
+import numpy as __np__
+
+# Optical path difference (OPD) on the exit pupil reference sphere
+# The rays of a square pupil grid are traced with their optical path
+# (trace kernel OPL) to the image, then followed back to the reference
+# sphere centered on the chief ray image point through the center of
+# the exit pupil. The OPD of a ray is the optical path of the chief
+# ray minus its own, in waves, nan outside the pupil and for lost rays.
+
+def pupil_square(n):
+    '''
+    n x n cell centered square grid over the normalized pupil
+    output: x (n,) coordinates of the columns (and rows),
+            mask (n,n) points inside the unit circle, [y,x] indexed
+    '''
+    x = (__np__.arange(n) + 0.5)*2/n - 1
+    mask = x[:,None]**2 + x[None,:]**2 <= 1
+    return x,mask
+
+def reference_opl(Lens,Pos,KLM,OPL,n,center):
+    '''
+    optical path of image rays up to the reference sphere
+    ==========================================================
+    input:
+    Lens: Lens instance
+    Pos, KLM, OPL: (...,3), (...,3), (...) rays on the image surface
+    n: image space refractive index, broadcasting against OPL
+    center: (...,3) sphere center, broadcasting against Pos
+    output:
+    (...) OPL minus the optical path from the sphere to the image
+    '''
+    s = Lens.surface_list
+    # exit pupil center in the image surface frame, EX is measured from the last surface
+    z_EX = Lens.EX - s[-2].thickness
+    center = __np__.asarray(center,dtype=float)
+    R2 = center[...,0]**2 + center[...,1]**2 + (center[...,2] - z_EX)**2
+    v = Pos - center
+    vD = (v*KLM).sum(axis=-1)
+    # go back along every ray from the image to the sphere
+    back = vD + __np__.sqrt(vD**2 - (v*v).sum(axis=-1) + R2)
+    return OPL - n*back
+
+class OPDMap(object):
+    '''
+    OPD over a square pupil grid for some fields and wavelengths
+    ==========================================================
+    x: (n,) normalized pupil coordinates of the grid columns and rows
+    W: (W,F,n,n) OPD in waves, [y,x] indexed, nan outside the pupil
+       and for vignetted rays, relative to the chief ray
+    mask: (W,F,n,n) True where W is defined
+    wavelength: (W,) wavelength in mm
+    slope: (W,F,2) image space direction cosine K, L per unit of
+           normalized pupil x, y, 2*abs(slope)/wavelength is the cutoff
+           frequency in cycles/mm
+    wave_list, field_list: wavelength and field numbers of the axes
+    '''
+    def __init__(self,x,W,mask,wavelength,slope,wave_list,field_list):
+        self.x = x
+        self.W = W
+        self.mask = mask
+        self.wavelength = wavelength
+        self.slope = slope
+        self.wave_list = list(wave_list)
+        self.field_list = list(field_list)
+
+    @property
+    def n(self):
+        return len(self.x)
+
+    def cutoff(self):
+        '''
+        (W,F,2) x, y incoherent cutoff frequency in cycles/mm
+        '''
+        return 2*abs(self.slope)/self.wavelength[:,None,None]
+
+    def detilt(self):
+        '''
+        (W,F,n,n) OPD with the least squares piston and tilt removed,
+        the OPD to the best reference sphere centered in the image plane
+        '''
+        x = __np__.broadcast_to(self.x[None,:],(self.n,self.n))
+        y = x.T
+        basis = [__np__.ones((self.n,self.n)),x,y]
+        W = __np__.where(self.mask,self.W,0)
+        A = __np__.empty(self.W.shape[:2]+(3,3))
+        b = __np__.empty(self.W.shape[:2]+(3,))
+        for i,p in enumerate(basis):
+            b[...,i] = (W*p).sum(axis=(-2,-1))
+            for j,q in enumerate(basis):
+                A[...,i,j] = (self.mask*p*q).sum(axis=(-2,-1))
+        c = __np__.linalg.solve(A,b[...,None])[...,0]
+        plane = sum(c[...,i,None,None]*p for i,p in enumerate(basis))
+        return __np__.where(self.mask,self.W - plane,__np__.nan)
+
+    def rms(self,tilt=False):
+        '''
+        (W,F) RMS OPD in waves, piston removed, and tilt unless tilt=True
+        '''
+        W = self.W if tilt else self.detilt()
+        return __np__.sqrt(__np__.nanmean((W - __np__.nanmean(W,axis=(-2,-1),keepdims=True))**2,axis=(-2,-1)))
+
+    def pv(self,tilt=False):
+        '''
+        (W,F) peak to valley OPD in waves, tilt removed unless tilt=True
+        '''
+        W = self.W if tilt else self.detilt()
+        return __np__.nanmax(W,axis=(-2,-1)) - __np__.nanmin(W,axis=(-2,-1))
+
+    def pupil_function(self,W=None):
+        '''
+        (W,F,n,n) complex pupil function exp(2*pi*i*OPD), 0 outside
+        '''
+        if W is None:
+            W = self.W
+        return __np__.where(self.mask,__np__.exp(2j*__np__.pi*__np__.nan_to_num(W)),0)
+
+    def strehl(self,tilt=False):
+        '''
+        (W,F) Strehl ratio, intensity at the reference point relative to
+        the aberration free pupil, about the best reference point unless
+        tilt=True (then about the chief ray image point)
+        '''
+        P = self.pupil_function(self.W if tilt else self.detilt())
+        return abs(P.sum(axis=(-2,-1)))**2/__np__.maximum(self.mask.sum(axis=(-2,-1)),1)**2
+
+    def psf(self,pad=2,centered=True):
+        '''
+        point spread function by FFT of the zero padded pupil function
+        ==========================================================
+        pad: PSF size over pupil size, the PSF is M x M, M = pad*n
+             rounded up to an even size fast for the FFT
+        centered: chief ray image point in the middle (fftshift),
+                  otherwise at [0,0]
+        output:
+        psf: (W,F,M,M) [y,x] indexed, normalized to the peak of the
+             aberration free pupil, so its peak is the Strehl ratio
+        pixel: (W,F,2) x, y pixel size in mm on the image
+        '''
+        from .. import fft_tools
+        size = fft_tools.next_fast_len(pad*self.n,even=True)
+        P = fft_tools.padded(self.pupil_function(),(size,size),key='psf')
+        psf = abs(fft_tools.fft2(P))**2
+        psf /= (__np__.maximum(self.mask.sum(axis=(-2,-1)),1)**2)[...,None,None]
+        if centered:
+            psf = fft_tools.fftshift(psf,axes=(-2,-1))
+        pixel = self.n/(size*self.cutoff())
+        return psf,pixel
+
+    def zernike(self,n_terms=37):
+        '''
+        (W,F,n_terms) least squares Zernike coefficients of the OPD in
+        waves, in the order and normalization of the zernike module,
+        e.g. zernike.Coefficient(*Z[w,f]) for the first 37 terms
+        '''
+        from .. import zernike
+        Z = __np__.zeros(self.W.shape[:2]+(n_terms,))
+        for index in __np__.ndindex(*self.W.shape[:2]):
+            # design matrices are cached, fields without vignetting share one
+            Z[index] = zernike.lstsqfit(self.W[index],n_terms,mask=self.mask[index],x=self.x)
+        return Z
+
+def trace_opd(Lens,n=64,wave_list=None,field_list=None,reference_wave=None,defocus=0):
+    '''
+    trace the OPD of an n x n pupil grid
+    ==========================================================
+    input:
+    Lens: Lens instance
+    n: grid points across the pupil
+    wave_list, field_list: default all
+    reference_wave: wavelength number whose chief ray image point is the
+                    reference sphere center of every wavelength, so that
+                    lateral color shows as tilt, default the middle one
+    defocus: image plane shift along z (CodeV thickness of SI)
+    output:
+    OPDMap
+    '''
+    from . import trace
+    if wave_list is None:
+        wave_list = range(1,len(Lens.wavelength_list)+1)
+    if field_list is None:
+        field_list = range(1,len(Lens.field_angle_list)+1)
+    if reference_wave is None:
+        reference_wave = int(len(Lens.wavelength_list)/2+1)
+    wave_list = list(wave_list)
+    field_list = list(field_list)
+    waves = __np__.asarray(wave_list+[reference_wave],dtype=int).reshape(-1,1,1)
+    x,inside = pupil_square(n)
+    xx,yy = __np__.meshgrid(x,x)
+    # chief ray first
+    grid = __np__.concatenate([[[0,0]],__np__.stack([xx[inside],yy[inside]],axis=-1)])
+    Pos,KLM = trace.launch_rays(Lens,grid,field_list,waves)
+    shape = (len(waves),len(field_list),len(grid))
+    Pos_img = __np__.empty(shape+(3,))
+    KLM_img = __np__.empty(shape+(3,))
+    OPL = __np__.empty(shape)
+    valid = __np__.empty(shape,dtype=bool)
+    trace.trace_image(Lens,__np__.broadcast_to(Pos,shape+(3,)),__np__.broadcast_to(KLM,shape+(3,)),
+                      waves,Pos_img,KLM_img,OPL_out=OPL,valid_out=valid)
+
+    index = __np__.asarray(Lens.surface_list[-2].indexlist)[waves-1]
+    if defocus:
+        t = defocus/KLM_img[...,2]
+        Pos_img += KLM_img*t[...,None]
+        OPL += index*t
+    center = Pos_img[-1,:,None,0,:]
+    OPL = reference_opl(Lens,Pos_img,KLM_img,OPL,index,center)[:-1]
+    wavelength = __np__.asarray([Lens.wavelength_list[w-1] for w in wave_list])*1e-6
+    opd = (OPL[...,:1] - OPL[...,1:])/wavelength[:,None,None]
+    valid = valid[:-1,:,1:] & valid[:-1,:,:1]
+
+    shape = (len(wave_list),len(field_list),n,n)
+    W = __np__.full(shape,__np__.nan)
+    W[...,inside] = __np__.where(valid,opd,__np__.nan)
+    mask = __np__.zeros(shape,dtype=bool)
+    mask[...,inside] = valid
+    slope = __np__.stack([_slope(grid[1:,i],KLM_img[:-1,:,1:,i],valid) for i in (0,1)],axis=-1)
+    return OPDMap(x,W,mask,wavelength,slope,wave_list,field_list)
+
+def _slope(p,D,valid):
+    # least squares slope of the direction cosines D (...,P) against p (P,)
+    count = valid.sum(axis=-1)
+    D = __np__.where(valid,D,0)
+    p = __np__.where(valid,p,0)
+    dp = p - (p.sum(axis=-1)/count)[...,None]
+    dp = __np__.where(valid,dp,0)
+    return (dp*D).sum(axis=-1)/(dp*dp).sum(axis=-1)
@@ -1,7 +1,6 @@
 # format output tools
 from __future__ import division as __division__
 import numpy as __np__
-import matplotlib.pyplot as __plt__
 
 
 # real ray tracing output
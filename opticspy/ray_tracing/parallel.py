@@ -0,0 +1,466 @@
+from __future__ import division as __division__
+import os
+import numpy as __np__
+from . import field
+
+# Parallel execution backends for the vectorized ray tracer
+# rays are split in contiguous chunks, every chunk is traced by one worker
+# and written into its own slice of the output, so the result does not
+# depend on the backend, the number of workers or the finishing order.
+# Worker processes exchange ray arrays through shared memory blocks (or
+# memory mapped files), only small descriptors are pickled.
+
+BACKENDS = ('serial','thread','process')
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def check_backend(backend):
+    if backend not in BACKENDS:
+        raise Exception('unknown trace backend: %s, use one of %s'%(backend,', '.join(BACKENDS)))
+
+def chunk_bounds(n_rays,n_workers,chunk_size=None):
+    '''
+    split n_rays into contiguous chunks
+    ==========================================================
+    input:
+    n_rays: number of rays
+    n_workers: number of workers
+    chunk_size: rays per chunk, default one chunk per worker
+    output:
+    list of (start,stop)
+    '''
+    if chunk_size is None:
+        chunk_size = -(-n_rays//max(n_workers,1))
+    chunk_size = max(int(chunk_size),1)
+    return [(start,min(start+chunk_size,n_rays)) for start in range(0,n_rays,chunk_size)]
+
+
+class SharedArray(object):
+    '''
+    numpy array living in a multiprocessing.shared_memory block,
+    or in a memory mapped file when filename is given.
+    Only descriptor() = (kind,name,shape,dtype) is pickled to other
+    processes, which get the same memory back with attach(descriptor).
+    '''
+    def __init__(self,kind,name,shape,dtype,owner):
+        self.kind = kind
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = __np__.dtype(dtype)
+        self.owner = owner
+        if kind == 'shm':
+            from multiprocessing import shared_memory
+            if owner:
+                nbytes = max(int(__np__.prod(self.shape))*self.dtype.itemsize,1)
+                self.shm = shared_memory.SharedMemory(create=True,size=nbytes)
+                self.name = self.shm.name
+            else:
+                self.shm = shared_memory.SharedMemory(name=name)
+            self.array = __np__.ndarray(self.shape,dtype=self.dtype,buffer=self.shm.buf)
+        elif kind == 'file':
+            self.array = __np__.memmap(name,dtype=self.dtype,shape=self.shape,
+                                       mode='w+' if owner else 'r+')
+        else:
+            raise Exception('unknown shared array kind: %s'%kind)
+
+    @classmethod
+    def create(cls,shape,dtype=float,filename=None):
+        if filename is None:
+            return cls('shm',None,shape,dtype,owner=True)
+        return cls('file',filename,shape,dtype,owner=True)
+
+    @classmethod
+    def copy_of(cls,array,filename=None):
+        array = __np__.asarray(array)
+        shared = cls.create(array.shape,array.dtype,filename)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls,descriptor):
+        kind,name,shape,dtype = descriptor
+        return cls(kind,name,shape,dtype,owner=False)
+
+    def descriptor(self):
+        return (self.kind,self.name,self.shape,self.dtype.str)
+
+    def close(self):
+        '''
+        release the memory, the owner also removes the shared block,
+        memory mapped files are flushed and kept
+        '''
+        if self.array is None:
+            return
+        if self.kind == 'file':
+            self.array.flush()
+            self.array = None
+            return
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedRayBundle(field.RayBundle):
+    '''
+    RayBundle whose Pos, KLM and valid arrays are SharedArray,
+    so worker processes can trace straight into slices of it
+    ==========================================================
+    create: allocate a new bundle, in shared memory or, with filename,
+            in the memory mapped files filename.Pos/.KLM/.valid
+    descriptor: small picklable tuple describing the bundle
+    attach: open the bundle of a descriptor in another process
+    close: release the memory (also done by the with statement)
+    '''
+    def __init__(self,shared,axes=None,surfaces=None):
+        self.shared = list(shared)
+        Pos,KLM,valid = [s.array for s in self.shared]
+        field.RayBundle.__init__(self,Pos,KLM,valid,axes=axes,surfaces=surfaces)
+
+    @classmethod
+    def create(cls,n_surfaces,shape,axes=None,filename=None,surfaces=None):
+        shape = (n_surfaces,)+tuple(shape)+(3,)
+        names = [None,None,None] if filename is None else \
+                [filename+'.Pos',filename+'.KLM',filename+'.valid']
+        shared = [SharedArray.create(shape,float,names[0]),
+                  SharedArray.create(shape,float,names[1]),
+                  SharedArray.create(shape[1:-1],bool,names[2])]
+        shared[2].array[...] = True
+        return cls(shared,axes=axes,surfaces=surfaces)
+
+    @classmethod
+    def attach(cls,descriptor):
+        descriptors,axes,surfaces = descriptor
+        return cls([SharedArray.attach(d) for d in descriptors],axes=axes,surfaces=surfaces)
+
+    def descriptor(self):
+        return ([s.descriptor() for s in self.shared],self.axes,self.surfaces)
+
+    def close(self):
+        self.Pos = self.KLM = self.valid = None
+        for s in self.shared:
+            s.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+
+def trace_rays(Lens,Pos,KLM,wave_num,backend='thread',n_workers=None,chunk_size=None,out=None,
+               surface_num=None):
+    '''
+    trace_rays with rays split across workers
+    ==========================================================
+    input:
+    Lens: Lens instance
+    Pos, KLM: (...,3) ray position and direction on the first surface
+    wave_num: wavelength number, or array broadcasting against Pos[...,0]
+    backend: 'serial', 'thread' or 'process'
+    n_workers: number of workers, default os.cpu_count()
+    chunk_size: rays per job, default one job per worker
+    out: RayBundle to trace into, the process backend writes
+         directly into a SharedRayBundle without any copy
+    surface_num: keep only the rays on this surface, default all surfaces
+    output:
+    Pos_all, KLM_all: (n_surfaces,...,3), same as trace.trace_rays,
+                      (1,...,3) with surface_num
+    '''
+    from . import trace
+    check_backend(backend)
+    Pos = __np__.asarray(Pos,dtype=float)
+    KLM = __np__.asarray(KLM,dtype=float)
+    wave_num = __np__.asarray(wave_num,dtype=int)
+    shape = __np__.broadcast_shapes(Pos.shape[:-1],KLM.shape[:-1],wave_num.shape)
+    n_surfaces = len(Lens.surface_list) if surface_num is None else 1
+    if out is not None and out.Pos.shape != (n_surfaces,)+shape+(3,):
+        raise Exception('output bundle shape %s does not match the rays %s'
+                        %(out.Pos.shape,(n_surfaces,)+shape+(3,)))
+    if n_workers is None:
+        n_workers = default_workers()
+    bounds = chunk_bounds(int(__np__.prod(shape)),n_workers,chunk_size)
+    Pos = __np__.broadcast_to(Pos,shape+(3,))
+    KLM = __np__.broadcast_to(KLM,shape+(3,))
+    if backend == 'serial' or len(bounds) <= 1:
+        return trace.trace_rays(Lens,Pos,KLM,wave_num,surface_num=surface_num,
+                                Pos_out=None if out is None else out.Pos,
+                                KLM_out=None if out is None else out.KLM)
+
+    Pos = Pos.reshape(-1,3)
+    KLM = KLM.reshape(-1,3)
+    wave_num = __np__.broadcast_to(wave_num,shape).reshape(-1)
+    if backend == 'thread':
+        if out is None:
+            out = field.RayBundle(__np__.empty((n_surfaces,)+shape+(3,)),
+                                  __np__.empty((n_surfaces,)+shape+(3,)))
+        Pos_out = out.Pos.reshape(n_surfaces,-1,3)
+        KLM_out = out.KLM.reshape(n_surfaces,-1,3)
+        _trace_threads(Lens,Pos,KLM,wave_num,Pos_out,KLM_out,bounds,n_workers,surface_num)
+        # reshape copies a strided output bundle, then copy the rays back
+        if not __np__.may_share_memory(Pos_out,out.Pos):
+            out.Pos[...] = Pos_out.reshape(out.Pos.shape)
+        if not __np__.may_share_memory(KLM_out,out.KLM):
+            out.KLM[...] = KLM_out.reshape(out.KLM.shape)
+        return out.Pos,out.KLM
+    if isinstance(out,SharedRayBundle):
+        _trace_processes(Lens,Pos,KLM,wave_num,out,bounds,n_workers,surface_num)
+        return out.Pos,out.KLM
+    with SharedRayBundle.create(n_surfaces,shape) as shared:
+        _trace_processes(Lens,Pos,KLM,wave_num,shared,bounds,n_workers,surface_num)
+        if out is None:
+            return shared.Pos.copy(),shared.KLM.copy()
+        out.Pos[...],out.KLM[...] = shared.Pos,shared.KLM
+        return out.Pos,out.KLM
+
+def trace_shared(Lens,Pos,KLM,wave_num,backend='process',n_workers=None,chunk_size=None,
+                 axes=None,filename=None,surface_num=None):
+    '''
+    trace rays into a new SharedRayBundle, the result stays in shared memory
+    (or in the memory mapped files filename.*) and is never pickled,
+    close it when done. With surface_num only that surface is kept.
+    '''
+    from . import trace
+    Pos = __np__.asarray(Pos,dtype=float)
+    KLM = __np__.asarray(KLM,dtype=float)
+    shape = __np__.broadcast_shapes(Pos.shape[:-1],KLM.shape[:-1],__np__.shape(wave_num))
+    if surface_num is None:
+        out = SharedRayBundle.create(len(Lens.surface_list),shape,axes=axes,filename=filename)
+    else:
+        out = SharedRayBundle.create(1,shape,axes=axes,filename=filename,
+                                     surfaces=(trace.surface_number(Lens,surface_num),))
+    try:
+        trace_rays(Lens,Pos,KLM,wave_num,backend=backend,n_workers=n_workers,
+                   chunk_size=chunk_size,out=out,surface_num=surface_num)
+    except Exception:
+        out.close()
+        raise
+    out.valid[...] = __np__.isfinite(out.Pos[-1]).all(axis=-1)
+    return out
+
+def trace_lenses(Lens_list,Pos,KLM,wave_num,backend='process',n_workers=None,filename=None):
+    '''
+    trace the same rays through several versions of one lens,
+    e.g. the perturbed lenses of a Monte Carlo tolerance run
+    ==========================================================
+    input:
+    Lens_list: Lens instances, all with the same number of surfaces
+    Pos, KLM, wave_num: launch rays, see trace_rays
+    backend: 'serial', 'thread' or 'process', one job per lens
+    output:
+    SharedRayBundle, axes ('lens',...), shape (n_surfaces,n_lens,...,3)
+    '''
+    check_backend(backend)
+    n_surfaces = set(len(L.surface_list) for L in Lens_list)
+    if len(n_surfaces) != 1:
+        raise Exception('all lenses must have the same number of surfaces')
+    Pos = __np__.asarray(Pos,dtype=float)
+    KLM = __np__.asarray(KLM,dtype=float)
+    wave_num = __np__.asarray(wave_num,dtype=int)
+    shape = __np__.broadcast_shapes(Pos.shape[:-1],KLM.shape[:-1],wave_num.shape)
+    n_axes = len(shape)
+    axes = ('lens',)+(('ray',) if n_axes == 1 else tuple('axis%d'%i for i in range(n_axes)))
+    out = SharedRayBundle.create(n_surfaces.pop(),(len(Lens_list),)+shape,
+                                 axes=axes,filename=filename)
+    Pos = __np__.broadcast_to(Pos,shape+(3,))
+    KLM = __np__.broadcast_to(KLM,shape+(3,))
+    wave_num = __np__.broadcast_to(wave_num,shape)
+    if n_workers is None:
+        n_workers = default_workers()
+    try:
+        _trace_lens_jobs(Lens_list,Pos,KLM,wave_num,out,backend,n_workers)
+    except Exception:
+        out.close()
+        raise
+    out.valid[...] = __np__.isfinite(out.Pos[-1]).all(axis=-1)
+    return out
+
+def _trace_lens_jobs(Lens_list,Pos,KLM,wave_num,out,backend,n_workers):
+    if backend == 'process':
+        inputs = [SharedArray.copy_of(Pos),SharedArray.copy_of(KLM),SharedArray.copy_of(wave_num)]
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+            descriptors = [s.descriptor() for s in inputs]+[out.descriptor()]
+            with ProcessPoolExecutor(max_workers=min(n_workers,len(Lens_list)),
+                                     initializer=_init_worker,initargs=(None,descriptors)) as executor:
+                list(executor.map(_trace_shared_lens,enumerate(Lens_list)))
+        finally:
+            for s in inputs:
+                s.close()
+    else:
+        jobs = [(i,L,Pos,KLM,wave_num,out) for i,L in enumerate(Lens_list)]
+        if backend == 'thread':
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                list(executor.map(lambda job: _trace_lens(*job),jobs))
+        else:
+            for job in jobs:
+                _trace_lens(*job)
+
+def reduce_stream(Lens,chunks,reducers,backend='process',n_workers=None,surface_num=-1):
+    '''
+    trace.trace_stream and cal_tools.reduce_stream with the chunks spread
+    across workers
+    ==========================================================
+    input:
+    Lens: Lens instance
+    chunks: iterable of (Pos,KLM,wave_num), e.g. field.pupil_chunks
+    reducers: new cal_tools reducers, give EncircledEnergy a center
+    backend: 'serial', 'thread' or 'process'
+    surface_num: surface to reduce, default image
+    output:
+    reducers, updated
+    Every chunk is reduced by fresh copies of the reducers in a worker,
+    only the small reducers come back and are merged in chunk order, so
+    the result does not depend on the backend or the number of workers.
+    At most 2*n_workers chunks are in flight, memory stays bounded.
+    Worker processes read the launch rays from 2*n_workers reused shared
+    memory slots, a job only pickles the slot number and array shapes.
+    '''
+    import copy
+    import functools
+    from collections import deque
+    from . import cal_tools
+    check_backend(backend)
+    if n_workers is None:
+        n_workers = default_workers()
+    templates = copy.deepcopy(reducers)
+    if backend == 'serial':
+        for chunk in chunks:
+            cal_tools.merge_reducers([reducers,_reduce_chunk(Lens,templates,surface_num,chunk)])
+        return reducers
+    if backend == 'thread':
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=n_workers)
+        job = functools.partial(_reduce_chunk,Lens,templates,surface_num)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=n_workers,initializer=_init_reduce_worker,
+                                       initargs=(Lens,templates,surface_num))
+        job = _reduce_worker_chunk
+    # (future,slot) in chunk order, only the process backend fills the slots
+    slots = [[None,None,None] for i in range(2*n_workers)]
+    free = deque(range(len(slots)))
+    pending = deque()
+    try:
+        with executor:
+            for chunk in chunks:
+                if not free:
+                    future,slot = pending.popleft()
+                    cal_tools.merge_reducers([reducers,future.result()])
+                    free.append(slot)
+                slot = free.popleft()
+                if backend == 'process':
+                    chunk = _share_chunk(slots,slot,chunk)
+                pending.append((executor.submit(job,chunk),slot))
+            while pending:
+                future,slot = pending.popleft()
+                cal_tools.merge_reducers([reducers,future.result()])
+    finally:
+        for slot in slots:
+            for shared in slot:
+                if shared is not None:
+                    shared.close()
+    return reducers
+
+def _share_chunk(slots,i,chunk):
+    # copy the chunk into the shared arrays of slot i, grown when too small,
+    # return the job (i,[(descriptor,shape)]) for _reduce_worker_chunk
+    arrays = [__np__.asarray(chunk[0],dtype=float),__np__.asarray(chunk[1],dtype=float),
+              __np__.asarray(chunk[2],dtype=int)]
+    job = []
+    for k,a in enumerate(arrays):
+        shared = slots[i][k]
+        if shared is None or shared.shape[0] < a.size:
+            if shared is not None:
+                shared.close()
+            shared = slots[i][k] = SharedArray.create((max(a.size,1),),a.dtype)
+        shared.array[:a.size] = a.ravel()
+        job.append((shared.descriptor(),a.shape))
+    return i,job
+
+def _reduce_chunk(Lens,templates,surface_num,chunk):
+    import copy
+    from . import trace
+    Pos,KLM,wave_num = chunk
+    Pos,KLM = trace.trace_image(Lens,Pos,KLM,wave_num,surface_num=surface_num)
+    xy = __np__.moveaxis(Pos[...,:2],-1,0)
+    return [copy.deepcopy(reducer).update(xy) for reducer in templates]
+
+
+def _trace_chunk(Lens,Pos,KLM,wave_num,Pos_all,KLM_all,start,stop,surface_num=None):
+    from . import trace
+    trace.trace_rays(Lens,Pos[start:stop],KLM[start:stop],wave_num[start:stop],
+                     surface_num=surface_num,Pos_out=Pos_all[:,start:stop],
+                     KLM_out=KLM_all[:,start:stop])
+
+def _trace_lens(i,Lens,Pos,KLM,wave_num,out):
+    from . import trace
+    trace.trace_rays_inplace(Lens,Pos,KLM,wave_num,out.Pos[:,i],out.KLM[:,i])
+
+def _trace_threads(Lens,Pos,KLM,wave_num,Pos_all,KLM_all,bounds,n_workers,surface_num=None):
+    # numpy releases the GIL inside the array operations
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        jobs = [executor.submit(_trace_chunk,Lens,Pos,KLM,wave_num,Pos_all,KLM_all,start,stop,surface_num)
+                for start,stop in bounds]
+        for job in jobs:
+            job.result()
+
+# per process state of the worker pool, filled by _init_worker
+_worker = {}
+
+def _init_worker(Lens,descriptors):
+    _worker['Lens'] = Lens
+    _worker['inputs'] = [SharedArray.attach(d) for d in descriptors[:-1]]
+    _worker['out'] = SharedRayBundle.attach(descriptors[-1])
+
+def _init_reduce_worker(Lens,templates,surface_num):
+    _worker['slots'] = {}
+    _worker['Lens'] = Lens
+    _worker['templates'] = templates
+    _worker['surface_num'] = surface_num
+
+def _reduce_worker_chunk(job):
+    # views of the launch rays in the shared slot, attached once per slot
+    i,arrays = job
+    attached = _worker.setdefault('slots',{})
+    chunk = []
+    for k,(descriptor,shape) in enumerate(arrays):
+        shared = attached.get((i,k))
+        if shared is None or shared.name != descriptor[1]:
+            if shared is not None:
+                shared.close()
+            shared = attached[(i,k)] = SharedArray.attach(descriptor)
+        chunk.append(shared.array[:int(__np__.prod(shape))].reshape(shape))
+    return _reduce_chunk(_worker['Lens'],_worker['templates'],_worker['surface_num'],chunk)
+
+def _trace_shared_chunk(job):
+    Pos,KLM,wave_num = [a.array for a in _worker['inputs']]
+    out = _worker['out']
+    n_surfaces = out.n_surfaces
+    _trace_chunk(_worker['Lens'],Pos,KLM,wave_num,out.Pos.reshape(n_surfaces,-1,3),
+                 out.KLM.reshape(n_surfaces,-1,3),*job)
+    return job
+
+def _trace_shared_lens(job):
+    i,Lens = job
+    Pos,KLM,wave_num = [a.array for a in _worker['inputs']]
+    _trace_lens(i,Lens,Pos,KLM,wave_num,_worker['out'])
+    return i
+
+def _trace_processes(Lens,Pos,KLM,wave_num,out,bounds,n_workers,surface_num=None):
+    # the launch rays are copied once into shared memory, workers get the
+    # lens once through the pool initializer and afterwards only the
+    # (start,stop) of their chunk, results are written straight into out
+    from concurrent.futures import ProcessPoolExecutor
+    inputs = [SharedArray.copy_of(Pos),SharedArray.copy_of(KLM),SharedArray.copy_of(wave_num)]
+    try:
+        descriptors = [s.descriptor() for s in inputs]+[out.descriptor()]
+        with ProcessPoolExecutor(max_workers=min(n_workers,len(bounds)),initializer=_init_worker,
+                                 initargs=(Lens,descriptors)) as executor:
+            list(executor.map(_trace_shared_chunk,[(start,stop,surface_num) for start,stop in bounds]))
+    finally:
+        for s in inputs:
+            s.close()
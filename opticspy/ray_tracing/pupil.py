@@ -0,0 +1,138 @@
+from __future__ import division as __division__
+import numpy as __np__
+
+# Pupil sampling in the normalized entrance pupil (unit circle)
+# every sampler returns grid (N,2) x,y and weights (N,) summing to 1,
+# a pupil average of f is (weights*f(grid)).sum()
+
+GOLDEN_ANGLE = __np__.pi*(3 - __np__.sqrt(5))
+
+def uniform_weights(grid):
+    return __np__.full(len(grid),1/max(len(grid),1))
+
+def polar2grid(r,theta):
+    return __np__.stack([r*__np__.cos(theta),r*__np__.sin(theta)],axis=-1)
+
+def unit_square2disk(u):
+    '''
+    map (N,2) points of the unit square to the unit circle, area preserving
+    '''
+    return polar2grid(__np__.sqrt(u[:,0]),2*__np__.pi*u[:,1])
+
+def square(n):
+    '''
+    square grid, n points across the diameter, points outside the pupil dropped
+    n = 12 ==> 88 points
+    '''
+    x1 = __np__.linspace(-1,1,n)
+    x,y = __np__.meshgrid(x1,x1,indexing='ij')
+    inside = x**2 + y**2 <= 1
+    grid = __np__.stack([x[inside],y[inside]],axis=-1)
+    return grid,uniform_weights(grid)
+
+def hexapolar(n,center=True):
+    '''
+    rings of equally spaced points, ring i (1..n) has 6*i points at radius i/n
+    center: add the pupil center as one more point
+    weights: area of the annulus around every ring shared by its points
+    '''
+    grids = [__np__.zeros((1,2))] if center else []
+    counts = [1] if center else []
+    for i in range(1,n+1):
+        theta = __np__.linspace(0,360-360/i/6,i*6)
+        grids.append(polar2grid(1/n*i,theta*__np__.pi/180))
+        counts.append(6*i)
+    # annulus edges halfway between the rings
+    edges = __np__.concatenate([[0],(__np__.arange(0 if center else 1,n)+0.5)/n,[1]])
+    area = __np__.diff(edges**2)
+    weights = __np__.repeat(area/__np__.asarray(counts),counts)
+    return __np__.concatenate(grids),weights
+
+def circular(n):
+    '''
+    hexapolar rings without the center point, the old 'circular' grid
+    n = 4 ==> 60 points
+    '''
+    return hexapolar(n,center=False)
+
+def gauss(n_rings,n_arms=None):
+    '''
+    Gaussian quadrature over the circle (G. W. Forbes, JOSA A 5, 1988)
+    ========================================
+    n_rings: number of rings, Gauss-Legendre nodes in r**2
+    n_arms: number of arms, default 2*n_rings+1
+    Pupil averages of polynomials in x,y are exact up to
+    order 2*n_rings-1 in r**2 and n_arms-1 in angle.
+    '''
+    if n_arms is None:
+        n_arms = 2*n_rings+1
+    u,w = __np__.polynomial.legendre.leggauss(n_rings)
+    r = __np__.sqrt((u+1)/2)
+    theta = (__np__.arange(n_arms)+0.5)*2*__np__.pi/n_arms
+    r,theta = __np__.meshgrid(r,theta,indexing='ij')
+    grid = polar2grid(r.ravel(),theta.ravel())
+    weights = __np__.repeat(w/2/n_arms,n_arms)
+    return grid,weights
+
+def fibonacci(n):
+    '''
+    Fibonacci (golden angle) spiral, n nearly uniformly spread points
+    '''
+    i = __np__.arange(n)
+    return polar2grid(__np__.sqrt((i+0.5)/n),i*GOLDEN_ANGLE),__np__.full(n,1/n)
+
+def radical_inverse(i,base):
+    '''
+    van der Corput radical inverse of the integers i in base
+    '''
+    i = __np__.array(i,dtype=__np__.int64)
+    result = __np__.zeros(i.shape)
+    f = 1/base
+    while __np__.any(i > 0):
+        result += f*(i % base)
+        i //= base
+        f /= base
+    return result
+
+def halton(n,skip=1):
+    '''
+    Halton sequence in bases 2 and 3 mapped to the circle
+    skip: number of leading points left out, the first one is 0,0
+    '''
+    i = __np__.arange(skip,skip+n)
+    u = __np__.stack([radical_inverse(i,2),radical_inverse(i,3)],axis=-1)
+    return unit_square2disk(u),__np__.full(n,1/n)
+
+def sobol(n,seed=None,scramble=True):
+    '''
+    Sobol sequence mapped to the circle, needs scipy (scipy.stats.qmc),
+    n should be a power of 2
+    '''
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        raise Exception('sobol sampling needs scipy >= 1.7, use halton instead')
+    u = qmc.Sobol(d=2,scramble=scramble,seed=seed).random(n)
+    return unit_square2disk(u),__np__.full(n,1/n)
+
+def random(n,seed=None):
+    '''
+    uniform random points, seed None uses the global numpy random state
+    '''
+    rng = __np__.random if seed is None else __np__.random.default_rng(seed)
+    r = __np__.sqrt(rng.random(n))    #sqrt(random(0--r^2)) get radius
+    theta = 2*__np__.pi*rng.random(n)  # random(0--2pi) get theta
+    return polar2grid(r,theta),__np__.full(n,1/n)
+
+SAMPLERS = {'grid':square,'square':square,'circular':circular,'hexapolar':hexapolar,
+            'gauss':gauss,'fibonacci':fibonacci,'halton':halton,'sobol':sobol,
+            'random':random}
+
+def sample(grid_type,n,**kwargs):
+    '''
+    pupil sampling by name, see SAMPLERS
+    output: grid (N,2), weights (N,)
+    '''
+    if grid_type not in SAMPLERS:
+        raise Exception('No this kind of grid: %s, use one of %s'%(grid_type,', '.join(sorted(SAMPLERS))))
+    return SAMPLERS[grid_type](n,**kwargs)
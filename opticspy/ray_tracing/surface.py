@@ -1,6 +1,5 @@
 from __future__ import division as __division__
 import numpy as __np__
-import matplotlib.pyplot as __plt__
 from . import glass_funcs
 
 # Ray Class
@@ -10,14 +9,53 @@ class Surface(object):
     Surface Class
     '''
     def __init__(self,wavelength_list,number,radius,thickness,glass,STO,__diameter__):
+        self._revision = 0
         self.wavelength_list = wavelength_list
         self.number = number
         self.radius = radius
         self.glass = glass
-        self.indexlist = glass_funcs.glass2indexlist(wavelength_list,glass)
         self.thickness = thickness
         self.STO = STO
         self.__diameter__ = __diameter__
+        # clear aperture semi-diameter, rays outside are vignetted,
+        # None means no clipping (__diameter__ is only for drawing)
+        self.aperture = None
+
+    # radius, thickness, glass and STO changes bump the revision number,
+    # Lens uses it to know when cached first order data is out of date
+    @property
+    def radius(self):
+        return self._radius
+    @radius.setter
+    def radius(self,value):
+        self._radius = value
+        self._revision += 1
+
+    @property
+    def thickness(self):
+        return self._thickness
+    @thickness.setter
+    def thickness(self,value):
+        self._thickness = value
+        self._revision += 1
+
+    @property
+    def glass(self):
+        return self._glass
+    @glass.setter
+    def glass(self,value):
+        self._glass = value
+        self.indexlist = glass_funcs.glass2indexlist(self.wavelength_list,value)
+        self._revision += 1
+
+    @property
+    def STO(self):
+        return self._STO
+    @STO.setter
+    def STO(self,value):
+        self._STO = value
+        self._revision += 1
+
     def list(self):
         print('self_number',self.number)
         print(self.radius,self.thickness,self.indexlist)
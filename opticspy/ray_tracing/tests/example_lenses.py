@@ -0,0 +1,15 @@
+import os
+
+from opticspy.ray_tracing import codev
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       'CodeV_examples', 'cooke_triplet')
+SEQ = os.path.join(EXAMPLE, 'ag_triplet.seq')
+
+
+def cooke_triplet(EPD=10.0):
+    # the CodeV example triplet, paraxial data ready for tracing
+    Lens = codev.readseq(SEQ)
+    Lens.EPD = EPD
+    Lens.refresh_paraxial()
+    return Lens
@@ -0,0 +1,63 @@
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy.ray_tracing import aiming, pupil, trace
+
+from example_lenses import cooke_triplet
+
+
+class TestRayAiming(TestCase):
+    def setUp(self):
+        self.Lens = cooke_triplet()
+        self.Lens.ray_aiming = True
+        self.grid, _ = pupil.hexapolar(4)
+
+    def stop_xy(self, Pos, KLM):
+        Pos_out = np.empty(Pos.shape)
+        KLM_out = np.empty(Pos.shape)
+        trace.trace_image(self.Lens, Pos, KLM, 2, Pos_out, KLM_out,
+                          surface_num=aiming.stop_number(self.Lens))
+        return Pos_out[..., :2]
+
+    def test_rays_hit_the_stop(self):
+        Pos, KLM = trace.launch_rays(self.Lens, self.grid, [1, 2, 3], 2)
+        target = self.grid * aiming.stop_radius(self.Lens)
+        np.testing.assert_allclose(self.stop_xy(Pos, KLM), np.broadcast_to(target, Pos.shape[:-1] + (2,)), atol=1e-8)
+
+    def test_cache_follows_the_lens(self):
+        Pos, KLM = trace.launch_rays(self.Lens, self.grid, [3], 2)
+        Pos_cached, _ = trace.launch_rays(self.Lens, self.grid, [3], 2)
+        np.testing.assert_array_equal(Pos, Pos_cached)
+
+        self.Lens.surface_list[2].thickness += 0.05
+        Pos_new, KLM_new = trace.launch_rays(self.Lens, self.grid, [3], 2)
+        assert not np.array_equal(Pos, Pos_new)
+        target = self.grid * aiming.stop_radius(self.Lens)
+        np.testing.assert_allclose(self.stop_xy(Pos_new, KLM_new)[0, 0], target, atol=1e-8)
+
+    def test_cache_follows_the_epd(self):
+        trace.launch_rays(self.Lens, self.grid, [3], 2)
+        self.Lens.EPD = 5.0
+        Pos, KLM = trace.launch_rays(self.Lens, self.grid, [3], 2)
+        target = self.grid * aiming.stop_radius(self.Lens)
+        np.testing.assert_allclose(self.stop_xy(Pos, KLM)[0, 0], target, atol=1e-8)
+
+    def test_cache_is_bounded(self):
+        for n in range(aiming.AIM_CACHE_GRIDS + 3):
+            trace.launch_rays(self.Lens, self.grid[n:n + 5], [1], 2)
+        self.assertEqual(len(self.Lens.aim_cache), aiming.AIM_CACHE_GRIDS)
+
+    def test_unreachable_field_is_not_cached(self):
+        angles = [[0, 0], [0, 45]]
+        with np.errstate(invalid='ignore'):
+            for attempt in range(2):
+                # warns every time, the failed aim is never reused
+                with self.assertWarns(RuntimeWarning):
+                    Pos, KLM = aiming.aim_rays(self.Lens, self.grid, angles, 2)
+            xy = self.stop_xy(Pos, KLM)
+        solutions = list(self.Lens.aim_cache.values())[-1]
+        self.assertEqual(list(solutions), [((0.0, 0.0), 2)])
+        assert all(np.isfinite(aim).all() for _, aim in solutions.values())
+        target = self.grid * aiming.stop_radius(self.Lens)
+        np.testing.assert_allclose(xy[0, 0], target, atol=1e-8)
@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy.ray_tracing import cal_tools, trace
+
+from example_lenses import cooke_triplet
+
+
+class TestAnalysis(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.Lens = cooke_triplet()
+
+    def test_spot_diagram(self):
+        spot = cal_tools.spot_diagram(self.Lens, n=12)
+        W, F = len(self.Lens.wavelength_list), len(self.Lens.field_angle_list)
+        self.assertEqual(spot.rms.shape, (W, F))
+        bundle = trace.trace_spotdiagram(self.Lens, 12, 'grid')
+        xy = bundle.xy(-1)
+        np.testing.assert_allclose(spot.x, xy[0])
+        np.testing.assert_allclose(spot.rms, cal_tools.rms(xy))
+        # the on axis spot is centered on the axis
+        np.testing.assert_allclose(spot.centroid[:, 0], 0, atol=1e-12)
+        np.testing.assert_allclose(spot.airy, 1.22*np.asarray(self.Lens.wavelength_list)*1e-6*self.Lens.FNO)
+        assert np.all((spot.frac_inside >= 0) & (spot.frac_inside <= 1))
+
+    def test_ray_fan(self):
+        fan = cal_tools.ray_fan(self.Lens, n_Y=21, n_X=11)
+        self.assertEqual(fan.Ey.shape[-1], 21)
+        np.testing.assert_array_equal(fan.Ey[..., 10], 0)
+        np.testing.assert_array_equal(fan.Ex[..., 0], 0)
+        # on axis the fans are odd and the x fan is the y fan rotated
+        np.testing.assert_allclose(fan.Ey[:, 0], -fan.Ey[:, 0, ::-1], atol=1e-12)
+        np.testing.assert_allclose(fan.Ex[:, 0], fan.Ey[:, 0, 10:], atol=1e-12)
@@ -0,0 +1,50 @@
+import threading
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy import fft_tools
+
+
+class TestFFTTools(TestCase):
+    def test_real_fft2_matches_numpy(self):
+        a = np.random.RandomState(0).rand(2, 15, 12)
+        for s in [None, (15, 12), (20, 16), (21, 25)]:
+            np.testing.assert_allclose(fft_tools.fft2(a, s), np.fft.fft2(a, s), atol=1e-10)
+            np.testing.assert_allclose(fft_tools.rfft2(a, s), np.fft.rfft2(a, s), atol=1e-10)
+        np.testing.assert_allclose(fft_tools.fft2(a, axes=(0, 1)), np.fft.fft2(a, axes=(0, 1)), atol=1e-10)
+
+    def test_next_fast_len(self):
+        self.assertEqual(fft_tools.next_fast_len(97), 100)
+        self.assertEqual(fft_tools.next_fast_len(121), 125)
+        self.assertEqual(fft_tools.next_fast_len(121, even=True), 128)
+
+    def test_padded_buffer_is_reused(self):
+        a = np.ones((3, 3))
+        out = fft_tools.padded(a, (5, 5), key='test')
+        self.assertEqual(out.sum(), 9)
+        again = fft_tools.padded(2*a, (5, 5), key='test')
+        self.assertIs(again, out)
+        self.assertEqual(again.sum(), 18)
+        fft_tools.clear_buffers()
+
+    def test_padded_buffer_per_thread(self):
+        a = np.ones((3, 3))
+        out = fft_tools.padded(a, (5, 5), key='test')
+        other = []
+        thread = threading.Thread(target=lambda: other.append(fft_tools.padded(2*a, (5, 5), key='test')))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], out)
+        self.assertEqual(out.sum(), 9)
+        fft_tools.clear_buffers()
+
+    def test_padded_buffers_are_bounded(self):
+        for n in range(4, 4 + 2*fft_tools.MAX_BUFFERS):
+            fft_tools.padded(np.ones((3, 3)), (n, n), key='test')
+        self.assertEqual(len(fft_tools.__buffers__()), fft_tools.MAX_BUFFERS)
+        size = int(np.sqrt(fft_tools.MAX_BUFFER_BYTES/16)) + 1
+        big = fft_tools.padded(np.ones((3, 3), dtype=complex), (size, size), key='test')
+        self.assertIsNot(fft_tools.padded(np.ones((3, 3), dtype=complex), (size, size), key='test'), big)
+        self.assertLessEqual(sum(b.nbytes for b in fft_tools.__buffers__().values()), fft_tools.MAX_BUFFER_BYTES)
+        fft_tools.clear_buffers()
@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy.ray_tracing import first_order_tools
+
+from example_lenses import cooke_triplet
+
+
+FIRST_ORDER = {
+    'EFL': lambda Lens: first_order_tools.EFL(Lens, 0, 0),
+    'EP': first_order_tools.EP,
+    'EX': first_order_tools.EX,
+    'OAL': first_order_tools.OAL,
+    'image_position': first_order_tools.image_position,
+}
+
+
+class TestFirstOrderCache(TestCase):
+    def setUp(self):
+        self.Lens = cooke_triplet()
+
+    def assert_fresh(self, changed):
+        # every cached value equals a recomputation, the ones in changed differ from before
+        for name, func in FIRST_ORDER.items():
+            value = getattr(self.Lens, name)
+            np.testing.assert_allclose(value, func(self.Lens), err_msg=name)
+            if name in changed:
+                assert not np.allclose(value, self.before[name]), name
+
+    def change(self, changed, edit):
+        self.before = {name: getattr(self.Lens, name) for name in FIRST_ORDER}
+        edit(self.Lens.surface_list)
+        self.assert_fresh(changed)
+
+    def test_radius(self):
+        # in front of the stop, then behind it
+        self.change(['EFL', 'EP', 'image_position'], lambda s: setattr(s[2], 'radius', 200.0))
+        self.change(['EFL', 'EX', 'image_position'], lambda s: setattr(s[5], 'radius', 40.0))
+
+    def test_thickness(self):
+        self.change(['EFL', 'EP', 'OAL', 'image_position'], lambda s: setattr(s[2], 'thickness', 5.5))
+
+    def test_glass(self):
+        self.change(['EFL', 'EP', 'image_position'], lambda s: setattr(s[1], 'glass', 'N-F2_schott'))
+
+    def test_stop(self):
+        def move_stop(s):
+            s[3].STO = False
+            s[2].STO = True
+        self.change(['EP', 'EX'], move_stop)
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy.ray_tracing import glass_funcs
+from opticspy.ray_tracing.glass_function import glassIndex
+from opticspy.ray_tracing.glass_function.refractiveIndex import (Material, TabulatedRefractiveIndexData,
+                                                                 parseMaterialData)
+
+GLASS = os.path.join(glassIndex.defaultDatabasePath, 'glass')
+WAVELENGTHS = np.array([486.1, 546.1, 587.6, 656.3, 1014.0])
+
+
+class TestGlass(TestCase):
+    def test_scalar_and_array_input(self):
+        for book, page in [('schott', 'N-BK7'), ('schott', 'N-F2'), ('ami', 'AMTIR-1')]:
+            material = glass_funcs.get_material(book, page)
+            wavelengths = WAVELENGTHS if book != 'ami' else WAVELENGTHS*5
+            n = material.getRefractiveIndex(wavelengths)
+            assert n.shape == wavelengths.shape
+            np.testing.assert_array_equal(n, [material.getRefractiveIndex(w) for w in wavelengths])
+            np.testing.assert_array_equal(material.getRefractiveIndex(wavelengths.reshape(-1, 1))[:, 0], n)
+
+    def test_known_index(self):
+        self.assertAlmostEqual(glass_funcs.glass_index('schott', 'N-BK7', 587.6), 1.5168, places=4)
+        self.assertAlmostEqual(glass_funcs.glass_index('schott', 'N-F2', 587.6), 1.6200, places=4)
+
+    def test_index_file_matches_yaml(self):
+        for book, page in [('schott', 'N-BK7'), ('ami', 'AMTIR-1')]:
+            wavelengths = WAVELENGTHS if book != 'ami' else WAVELENGTHS*5
+            yaml = Material(os.path.join(GLASS, book, page + '.yml'))
+            np.testing.assert_array_equal(glass_funcs.get_material(book, page).getRefractiveIndex(wavelengths),
+                                          yaml.getRefractiveIndex(wavelengths))
+
+    def test_tabulated_matches_formula(self):
+        formula = glass_funcs.get_material('schott', 'N-BK7').refractiveIndex
+        table = np.linspace(400, 1100, 1401)
+        tabulated = TabulatedRefractiveIndexData(table/1000, formula.getRefractiveIndex(table))
+        np.testing.assert_allclose(tabulated.getRefractiveIndex(WAVELENGTHS), formula.getRefractiveIndex(WAVELENGTHS),
+                                   atol=1e-6)
+        # table rows exactly, linear interpolation in between
+        data = parseMaterialData([{'type': 'tabulated n', 'data': '0.5 1.5\n0.7 1.4\n0.6 1.45 0.1\n'}])
+        material = Material(records=data)
+        np.testing.assert_allclose(material.getRefractiveIndex([500, 600, 650]), [1.5, 1.45, 1.425])
+
+    def test_out_of_range(self):
+        with self.assertRaises(Exception):
+            glass_funcs.get_material('schott', 'N-BK7').getRefractiveIndex([500, 3000])
+
+    def test_index_follows_database(self):
+        database = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, database)
+        os.makedirs(os.path.join(database, 'glass', 'schott'))
+        yml = os.path.join(database, 'glass', 'schott', 'N-BK7.yml')
+        shutil.copy(os.path.join(GLASS, 'schott', 'N-BK7.yml'), yml)
+        filename = os.path.join(database, 'index.bin')
+        n = glassIndex.openIndex(database, filename).getMaterial('schott', 'N-BK7').getRefractiveIndex(587.6)
+        self.assertAlmostEqual(n, 1.5168, places=4)
+        # edit the first Sellmeier term, the index must not serve the old coefficients
+        with open(yml) as fid:
+            text = fid.read().replace('coefficients: 0 1.03961212', 'coefficients: 0 1.13961212')
+        with open(yml, 'w') as fid:
+            fid.write(text)
+        os.utime(yml, ns=(0, os.stat(yml).st_mtime_ns + 10**9))
+        index = glassIndex.openIndex(database, filename)
+        self.assertEqual(index.fingerprint, glassIndex.databaseFingerprint(database))
+        self.assertGreater(index.getMaterial('schott', 'N-BK7').getRefractiveIndex(587.6), n + 0.01)
@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# import the ray tracing modules in a fresh interpreter, report what got loaded
+SCRIPT = '''
+import sys, time
+t = time.perf_counter()
+import opticspy
+from opticspy.ray_tracing import lens, trace, field, codev
+print(time.perf_counter() - t)
+print(' '.join(sorted(m for m in sys.modules if m.split('.')[0] in ('matplotlib', 'unwrap')
+                      or m.startswith('opticspy.mplot3d') or m.startswith('opticspy.zernike'))))
+'''
+
+
+class TestImportTime(TestCase):
+    def test_headless_import(self):
+        out = subprocess.check_output([sys.executable, '-c', SCRIPT], cwd=ROOT)
+        seconds, modules = (out.decode().split('\n') + [''])[:2]
+        # the time depends on the machine load, it is only reported
+        print('ray tracing import time: {:.3f} s'.format(float(seconds)))
+        assert modules.split() == [], modules
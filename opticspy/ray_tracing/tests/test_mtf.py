@@ -0,0 +1,37 @@
+import os
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy.ray_tracing import cal_tools, codev, opd
+
+from example_lenses import EXAMPLE, cooke_triplet
+
+
+class TestDiffractionMTF(TestCase):
+    def setUp(self):
+        self.Lens = cooke_triplet()
+
+    def test_diffraction_limit(self):
+        opd_map = opd.trace_opd(self.Lens, 32)
+        opd_map.W[...] = np.where(opd_map.mask, 0, np.nan)
+        cutoff = opd_map.cutoff()
+        nu = np.linspace(0, 1, 11)
+        mtf = cal_tools.DiffractionMTF(opd_map, nu*cutoff[1, 0, 0], wave_weights=[0, 1, 0])
+        limit = 2/np.pi*(np.arccos(nu) - nu*np.sqrt(1 - nu**2))
+        np.testing.assert_allclose(mtf.tan[0], limit, atol=0.02)
+        np.testing.assert_allclose(mtf.sag[0], limit, atol=0.02)
+
+    def test_pad_too_small(self):
+        opd_map = opd.trace_opd(self.Lens, 8, wave_list=[2], field_list=[1])
+        with self.assertRaises(ValueError):
+            cal_tools.DiffractionMTF(opd_map, pad=1.5)
+
+    def test_codev_cooke_triplet(self):
+        reference = codev.readmtf(os.path.join(EXAMPLE, 'MTF.txt'))
+        # CodeV thickness of the image surface SI is a defocus
+        defocus = self.Lens.surface_list[-1].thickness
+        mtf = cal_tools.diffraction_mtf(self.Lens, reference['frequency'], n=64,
+                                        wave_weights=reference['wave_weights'], defocus=defocus)
+        np.testing.assert_allclose(mtf.sag, reference['rad'], atol=0.035)
+        np.testing.assert_allclose(mtf.tan, reference['tan'], atol=0.035)
@@ -0,0 +1,34 @@
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy import interferometer_zenike
+from opticspy.ray_tracing import cal_tools, opd
+
+from example_lenses import cooke_triplet
+
+
+class TestOPDMap(TestCase):
+    def setUp(self):
+        self.Lens = cooke_triplet()
+        self.opd_map = opd.trace_opd(self.Lens, 64)
+
+    def test_rms_matches_quadrature(self):
+        # same reference sphere only for the reference wavelength, the
+        # others carry the lateral color as tilt in the OPD map
+        quadrature = cal_tools.pupil_quadrature(self.Lens, n_rings=6)
+        np.testing.assert_allclose(self.opd_map.rms(tilt=True)[1], quadrature.rms_wavefront[1], rtol=0.01)
+
+    def test_strehl_is_the_on_axis_psf_peak(self):
+        psf, pixel = self.opd_map.psf()
+        n = psf.shape[-1]
+        np.testing.assert_allclose(psf[:, 0, n//2, n//2], self.opd_map.strehl(tilt=True)[:, 0])
+        assert np.all(self.opd_map.strehl() <= 1)
+
+    def test_zernike_round_trip(self):
+        x = self.opd_map.x
+        r = np.hypot(x[None, :], x[:, None])
+        u = np.arctan2(x[:, None], x[None, :])
+        C = list(np.linspace(-0.5, 0.5, 37))
+        self.opd_map.W[...] = np.where(self.opd_map.mask, interferometer_zenike.__zernikepolar__(C, r, u), np.nan)
+        np.testing.assert_allclose(self.opd_map.zernike()[1, 2], C, atol=1e-10)
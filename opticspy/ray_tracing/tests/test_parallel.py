@@ -0,0 +1,63 @@
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy.ray_tracing import field, parallel, trace
+
+from example_lenses import cooke_triplet
+
+
+class TestParallelTrace(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.Lens = cooke_triplet()
+        cls.grid = field.grid_generator(20, 'grid')
+        cls.serial = trace.trace_system(cls.Lens, cls.grid)
+
+    def assert_same(self, bundle):
+        np.testing.assert_array_equal(bundle.Pos, self.serial.Pos)
+        np.testing.assert_array_equal(bundle.KLM, self.serial.KLM)
+
+    def test_thread(self):
+        for n_workers in (2, 5):
+            self.assert_same(trace.trace_system(self.Lens, self.grid, backend='thread', n_workers=n_workers))
+
+    def test_process(self):
+        self.assert_same(trace.trace_system(self.Lens, self.grid, backend='process', n_workers=3))
+
+    def test_chunk_bounds(self):
+        assert parallel.chunk_bounds(10, 3) == [(0, 4), (4, 8), (8, 10)]
+        assert parallel.chunk_bounds(10, 3, chunk_size=6) == [(0, 6), (6, 10)]
+
+    def test_unknown_backend(self):
+        with self.assertRaises(Exception):
+            trace.trace_system(self.Lens, self.grid, backend='gpu')
+
+    def test_shared_bundle(self):
+        Pos, KLM = field.grid2launch(self.Lens, self.grid, self.Lens.field_angle_list)
+        wave_num = np.arange(1, len(self.Lens.wavelength_list) + 1).reshape(-1, 1, 1)
+        with parallel.trace_shared(self.Lens, Pos, KLM, wave_num, n_workers=2,
+                                   axes=('wave', 'field', 'ray')) as bundle:
+            attached = parallel.SharedRayBundle.attach(bundle.descriptor())
+            np.testing.assert_array_equal(attached.Pos, self.serial.Pos)
+            attached.close()
+
+    def test_trace_lenses(self):
+        Pos, KLM = field.grid2launch(self.Lens, self.grid, 0.0)
+        with parallel.trace_lenses([self.Lens, self.Lens], Pos, KLM, 1, n_workers=2) as bundle:
+            assert bundle.axes == ('lens', 'ray')
+            np.testing.assert_array_equal(bundle.Pos[:, 1], self.serial.Pos[:, 0, 0])
+
+    def test_thread_into_strided_buffers(self):
+        shape = self.serial.Pos.shape
+        Pos_out = np.empty(shape[:-2] + (2*shape[-2], 3))[..., ::2, :]
+        KLM_out = np.empty(Pos_out.shape)
+        Pos, KLM = field.grid2launch(self.Lens, self.grid, self.Lens.field_angle_list)
+        wave_num = np.arange(1, len(self.Lens.wavelength_list) + 1).reshape(-1, 1, 1)
+        P, D = trace.trace_rays(self.Lens, np.broadcast_to(Pos, shape[1:]), np.broadcast_to(KLM, shape[1:]),
+                                wave_num, backend='thread', n_workers=2, Pos_out=Pos_out, KLM_out=KLM_out)
+        assert P is Pos_out and D is KLM_out
+        np.testing.assert_array_equal(Pos_out, self.serial.Pos)
+        with self.assertRaises(Exception):
+            trace.trace_rays(self.Lens, Pos, KLM, 1, backend='thread', Pos_out=np.empty(Pos.shape, dtype=np.float32),
+                             KLM_out=np.empty(Pos.shape, dtype=np.float32))
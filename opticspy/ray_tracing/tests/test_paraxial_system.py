@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy.ray_tracing import first_order_tools
+
+from example_lenses import cooke_triplet
+
+
+def looped_ABCD(Lens, start, end, w):
+    # the R/T matrix loop ABCD_start_end used before the prefix products
+    s = Lens.surface_list
+    matrices = []
+    for i in range(start - 1, end):
+        matrices.append(first_order_tools.R(1/s[i].radius, s[i-1].indexlist[w], s[i].indexlist[w]))
+        if i + 1 != end:
+            matrices.append(first_order_tools.T(s[i].thickness, s[i].indexlist[w]))
+    return np.array(first_order_tools.ABCD(matrices))
+
+
+class TestParaxialSystem(TestCase):
+    def setUp(self):
+        self.Lens = cooke_triplet()
+        self.system = first_order_tools.paraxial_system(self.Lens)
+
+    def test_ABCD_matches_loop(self):
+        N = len(self.Lens.surface_list)
+        w = self.system.reference
+        for start in range(1, N + 1):
+            for end in range(start, N + 1):
+                expected = looped_ABCD(self.Lens, start, end, w)
+                np.testing.assert_allclose(self.system.ABCD(start, end), expected, rtol=1e-12, atol=1e-12,
+                                           err_msg=str((start, end)))
+
+    def test_matrix_per_wavelength(self):
+        N = len(self.Lens.surface_list)
+        for start, end in [(1, N - 1), (2, N - 1), (3, 5)]:
+            M = self.system.matrix(start, end)
+            for w in range(len(self.Lens.wavelength_list)):
+                np.testing.assert_allclose(M[w].ravel(), looped_ABCD(self.Lens, start, end, w), rtol=1e-12, atol=1e-12)
+
+    def test_bad_surfaces(self):
+        for start, end in [(0, 3), (4, 3), (1, len(self.Lens.surface_list) + 1)]:
+            with self.assertRaises(ValueError):
+                self.system.ABCD(start, end)
+
+    def test_chief_ray_through_stop_center(self):
+        stop = [S.STO for S in self.Lens.surface_list].index(True) + 1
+        heights = first_order_tools.chief_ray_heights(self.Lens, 20.0)
+        self.assertLess(abs(heights[stop - 2]), 1e-10*abs(heights).max())
+        marginal = first_order_tools.marginal_ray_heights(self.Lens, 'all')
+        np.testing.assert_allclose(marginal[:, 0], self.Lens.EPD/2)
@@ -0,0 +1,24 @@
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy.ray_tracing import pupil
+
+
+class TestPupil(TestCase):
+    def test_weights(self):
+        for grid_type, n in [('grid', 12), ('circular', 4), ('hexapolar', 5), ('gauss', 4),
+                             ('fibonacci', 100), ('halton', 100), ('random', 100)]:
+            grid, weights = pupil.sample(grid_type, n)
+            assert grid.shape == (len(weights), 2)
+            assert np.all((grid**2).sum(axis=1) <= 1 + 1e-12)
+            np.testing.assert_allclose(weights.sum(), 1)
+        assert len(pupil.square(12)[0]) == 88
+        assert len(pupil.circular(4)[0]) == 60
+
+    def test_gauss_is_exact(self):
+        grid, weights = pupil.gauss(3)
+        r2 = (grid**2).sum(axis=1)
+        # pupil averages of r**6 and y**2
+        np.testing.assert_allclose((weights * r2**3).sum(), 1 / 4)
+        np.testing.assert_allclose((weights * grid[:, 1]**2).sum(), 1 / 4)
@@ -0,0 +1,22 @@
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy.ray_tracing import cal_tools, pupil, trace
+
+from example_lenses import cooke_triplet
+
+
+class TestPupilQuadrature(TestCase):
+    def test_converges_to_dense_grid(self):
+        Lens = cooke_triplet()
+        quadrature = cal_tools.pupil_quadrature(Lens, n_rings=4)
+        assert len(quadrature.grid) == 36
+
+        grid, weights = pupil.square(201)
+        xy = trace.trace_system(Lens, grid, surface_num=-1).xy(-1)
+        centroid = (xy * weights).sum(axis=-1)
+        rms = np.sqrt((((xy - centroid[..., None])**2).sum(axis=0) * weights).sum(axis=-1))
+        np.testing.assert_allclose(quadrature.rms_spot, rms, rtol=1e-3)
+        np.testing.assert_allclose(quadrature.centroid, np.moveaxis(centroid, 0, -1), atol=1e-5)
+        assert np.all(quadrature.rms_wavefront > 0)
@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy.ray_tracing import cal_tools, field, parallel, trace
+
+from example_lenses import cooke_triplet
+
+
+class TestStream(TestCase):
+    def test_reducers_match_full_trace(self):
+        Lens = cooke_triplet()
+        grids = list(field.random_pupil_grids(5000, 1200, seed=0))
+        xy = trace.trace_system(Lens, np.concatenate(grids), surface_num=-1).xy(-1)
+
+        stream = trace.trace_stream(Lens, field.pupil_chunks(Lens, grids))
+        centroid, rms = cal_tools.reduce_stream(stream, [cal_tools.Centroid(), cal_tools.RMSRadius()])
+
+        np.testing.assert_allclose(centroid.result(), np.moveaxis(xy.mean(axis=-1), 0, -1))
+        d = xy - xy.mean(axis=-1, keepdims=True)
+        np.testing.assert_allclose(rms.result(), np.sqrt((d**2).sum(axis=0).mean(axis=-1)))
+
+    def test_merge(self):
+        rng = np.random.default_rng(0)
+        xy = rng.normal(size=(2, 3, 1000)) + [[[1.0]], [[-2.0]]]
+        whole = [cal_tools.RMSRadius().update(xy), cal_tools.MaxRadius().update(xy),
+                 cal_tools.FractionWithin(1.5).update(xy)]
+        parts = [[cal_tools.RMSRadius(), cal_tools.MaxRadius(), cal_tools.FractionWithin(1.5)] for _ in range(3)]
+        for reducers, chunk in zip(parts, np.array_split(xy, 3, axis=-1)):
+            cal_tools.reduce_stream([(np.moveaxis(chunk, 0, -1), None)], reducers)
+        merged = cal_tools.merge_reducers(parts)
+        for a, b in zip(whole, merged):
+            np.testing.assert_allclose(a.result(), b.result())
+
+    def test_rms_of_uniform_disk(self):
+        # RMS radius about the centroid, R/sqrt(2) for a uniform disk of radius R
+        rng = np.random.default_rng(5)
+        r = 2.0*np.sqrt(rng.random(200000))
+        t = 2*np.pi*rng.random(200000)
+        xy = np.array([r*np.cos(t) + 3.0, r*np.sin(t) - 1.0])
+        self.assertAlmostEqual(cal_tools.rms(xy), 2.0/np.sqrt(2), places=2)
+        self.assertAlmostEqual(cal_tools.rms([[-1.0, 1.0, 1.0, -1.0], [-1.0, -1.0, 1.0, 1.0]]), np.sqrt(2))
+        np.testing.assert_allclose(cal_tools.rms(xy), np.sqrt(((xy - xy.mean(axis=-1, keepdims=True))**2).sum(axis=0).mean()))
+
+    def test_spot_rms_matches_stream(self):
+        Lens = cooke_triplet()
+        grids = list(field.random_pupil_grids(3000, 1000, seed=1))
+        spot = cal_tools.SpotDiagram(Lens, trace.trace_system(Lens, np.concatenate(grids), surface_num=-1))
+        stream = trace.trace_stream(Lens, field.pupil_chunks(Lens, grids))
+        rms, = cal_tools.reduce_stream(stream, [cal_tools.RMSRadius()])
+        np.testing.assert_allclose(spot.rms, rms.result())
+
+    def test_encircled_energy_center(self):
+        with self.assertRaises(Exception):
+            cal_tools.EncircledEnergy(1.0)
+        Lens = cooke_triplet()
+        grids = list(field.random_pupil_grids(3000, 1000, seed=2))
+        center = np.moveaxis(cal_tools.reduce_stream(trace.trace_stream(Lens, field.pupil_chunks(Lens, grids)),
+                                                     [cal_tools.Centroid()])[0].result(), -1, 0)
+        ee, = parallel.reduce_stream(Lens, field.pupil_chunks(Lens, grids),
+                                     [cal_tools.EncircledEnergy(0.05, 20, center)], backend='serial')
+        radius, fraction = ee.result()
+        assert np.all(np.diff(fraction, axis=-1) >= 0)
+
+    def test_parallel_backends_agree(self):
+        Lens = cooke_triplet()
+        # chunks of growing size, the shared slots are reused and grown
+        grids = list(field.random_pupil_grids(3000, 500, seed=3)) + list(field.random_pupil_grids(1500, 1500, seed=4))
+        center = np.zeros((2, 3, 3))
+        results = {}
+        for backend in parallel.BACKENDS:
+            reducers = [cal_tools.Centroid(), cal_tools.RMSRadius(), cal_tools.MaxRadius(),
+                        cal_tools.FractionWithin(0.05), cal_tools.EncircledEnergy(0.1, 10, center)]
+            parallel.reduce_stream(Lens, field.pupil_chunks(Lens, grids), reducers, backend=backend, n_workers=2)
+            # EncircledEnergy gives (radius, fraction)
+            results[backend] = [np.ravel(x) for r in reducers
+                                for x in (r.result() if isinstance(r.result(), tuple) else (r.result(),))]
+        for backend in ('thread', 'process'):
+            np.testing.assert_array_equal(np.concatenate(results[backend]), np.concatenate(results['serial']),
+                                          err_msg=backend)
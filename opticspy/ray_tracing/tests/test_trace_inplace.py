@@ -0,0 +1,71 @@
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy.ray_tracing import field, trace
+
+from example_lenses import cooke_triplet
+
+
+class TestTraceInplace(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.Lens = cooke_triplet()
+        Pos, KLM = field.grid2launch(cls.Lens, field.grid_generator(12, 'grid'), cls.Lens.field_angle_list)
+        cls.wave_num = np.arange(1, len(cls.Lens.wavelength_list) + 1).reshape(-1, 1, 1)
+        shape = (len(cls.Lens.wavelength_list),) + Pos.shape
+        cls.Pos = np.broadcast_to(Pos, shape)
+        cls.KLM = np.broadcast_to(KLM, shape)
+
+    def test_same_as_traceray_batch(self):
+        surface_list = self.Lens.surface_list
+        Pos, KLM = trace.trace_rays_inplace(self.Lens, self.Pos, self.KLM, self.wave_num)
+        for i in range(len(surface_list) - 1):
+            P, D = trace.traceray_batch(Pos[i], KLM[i], surface_list[i], surface_list[i + 1], self.wave_num)
+            np.testing.assert_array_equal(P, Pos[i + 1])
+            np.testing.assert_array_equal(D, KLM[i + 1])
+
+    def test_image_only(self):
+        Pos, KLM = trace.trace_rays(self.Lens, self.Pos, self.KLM, self.wave_num)
+        work = trace.TraceWorkspace(self.Pos.shape[:-1])
+        Pos_out, KLM_out = np.empty(self.Pos.shape), np.empty(self.KLM.shape)
+        for _ in range(2):
+            P, D = trace.trace_image(self.Lens, self.Pos, self.KLM, self.wave_num, Pos_out, KLM_out, work)
+            assert P is Pos_out and D is KLM_out
+            np.testing.assert_array_equal(P, Pos[-1])
+            np.testing.assert_array_equal(D, KLM[-1])
+
+    def test_surface_only(self):
+        grid = field.grid_generator(12, 'grid')
+        full = trace.trace_system(self.Lens, grid)
+        for surface_num in (-1, 4):
+            bundle = trace.trace_system(self.Lens, grid, surface_num=surface_num)
+            assert bundle.n_surfaces == 1
+            np.testing.assert_array_equal(bundle.xy(surface_num), full.xy(surface_num))
+
+    def test_bundle_selections_are_views(self):
+        bundle = trace.trace_system(self.Lens, field.grid_generator(12, 'grid'))
+        for part in (bundle.wave(2), bundle.field(3), bundle.wave(1).field(2), bundle.rays(3, 9)):
+            assert np.shares_memory(part.Pos, bundle.Pos)
+            assert np.shares_memory(part.KLM, bundle.KLM)
+        bundle = trace.trace_sys(self.Lens)
+        for part in (self.Lens.field_trace_info, self.Lens.Y_fan_info, self.Lens.X_fan_info):
+            assert np.shares_memory(part.Pos, bundle.Pos)
+
+    def test_same_as_legacy_traceray(self):
+        surface_list = self.Lens.surface_list
+        Pos, KLM = field.grid2launch(self.Lens, field.grid_generator(6, 'grid'), self.Lens.field_angle_list)
+        Pos, KLM = Pos.reshape(-1, 3), KLM.reshape(-1, 3)
+        # rays far off axis miss the lens surfaces and are lost (nan)
+        Pos = np.concatenate([Pos, [[0, 40, Pos[0, 2]], [25, -25, Pos[0, 2]]]])
+        KLM = np.concatenate([KLM, [[0, 0, 1], [0, 0, 1]]])
+        lost = 0
+        with np.errstate(invalid='ignore'):
+            for i in range(len(surface_list) - 1):
+                rays = trace.traceray([field.Ray(p, d) for p, d in zip(Pos, KLM)],
+                                      surface_list[i], surface_list[i + 1], 2)
+                Pos, KLM = trace.traceray_batch(Pos, KLM, surface_list[i], surface_list[i + 1], 2)
+                np.testing.assert_allclose(Pos, [ray.Pos for ray in rays], rtol=1e-13, atol=1e-13)
+                np.testing.assert_allclose(KLM, [ray.KLM for ray in rays], rtol=1e-13, atol=1e-13)
+                lost = np.isnan(Pos).any(axis=-1).sum()
+        self.assertEqual(lost, 2)
@@ -0,0 +1,41 @@
+from unittest import TestCase
+
+import numpy as np
+
+from opticspy.ray_tracing import field, trace
+
+from example_lenses import cooke_triplet
+
+
+class TestVignetting(TestCase):
+    def setUp(self):
+        self.Lens = cooke_triplet()
+        self.grid = field.grid_generator(20, 'grid')
+
+    def test_no_aperture_keeps_every_ray(self):
+        bundle = trace.trace_system(self.Lens, self.grid)
+        assert bundle.valid.all()
+
+    def test_aperture_clips_rays(self):
+        self.Lens.set_aperture(2, 5.0)
+        bundle = trace.trace_system(self.Lens, self.grid)
+        r = np.hypot(*bundle.xy(2))
+        assert np.all(r[bundle.valid] <= 5.0)
+        assert np.all(np.isnan(bundle.Pos[-1][~bundle.valid]))
+        transmission = bundle.transmission()
+        np.testing.assert_array_equal(transmission[:, 0], 1)
+        assert np.all(transmission[:, 1:] < 1)
+
+    def test_live_rays_match_full_trace(self):
+        self.Lens.set_aperture(2, 5.0)
+        self.Lens.set_aperture(7, 4.0)
+        compact = trace.trace_system(self.Lens, self.grid)
+        saved = trace.COMPACT_FRACTION
+        trace.COMPACT_FRACTION = 0
+        try:
+            full = trace.trace_system(self.Lens, self.grid)
+        finally:
+            trace.COMPACT_FRACTION = saved
+        assert compact.valid.mean() < trace.COMPACT_FRACTION
+        np.testing.assert_array_equal(compact.valid, full.valid)
+        np.testing.assert_array_equal(compact.Pos, full.Pos)
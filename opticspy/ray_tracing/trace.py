@@ -1,82 +1,130 @@
 from __future__ import division as __division__
 import numpy as __np__
-import matplotlib.pyplot as __plt__
 from . import field,first_order_tools,surface
 from . import output_tools
+from . import parallel
 
 # Function: trace rays
 # input a list of ray
 # output [ray position and direction] on next surface
 
 
-def trace_spotdiagram(Lens,n,grid_type):
+def trace_system(Lens,grid_list,wave_list=None,field_list=None,backend='serial',n_workers=None,
+                 surface_num=None):
     '''
-    trace all field,all wavelength through all surfaces
-    return list of dictionary
+    trace one pupil grid for all fields and all wavelengths in one pass
+    ==========================================================
+    input:
+    Lens: Lens instance
+    grid_list: (P,2) normalized pupil coordinates
+    wave_list: wavelength numbers to trace, default all
+    field_list: field numbers to trace, default all
+    backend: 'serial', 'thread' or 'process', see parallel module
+    n_workers: number of workers, default os.cpu_count()
+    surface_num: keep only the rays on this surface (-1 the image)
+    output:
+    RayBundle with axes ('wave','field','ray'),
+    position array shape (n_surfaces,W,F,P,3), (1,W,F,P,3) with surface_num
     '''
-    all_field_ray_dict_list = []
-    for wave_num in range(len(Lens.wavelength_list)):
-        wave_num = wave_num + 1
-        one_wavelength_trace = []
-        for field_num in range(len(Lens.field_angle_list)):
-            field_num = field_num + 1
-            field_ray_dict_list = trace_field_wave(Lens,field_num,wave_num,n,grid_type)
-            one_wavelength_trace.append(field_ray_dict_list)
-        all_field_ray_dict_list.append(one_wavelength_trace)
-    Lens.field_trace_info = all_field_ray_dict_list
-    return all_field_ray_dict_list
-
-def trace_Y_fan(Lens):
-    all_Y_fan_ray_dict_list = []
-    for wave_num in range(len(Lens.wavelength_list)):
-        wave_num = wave_num + 1
-        one_wavelength_trace = []
-        for field_num in range(len(Lens.field_angle_list)):
-            field_num = field_num + 1
-            field_ray_dict_list = trace_Y_fan_field_wave(Lens,field_num,wave_num,n=25)
-            one_wavelength_trace.append(field_ray_dict_list)
-        all_Y_fan_ray_dict_list.append(one_wavelength_trace)
-
-    Lens.Y_fan_info = all_Y_fan_ray_dict_list
-    return all_Y_fan_ray_dict_list
+    if wave_list is None:
+        wave_list = range(1,len(Lens.wavelength_list)+1)
+    if field_list is None:
+        field_list = range(1,len(Lens.field_angle_list)+1)
+    wave_nums = __np__.asarray(wave_list,dtype=int).reshape(-1,1,1)
+    Pos,KLM = launch_rays(Lens,grid_list,field_list,wave_nums)
+    shape = (len(wave_nums),)+Pos.shape[-3:]
+    Pos_all,KLM_all = trace_rays(Lens,__np__.broadcast_to(Pos,shape),
+                                 __np__.broadcast_to(KLM,shape),wave_nums,
+                                 backend=backend,n_workers=n_workers,surface_num=surface_num)
+    surfaces = None if surface_num is None else (surface_number(Lens,surface_num),)
+    return field.RayBundle(Pos_all,KLM_all,axes=('wave','field','ray'),surfaces=surfaces)
+
+def launch_rays(Lens,grid_list,field_list,wave_num):
+    '''
+    launch rays of a normalized pupil grid for some fields
+    ==========================================================
+    input:
+    Lens: Lens instance
+    grid_list: (P,2) normalized pupil coordinates
+    field_list: field numbers, fields are YAN or (XAN,YAN)
+    wave_num: wavelength number, or (W,1,1) wavelength numbers
+    output:
+    Pos, KLM (F,P,3) aimed at the paraxial entrance pupil, or with
+    Lens.ray_aiming (W,F,P,3) aimed at the stop by real rays
+    '''
+    angles = field.field_angles([Lens.field_angle_list[f-1] for f in field_list])
+    if Lens.ray_aiming:
+        from . import aiming
+        return aiming.aim_rays(Lens,grid_list,angles,wave_num)
+    return field.grid2launch(Lens,grid_list,angles[:,1],angles[:,0])
 
-def trace_X_fan(Lens):
-    all_X_fan_ray_dict_list = []
-    for wave_num in range(len(Lens.wavelength_list)):
-        wave_num = wave_num + 1
-        one_wavelength_trace = []
-        for field_num in range(len(Lens.field_angle_list)):
-            field_num = field_num + 1
-            field_ray_dict_list = trace_X_fan_field_wave(Lens,field_num,wave_num,n=20)
-            one_wavelength_trace.append(field_ray_dict_list)
-        all_X_fan_ray_dict_list.append(one_wavelength_trace)
+def trace_spotdiagram(Lens,n,grid_type,backend='serial',n_workers=None,surface_num=None):
+    '''
+    trace all field,all wavelength through all surfaces,
+    or with surface_num keep only that surface
+    return RayBundle, axes ('wave','field','ray')
+    '''
+    grid_list = field.grid_generator(n,grid_type)
+    Lens.field_trace_info = trace_system(Lens,grid_list,backend=backend,n_workers=n_workers,
+                                         surface_num=surface_num)
+    return Lens.field_trace_info
 
-    Lens.X_fan_info = all_X_fan_ray_dict_list
-    return all_X_fan_ray_dict_list
+def trace_Y_fan(Lens,n=25,backend='serial',n_workers=None):
+    Lens.Y_fan_info = trace_system(Lens,field.Y_fan_grid(n),backend=backend,n_workers=n_workers)
+    return Lens.Y_fan_info
 
+def trace_X_fan(Lens,n=20,backend='serial',n_workers=None):
+    Lens.X_fan_info = trace_system(Lens,field.X_fan_grid(n),backend=backend,n_workers=n_workers)
+    return Lens.X_fan_info
 
+def trace_sys(Lens,n=12,grid_type='grid',n_Y_fan=25,n_X_fan=20,backend='serial',n_workers=None):
+    '''
+    trace spot diagram grid, Y fan, X fan and the chief/marginal rays
+    for drawing together, all fields and all wavelengths in one trace
+    fill Lens.field_trace_info, Y_fan_info, X_fan_info and surface diameters
+    '''
+    grids = [field.grid_generator(n,grid_type),field.Y_fan_grid(n_Y_fan),
+             field.X_fan_grid(n_X_fan),DRAW_RAY_GRID]
+    grids = [__np__.asarray(g,dtype=float).reshape(-1,2) for g in grids]
+    bounds = __np__.cumsum([0]+[len(g) for g in grids])
+    ray_bundle = trace_system(Lens,__np__.concatenate(grids),backend=backend,n_workers=n_workers)
+    Lens.field_trace_info = ray_bundle.rays(bounds[0],bounds[1])
+    Lens.Y_fan_info = ray_bundle.rays(bounds[1],bounds[2])
+    Lens.X_fan_info = ray_bundle.rays(bounds[2],bounds[3])
+    wave_num = int(len(Lens.wavelength_list)/2+1)
+    set_draw_diameter(Lens,ray_bundle.rays(bounds[3],bounds[4]).wave(wave_num))
+    return ray_bundle
 
 
 def trace_field_wave(Lens,field_num,wave_num,n,grid_type):
     '''
     trace one field in one wavelength
+    return RayBundle
     '''
-    field_angle = Lens.field_angle_list[field_num-1]
-    field_rays_list = field.field_rays_generator(Lens,field_angle,n,grid_type)
-    field_ray_dict_list = raylist2raydict(Lens,field_rays_list,wave_num)
-    return field_ray_dict_list
+    grid_list = field.grid_generator(n,grid_type)
+    return trace_grid_field_wave(Lens,grid_list,field_num,wave_num)
 
 def trace_Y_fan_field_wave(Lens,field_num,wave_num,n):
-    field_angle = Lens.field_angle_list[field_num-1]
-    Y_fan_rays_list = field.Y_fan_rays_generator(Lens,n,field_angle)
-    Y_fan_ray_dict_list = raylist2raydict(Lens,Y_fan_rays_list,wave_num)
-    return Y_fan_ray_dict_list
+    return trace_grid_field_wave(Lens,field.Y_fan_grid(n),field_num,wave_num)
 
 def trace_X_fan_field_wave(Lens,field_num,wave_num,n):
-    field_angle = Lens.field_angle_list[field_num-1]
-    X_fan_rays_list = field.X_fan_rays_generator(Lens,n,field_angle)
-    X_fan_ray_dict_list = raylist2raydict(Lens,X_fan_rays_list,wave_num)
-    return X_fan_ray_dict_list
+    return trace_grid_field_wave(Lens,field.X_fan_grid(n),field_num,wave_num)
+
+def trace_grid_field_wave(Lens,grid_list,field_num,wave_num):
+    '''
+    trace a normalized pupil grid for one field in one wavelength
+    return RayBundle
+    '''
+    Pos,KLM = launch_rays(Lens,grid_list,[field_num],wave_num)
+    return trace_bundle(Lens,Pos.reshape(-1,3),KLM.reshape(-1,3),wave_num)
+
+def trace_bundle(Lens,Pos,KLM,wave_num):
+    '''
+    trace (N,3) start position and direction arrays through all surfaces
+    return RayBundle
+    '''
+    Pos_all,KLM_all = trace_rays(Lens,Pos,KLM,wave_num)
+    return field.RayBundle(Pos_all,KLM_all)
 
 
 def raylist2raydict(Lens,rayslist,wave_num):
@@ -88,22 +136,395 @@ def raylist2raydict(Lens,rayslist,wave_num):
     raylist: ray list in EP
     wave_num: wavelength number
     '''
-    field_ray_dict_list = []
-    surface_list = Lens.surface_list
-    for ray_list in rayslist:
-        ray_list = [ray_list]
-        ray_tracing = []
-        ray_tracing.append(ray_list)
-        for i in range(len(surface_list)-1):
-            ray_list = traceray(ray_list, surface_list[0+i], surface_list[1+i], wave_num)
-            ray_tracing.append(ray_list)
-        ray_dict = ray2dict(ray_tracing)
-        field_ray_dict_list.append(ray_dict)
-    return field_ray_dict_list
+    Pos = __np__.asarray([ray.Pos for ray in rayslist],dtype=float).reshape(-1,3)
+    KLM = __np__.asarray([ray.KLM for ray in rayslist],dtype=float).reshape(-1,3)
+    return trace_bundle(Lens,Pos,KLM,wave_num).to_dict_list()
 
 
+def trace_rays(Lens,Pos,KLM,wave_num,backend='serial',n_workers=None,surface_num=None,
+               Pos_out=None,KLM_out=None):
+    '''
+    Vectorized ray tracing, trace a batch of rays through all surfaces
+    ==========================================================
+    input:
+    Lens: Lens instance
+    Pos: (N,3) ray positions on the first surface, or any (...,3)
+    KLM: (N,3) ray direction cosines
+    wave_num: wavelength number, or wavelength number array
+              broadcasting against Pos[...,0]
+    backend: 'serial', or 'thread'/'process' to split the rays
+             across n_workers workers, see parallel module
+    surface_num: store only the rays on this surface (-1 the image),
+                 memory does not grow with the number of surfaces
+    Pos_out, KLM_out: optional output buffers
+    output:
+    Pos_all, KLM_all: (n_surfaces,N,3) ray position and direction on each surface,
+                      (1,N,3) with surface_num
+    '''
+    if backend != 'serial':
+        if Pos_out is not None and (__np__.asarray(Pos_out).dtype != float or __np__.asarray(KLM_out).dtype != float):
+            # a RayBundle converts other types to a copy, the rays would not reach the caller
+            raise Exception('Pos_out and KLM_out must be float64 arrays')
+        out = None if Pos_out is None else field.RayBundle(Pos_out,KLM_out)
+        return parallel.trace_rays(Lens,Pos,KLM,wave_num,backend=backend,n_workers=n_workers,
+                                   out=out,surface_num=surface_num)
+    if surface_num is None:
+        return trace_rays_inplace(Lens,Pos,KLM,wave_num,Pos_out,KLM_out)
+    Pos = __np__.asarray(Pos,dtype=float)
+    shape = __np__.broadcast_shapes(Pos.shape[:-1],__np__.shape(KLM)[:-1],__np__.shape(wave_num))
+    if Pos_out is None:
+        Pos_out = __np__.empty((1,)+shape+(3,))
+    if KLM_out is None:
+        KLM_out = __np__.empty((1,)+shape+(3,))
+    trace_rays_inplace(Lens,Pos,KLM,wave_num,Pos_out[0],KLM_out[0],image_only=True,
+                       surface_num=surface_num)
+    return Pos_out,KLM_out
+
+def surface_number(Lens,surface_num):
+    '''
+    surface number starting from 1, -1 means the image surface
+    '''
+    n = len(Lens.surface_list)
+    if surface_num == -1:
+        return n
+    if not 1 <= surface_num <= n:
+        raise Exception('no surface %s, the lens has %d surfaces'%(surface_num,n))
+    return surface_num
 
 
+def trace_image(Lens,Pos,KLM,wave_num,Pos_out=None,KLM_out=None,work=None,surface_num=-1,OPL_out=None,
+                valid_out=None):
+    '''
+    trace rays to the image surface (or surface_num) only,
+    intermediate surfaces are not stored
+    output: Pos_out, KLM_out (...,3) ray position and direction on the image
+    see trace_rays_inplace
+    '''
+    return trace_rays_inplace(Lens,Pos,KLM,wave_num,Pos_out,KLM_out,image_only=True,
+                              work=work,surface_num=surface_num,OPL_out=OPL_out,
+                              valid_out=valid_out)
+
+def trace_stream(Lens,chunks,surface_num=-1):
+    '''
+    streaming ray tracing, for more rays than fit in memory
+    ==========================================================
+    input:
+    Lens: Lens instance
+    chunks: iterable of (Pos,KLM,wave_num) launch rays,
+            e.g. field.pupil_chunks(Lens,field.random_pupil_grids(n))
+    surface_num: surface to keep, default image
+    output:
+    yield (Pos,KLM) (...,3) on surface_num for every chunk.
+    The output buffers and scratch arrays are reused while the chunk
+    shape does not change, so peak memory is bounded by one chunk;
+    copy the yielded arrays to keep them.
+    '''
+    Pos_out = KLM_out = work = None
+    for Pos,KLM,wave_num in chunks:
+        Pos = __np__.asarray(Pos,dtype=float)
+        KLM = __np__.asarray(KLM,dtype=float)
+        shape = __np__.broadcast_shapes(Pos.shape[:-1],KLM.shape[:-1],__np__.shape(wave_num))
+        if work is None or work.shape != shape:
+            work = TraceWorkspace(shape)
+            Pos_out = __np__.empty(shape+(3,))
+            KLM_out = __np__.empty(shape+(3,))
+        yield trace_image(Lens,Pos,KLM,wave_num,Pos_out,KLM_out,work,surface_num)
+
+def trace_rays_inplace(Lens,Pos,KLM,wave_num,Pos_out=None,KLM_out=None,image_only=False,work=None,
+                       surface_num=-1,OPL_out=None,valid_out=None):
+    '''
+    Allocation free ray tracing kernel
+    ==========================================================
+    input:
+    Lens: Lens instance
+    Pos, KLM: (...,3) ray position and direction on the first surface
+    wave_num: wavelength number, or wavelength number array
+              broadcasting against Pos[...,0]
+    Pos_out, KLM_out: output buffers, allocated when None,
+              (n_surfaces,...,3), or (...,3) with image_only
+    image_only: keep only the rays on the image surface
+    work: TraceWorkspace of the batch shape, reused between calls
+    surface_num: with image_only, the surface to stop at, default image
+    OPL_out: optional optical path length buffer, (n_surfaces,...) or (...)
+             with image_only, filled with the optical path from the plane
+             wavefront through the origin of the first surface
+    valid_out: optional (...) bool buffer, False for the rays lost on the
+             way (missed surface, outside a surface aperture, total
+             internal reflection), lost rays are nan from that surface on
+    output:
+    Pos_out, KLM_out
+    With the buffers and the workspace passed in, tracing does not
+    allocate any array, every surface is traced with out= operations.
+    Once less than COMPACT_FRACTION of the rays are still alive, the
+    live rays are gathered and the following surfaces skip the lost ones.
+    '''
+    surface_list = Lens.surface_list
+    Pos = __np__.asarray(Pos,dtype=float)
+    KLM = __np__.asarray(KLM,dtype=float)
+    shape = __np__.broadcast_shapes(Pos.shape[:-1],KLM.shape[:-1],__np__.shape(wave_num))
+    out_shape = shape+(3,) if image_only else (len(surface_list),)+shape+(3,)
+    if Pos_out is None:
+        Pos_out = __np__.empty(out_shape)
+    if KLM_out is None:
+        KLM_out = __np__.empty(out_shape)
+    if work is None or work.shape != shape:
+        work = TraceWorkspace(shape)
+    if valid_out is None:
+        valid_out = work.valid
+    valid_out[...] = True
+    index = work.index_table(Lens,wave_num)
+    if image_only:
+        n_trace = surface_number(Lens,surface_num)
+        Pos_out[...] = Pos
+        KLM_out[...] = KLM
+        if OPL_out is not None:
+            launch_OPL(Pos_out,KLM_out,index[0],OPL_out,work)
+    else:
+        n_trace = len(surface_list)
+        Pos_out[0] = Pos
+        KLM_out[0] = KLM
+        if OPL_out is not None:
+            launch_OPL(Pos_out[0],KLM_out[0],index[0],OPL_out[0],work)
+    live = None
+    for i in range(n_trace-1):
+        if image_only:
+            out = Pos_out,KLM_out,OPL_out
+        else:
+            out = Pos_out[i+1],KLM_out[i+1],None if OPL_out is None else OPL_out[i+1]
+        if live is not None:
+            live.trace(i,surface_list[i],surface_list[i+1])
+            if not image_only:
+                live.scatter(*out+(valid_out,))
+        elif image_only:
+            traceray_inplace(Pos_out,KLM_out,surface_list[i],surface_list[i+1],
+                             index[i],index[i+1],Pos_out,KLM_out,work,OPL_out,valid_out)
+        else:
+            if OPL_out is not None:
+                OPL_out[i+1] = OPL_out[i]
+            traceray_inplace(Pos_out[i],KLM_out[i],surface_list[i],surface_list[i+1],
+                             index[i],index[i+1],Pos_out[i+1],KLM_out[i+1],work,out[2],valid_out)
+        if i+2 < n_trace and len(shape) > 0:
+            valid = valid_out if live is None else live.valid
+            if __np__.count_nonzero(valid) < COMPACT_FRACTION*valid.size:
+                if live is None:
+                    live = LiveRays.gather(shape,valid_out,*out+(index,))
+                else:
+                    live = live.drop_lost(*out+(valid_out,))
+    if live is not None and image_only:
+        live.scatter(Pos_out,KLM_out,OPL_out,valid_out)
+    return Pos_out,KLM_out
+
+# trace only the live rays once less than this fraction is left
+COMPACT_FRACTION = 0.5
+
+class LiveRays(object):
+    '''
+    the rays still alive in a batch, gathered into (k,3) arrays
+    ids: flat indices of the rays in the batch of the given shape
+    index: (n_surfaces,k) refractive index of every surface for every ray
+    '''
+    def __init__(self,shape,ids,Pos,KLM,OPL,index):
+        self.shape = shape
+        self.ids = ids
+        self.Pos = Pos
+        self.KLM = KLM
+        self.OPL = OPL
+        self.index = index
+        self.valid = __np__.ones(len(ids),dtype=bool)
+        self.work = TraceWorkspace((len(ids),))
+
+    @classmethod
+    def gather(cls,shape,valid,Pos,KLM,OPL,index):
+        ids = __np__.flatnonzero(valid)
+        sel = __np__.unravel_index(ids,shape)
+        # wavelength axes of the index table broadcast against the batch
+        index = index.reshape((len(index),)+(1,)*(len(shape)-index.ndim+1)+index.shape[1:])
+        index = __np__.broadcast_to(index,(len(index),)+shape)[(slice(None),)+sel]
+        return cls(shape,ids,Pos[sel],KLM[sel],None if OPL is None else OPL[sel],index)
+
+    def trace(self,i,surface1,surface2):
+        traceray_inplace(self.Pos,self.KLM,surface1,surface2,self.index[i],self.index[i+1],
+                         self.Pos,self.KLM,self.work,self.OPL,self.valid)
+
+    def scatter(self,Pos,KLM,OPL,valid):
+        '''
+        write the live rays back into the batch arrays, the other rays are nan
+        '''
+        sel = __np__.unravel_index(self.ids,self.shape)
+        Pos[...] = __np__.nan
+        KLM[...] = __np__.nan
+        Pos[sel] = self.Pos
+        KLM[sel] = self.KLM
+        if OPL is not None:
+            OPL[...] = __np__.nan
+            OPL[sel] = self.OPL
+        valid[...] = False
+        valid[sel] = self.valid
+
+    def drop_lost(self,Pos,KLM,OPL,valid):
+        '''
+        LiveRays without the rays lost since gather, which are marked
+        lost in the batch arrays
+        '''
+        keep = self.valid
+        sel = __np__.unravel_index(self.ids[~keep],self.shape)
+        valid[sel] = False
+        Pos[sel] = __np__.nan
+        KLM[sel] = __np__.nan
+        if OPL is not None:
+            OPL[sel] = __np__.nan
+        return LiveRays(self.shape,self.ids[keep],self.Pos[keep],self.KLM[keep],
+                        None if self.OPL is None else self.OPL[keep],self.index[:,keep])
+
+def launch_OPL(Pos,KLM,n,OPL,work):
+    '''
+    optical path from the plane wavefront through the origin,
+    normal to the ray direction, to the ray start point: n*(KLM.Pos)
+    '''
+    __np__.multiply(KLM[...,0],Pos[...,0],out=OPL)
+    OPL += __np__.multiply(KLM[...,1],Pos[...,1],out=work.tmp)
+    OPL += __np__.multiply(KLM[...,2],Pos[...,2],out=work.tmp)
+    OPL *= n
+
+
+class TraceWorkspace(object):
+    '''
+    scratch arrays of traceray_inplace for one batch shape,
+    shared by all surfaces and reused from call to call
+    '''
+    def __init__(self,shape):
+        self.shape = tuple(shape)
+        self.E,self.G,self.root,self.tmp = __np__.empty((4,)+self.shape)
+        self.lost,self.hit,self.valid = __np__.empty((3,)+self.shape,dtype=bool)
+        self._index_key = None
+        self._index = None
+
+    def index_table(self,Lens,wave_num):
+        '''
+        refractive index of every surface for wave_num,
+        shape (n_surfaces,)+wave_num shape
+        '''
+        table = Lens._first_order('index_table',
+                    lambda: __np__.asarray([S.indexlist for S in Lens.surface_list],dtype=float))
+        if self._index_key is None or self._index_key[0] is not table or \
+           not __np__.array_equal(self._index_key[1],wave_num):
+            self._index_key = (table,__np__.array(wave_num))
+            self._index = table[:,__np__.asarray(wave_num)-1]
+        return self._index
+
+def _square(n,out):
+    if __np__.ndim(n) == 0:
+        return n*n
+    return __np__.multiply(n,n,out=out)
+
+def traceray_inplace(Pos,KLM,surface1,surface2,n1,n2,Pos_out,KLM_out,work,OPL=None,valid=None):
+    '''
+    traceray_batch writing into Pos_out and KLM_out, which may be Pos and KLM
+    n1, n2: refractive index of surface1 and surface2, scalar or array
+            broadcasting against Pos[...,0]
+    work: TraceWorkspace holding the scratch arrays
+    OPL: optional (...) optical path length, the path n1*delta to
+         surface2 is added in place
+    valid: optional (...) bool mask, cleared for the rays lost on surface2
+    Rays missing surface2, outside its aperture or totally internally
+    reflected are lost, their position, direction and OPL become nan.
+    '''
+    c2 = 1 / surface2.radius
+    if Pos_out is not Pos:
+        __np__.copyto(Pos_out,Pos)
+    if KLM_out is not KLM:
+        __np__.copyto(KLM_out,KLM)
+    x,y,z = Pos_out[...,0],Pos_out[...,1],Pos_out[...,2]
+    K,L,M = KLM_out[...,0],KLM_out[...,1],KLM_out[...,2]
+    E,G,root,tmp = work.E,work.G,work.root,work.tmp
+    lost,hit = work.lost,work.hit
+    z -= surface1.thickness
+    # E = c*(x**2+y**2+z**2) - 2*z
+    __np__.multiply(x,x,out=E)
+    E += __np__.multiply(y,y,out=tmp)
+    E += __np__.multiply(z,z,out=tmp)
+    E *= c2
+    E -= __np__.multiply(z,2,out=tmp)
+    # G = M - c*(K*x+L*y+M*z)
+    __np__.multiply(K,x,out=G)
+    G += __np__.multiply(L,y,out=tmp)
+    G += __np__.multiply(M,z,out=tmp)
+    G *= c2
+    __np__.subtract(M,G,out=G)
+    # cosI = sqrt(G**2 - c*E), delta = E/(G+cosI)
+    __np__.multiply(G,G,out=root)
+    root -= __np__.multiply(E,c2,out=tmp)
+    __np__.sqrt(root,out=root)
+    # no intersection with the sphere
+    __np__.isnan(root,out=lost)
+    E /= __np__.add(G,root,out=tmp)
+    if OPL is not None:
+        OPL += __np__.multiply(E,n1,out=tmp)
+    for P,D in ((x,K),(y,L),(z,M)):
+        P += __np__.multiply(D,E,out=tmp)
+    if surface2.aperture is not None:
+        __np__.multiply(x,x,out=E)
+        E += __np__.multiply(y,y,out=tmp)
+        lost |= __np__.greater(E,surface2.aperture**2,out=hit)
+    # if curvature == 0, it is a stop, object or image plane
+    if c2 == 0:
+        return _drop_lost(Pos_out,KLM_out,OPL,valid,lost)
+    # sigma = sqrt(n2**2 - n1**2*(1-cosI**2)) - n1*cosI
+    __np__.multiply(root,root,out=G)
+    __np__.subtract(1,G,out=G)
+    G *= _square(n1,tmp)
+    __np__.subtract(_square(n2,tmp),G,out=G)
+    __np__.sqrt(G,out=G)
+    # total internal reflection
+    lost |= __np__.isnan(G,out=hit)
+    G -= __np__.multiply(n1,root,out=tmp)
+    # KLM_new = (n1*KLM - c2*sigma*Pos_new)/n2, M_new += sigma/n2
+    __np__.divide(G,n2,out=root)
+    G *= c2
+    for P,D in ((x,K),(y,L),(z,M)):
+        D *= n1
+        D -= __np__.multiply(G,P,out=tmp)
+        D /= n2
+    M += root
+    return _drop_lost(Pos_out,KLM_out,OPL,valid,lost)
+
+def _drop_lost(Pos,KLM,OPL,valid,lost):
+    if not lost.any():
+        return Pos,KLM
+    if valid is not None:
+        valid &= ~lost
+    __np__.copyto(Pos,__np__.nan,where=lost[...,None])
+    __np__.copyto(KLM,__np__.nan,where=lost[...,None])
+    if OPL is not None:
+        __np__.copyto(OPL,__np__.nan,where=lost)
+    return Pos,KLM
+
+
+def traceray_batch(Pos, KLM, surface1, surface2, wave_num):
+    '''
+    Vectorized version of traceray, Pos and KLM are (...,3) arrays
+    wave_num: wavelength number, or an integer array broadcasting
+              against Pos[...,0] for several wavelengths at once
+    Return (...,3) ray position and ray direction on next surface
+    '''
+    c2 = 1 / surface2.radius
+    n1 = __np__.asarray(surface1.indexlist)[__np__.asarray(wave_num)-1]
+    n2 = __np__.asarray(surface2.indexlist)[__np__.asarray(wave_num)-1]
+    tn1 = surface1.thickness
+    xyz = Pos - [0, 0, tn1]
+    delta, cosI = pos(__np__.moveaxis(xyz,-1,0), __np__.moveaxis(KLM,-1,0), c2)
+    Pos_new = xyz + delta[...,None] * KLM
+    # if curvature == 0, it is a stop, object or image plane
+    if c2 == 0:
+        return Pos_new, KLM.copy()
+    sigma = __np__.sqrt(n2 ** 2 - n1 ** 2 * (1 - cosI ** 2)) - n1 * cosI
+    KLM_new = (n1[...,None] * KLM - c2 * sigma[...,None] * Pos_new) / n2[...,None]
+    KLM_new[...,2] += sigma / n2
+    return Pos_new, KLM_new
+
+
+# chief ray(0,0), marginal ray(0,1)(0,-1)
+DRAW_RAY_GRID = [[0,0],[0,1],[0,-1]]
 
 def trace_draw_ray(Lens):
     '''
@@ -115,47 +536,24 @@ def trace_draw_ray(Lens):
 
     output: ab_ray_list
     '''
-    ab_ray_list = []
-    list_1 = []
-    list_2 = []
     wave_num = int(len(Lens.wavelength_list)/2+1)
-    for field_num in range(len(Lens.field_angle_list)):
-        field_num = field_num + 1
-        chief_ray_list = trace_one_ray(Lens,field_num,wave_num,[0,0])
-        marginal_ray_list_1 = trace_one_ray(Lens,field_num,wave_num,[0,1])
-        marginal_ray_list_2 = trace_one_ray(Lens,field_num,wave_num,[0,-1])
-        ab_ray_list.append(chief_ray_list)
-        ab_ray_list.append(marginal_ray_list_1)
-        ab_ray_list.append(marginal_ray_list_2)
-
-        list_1.append(marginal_ray_list_1) # length 3
-        list_2.append(marginal_ray_list_2) # length 3
-
-    # start find surface aperture diameter
-    diameter_list = []
-    #print '============================================'
-    for i,j in zip(list_1,list_2):
-        tmp1 = []
-        tmp2 = []
-        #print '++++++++++++++++++++++++++++++++++++++++'
-        for m,n in zip(i,j):
-            ray_height1 = abs(m[0].Pos[1])
-            ray_height2 = abs(n[0].Pos[1])
-            tmp1.append(ray_height1)
-            tmp2.append(ray_height2)
-        diameter_list.append(tmp1)
-        diameter_list.append(tmp2)
-    #print '============================================'
-    D = []
-    diameter_list = __np__.asarray(diameter_list)
-    diameter_list = __np__.transpose(diameter_list)
-    for i in diameter_list:
-        #print i
-        D.append(max(i)*2)
+    ray_bundle = trace_system(Lens,DRAW_RAY_GRID,wave_list=[wave_num]).wave(1)
+    set_draw_diameter(Lens,ray_bundle)
+    ab_ray_list = []
+    for P,D in zip(ray_bundle.Pos.reshape(ray_bundle.n_surfaces,-1,3).swapaxes(0,1),
+                   ray_bundle.KLM.reshape(ray_bundle.n_surfaces,-1,3).swapaxes(0,1)):
+        ab_ray_list.append([[field.Ray(p,d)] for p,d in zip(P,D)])
+    return ab_ray_list
 
+def set_draw_diameter(Lens,ray_bundle):
+    '''
+    set surface diameter from the marginal rays of a bundle traced
+    with DRAW_RAY_GRID, axes ('field','ray')
+    '''
+    ray_height = abs(ray_bundle.Pos[:,:,1:3,1])
+    D = __np__.nanmax(ray_height.reshape(ray_bundle.n_surfaces,-1),axis=1)*2
     for (surface,d) in zip(Lens.surface_list,D):
         surface.__diameter__ = d*1.1
-    return ab_ray_list
 
 
 
@@ -175,14 +573,8 @@ def trace_one_ray(Lens,field_num,wave_num,ray,start=0,end=0,output=False,output_
     '''
     #print '-------------------ray tracing------------------'
     ray_tracing = []
-    EP = Lens.EP
-    EPD = Lens.EPD
-    # print 'Entrance pupil position',EP
-    # print 'Entrance pupil diameter',EPD
-    angle = Lens.field_angle_list[field_num-1]
     surface_list = Lens.surface_list
     ray_list = []
-    Pos_z = surface_list[0].thickness
 
   #   if ray == [0,0]:
   #       print 'trace chief ray'
@@ -193,15 +585,8 @@ def trace_one_ray(Lens,field_num,wave_num,ray,start=0,end=0,output=False,output_
   #   else:
   #       print 'trace one ray'
 
-    Pos_x = Lens.EPD/2 * ray[0]    # not general enough, now only could trace y angle ray
-                                   # not really need to be traced?
-                                   # need to think
-    Pos_y = -(Pos_z + EP)*__np__.tan(angle/180*__np__.pi) + Lens.EPD/2 * ray[1]
-    l = __np__.sin(angle/180*__np__.pi)
-    m = __np__.cos(angle/180*__np__.pi)
-    Pos = [Pos_x,Pos_y,0]
-    KLM = [0,l,m]
-    Ray_1 = field.Ray(Pos,KLM)
+    Pos,KLM = launch_rays(Lens,[ray],[field_num],wave_num)
+    Ray_1 = field.Ray(list(Pos.reshape(3)),list(KLM.reshape(3)))
     ray_list.append(Ray_1)
     ray_tracing.append(ray_list)
     for i in range(len(surface_list)-1):
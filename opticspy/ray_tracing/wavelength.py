@@ -1,6 +1,5 @@
 from __future__ import division as __division__
 import numpy as __np__
-import matplotlib.pyplot as __plt__
 
 # Wavelength related functions
 
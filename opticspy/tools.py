@@ -1,8 +1,7 @@
 import numpy as __np__
-import matplotlib.pyplot as __plt__
-from matplotlib import cm as __cm__
 
 def __apershow__(obj, extent):
+	import matplotlib.pyplot as __plt__
 	if extent != 0:
 		obj = -abs(obj)
 		__plt__.imshow(obj, extent = [-extent/2,extent/2,-extent/2,extent/2])
@@ -14,19 +13,33 @@ def __apershow__(obj, extent):
 		__plt__.set_cmap('Greys')
 		__plt__.show()
 
+# outside masks of the last samplings
+__masks__ = {}
+MAX_MASKS = 8
+
+def __outsidemask__(start, stop, l, R):
+	"""
+	cached boolean mask of the l x l grid of linspace(start, stop, l)
+	points outside the circle of radius R, mask[i,j] is
+	x[i]**2+x[j]**2 > R**2, read only, shared by every call with the
+	same sampling
+	"""
+	key = (start, stop, l, R)
+	mask = __masks__.get(key)
+	if mask is None:
+		x = __np__.linspace(start, stop, l)
+		mask = x[:,None]**2 + x[None,:]**2 > R**2
+		mask.flags.writeable = False
+		if len(__masks__) >= MAX_MASKS:
+			del __masks__[next(iter(__masks__))]
+		__masks__[key] = mask
+	return mask
+
 def makecircle(a, r, PR):
-	max = a.max()
-	size = __np__.sqrt(a.size)
-	for i in range(int(size)):
-		for j in range(int(size)):
-			if __np__.sqrt(r[i]**2+r[j]**2) > PR:
-				a[i,j] = max
+	a[__np__.sqrt(r[:,None]**2+r[None,:]**2) > PR] = a.max()
+
 def makecircle_boundary(a,r,PR,value):
-	size = __np__.sqrt(a.size)
-	for i in range(int(size)):
-		for j in range(int(size)):
-			if __np__.sqrt(r[i]**2+r[j]**2) > PR:
-				a[i,j] = value
+	a[__np__.sqrt(r[:,None]**2+r[None,:]**2) > PR] = value
 
 def circle_aperture(n):
 	aperture = __np__.zeros([n,n])
@@ -79,6 +92,8 @@ def phase_shift_figure(I,PR,type):
 	"""
 	Draw PSI Interferograms, several types.
 	"""
+	import matplotlib.pyplot as __plt__
+	from matplotlib import cm as __cm__
 	if type == "4-step":
 		f, axarr = __plt__.subplots(2, 2, figsize=(9, 9), dpi=80)
 		axarr[0, 0].imshow(-I[0], extent=[-PR,PR,-PR,PR],cmap=__cm__.Greys)
@@ -10,11 +10,11 @@ import matplotlib.pyplot as __plt__
 from matplotlib import cm as __cm__
 from matplotlib.ticker import LinearLocator as __LinearLocator__
 from matplotlib.ticker import FormatStrFormatter as __FormatStrFormatter__
-from numpy.fft import fftshift as __fftshift__
-from numpy.fft import ifftshift as __ifftshift__
-from numpy.fft import fft2 as __fft2__
+from .fft_tools import fftshift as __fftshift__
+from .fft_tools import ifftshift as __ifftshift__
+from .fft_tools import fft2 as __fft2__
 from numpy.linalg import inv
-from numpy.fft import ifft2 as __ifft2__
+from .fft_tools import ifft2 as __ifft2__
 import operator as op
 
 from . import interferometer_zenike as __interferometer__
@@ -227,19 +227,22 @@ class Coefficient(object):
 		z: Distance from exit pupil to image plane
 		r: pupil radius, in unit of lambda
 		"""
+		# the PSF only depends on the coefficients and r, keep the last
+		# one for otf, mtf and ptf
+		key = (tuple(self.__coefficients__),r)
+		cache = getattr(self,'__psfcache__',None)
+		if cache is not None and cache[0] == key:
+			return cache[1]
 		pupil = l1 = 200 # exit pupil sample points
 		x = __np__.linspace(-r, r, l1)
 		[X,Y] = __np__.meshgrid(x,x)
 		Z = __interferometer__.__zernikecartesian__(self.__coefficients__,X,Y)
-		for i in range(len(Z)):
-			for j in range(len(Z)):
-				if x[i]**2+x[j]**2>r**2:
-					Z[i][j] = 0
+		Z[__tools__.__outsidemask__(-r,r,l1,r)] = 0
 		d = 400 # background
 		A = __np__.zeros([d,d])
 		A[d//2-l1//2+1:d//2+l1//2+1,d//2-l1//2+1:d//2+l1//2+1] = Z
 		axis_1 = d//pupil*r
-		fig = __plt__.figure()
+		# fig = __plt__.figure()
 		# ax = fig.gca()
 		# __plt__.imshow(A,extent=[-axis_1,axis_1,-axis_1,axis_1],cmap=__cm__.RdYlGn)
 		# ax.set_xlabel('mm',fontsize=14)
@@ -247,12 +250,10 @@ class Coefficient(object):
 		# __plt__.show()
 
 		abbe = __np__.exp(-1j*2*__np__.pi*A)
-		for i in range(len(abbe)):
-			for j in range(len(abbe)):
-				if abbe[i][j]==1:
-					abbe[i][j]=0
+		abbe[abbe==1] = 0
 		PSF = __fftshift__(__fft2__(__fftshift__(abbe)))**2
 		PSF = PSF/PSF.max()
+		self.__psfcache__ = (key,PSF)
 		return PSF
 
 	def psf(self,r=1,lambda_1=632*10**(-9),z=0.1):
@@ -273,26 +274,37 @@ class Coefficient(object):
 
 		"""
 		print(r,lambda_1,z)
-		PSF = self.__psfcaculator__(r=r,lambda_1=lambda_1,z=z)
+		PSF = self.psfmatrix(r=r,lambda_1=lambda_1,z=z)
 		fig = __plt__.figure(figsize=(9, 6), dpi=80)
 		__plt__.imshow(abs(PSF),cmap=__cm__.RdYlGn)
 		__plt__.colorbar()
 		__plt__.show()
 		return 0
 
+	def psfmatrix(self,r=1,lambda_1=632*10**(-9),z=0.1):
+		"""
+		Point spread function matrix, no figure
+		"""
+		return self.__psfcaculator__(r=r,lambda_1=lambda_1,z=z).copy()
+
 	def otf(self,r=1,lambda_1=632*10**(-9),z=0.1):
-		PSF = self.__psfcaculator__(r=r,lambda_1=lambda_1,z=z)
-		OTF = __fftshift__(__fft2__(PSF))
+		OTF = self.otfmatrix(r=r,lambda_1=lambda_1,z=z)
 		return 0
 
+	def otfmatrix(self,r=1,lambda_1=632*10**(-9),z=0.1):
+		"""
+		Optical transfer function matrix, no figure, the transform of the
+		PSF intensity abs(PSF) with zero frequency in the middle
+		"""
+		PSF = self.__psfcaculator__(r=r,lambda_1=lambda_1,z=z)
+		OTF = __fftshift__(__fft2__(abs(PSF)))
+		return OTF
 
 	def mtf(self,r=1,lambda_1=632*10**(-9),z=0.1,matrix = False):
 		"""
 		Modulate Transfer function
 		"""
-		PSF = self.__psfcaculator__(r=r,lambda_1=lambda_1,z=z)
-		MTF = __fftshift__(__fft2__(PSF))
-		MTF = MTF/MTF.max()
+		MTF = self.mtfmatrix(r=r,lambda_1=lambda_1,z=z)
 		f0 = r/1000/lambda_1/z/10000   # cutoff frequency?
 		fig = __plt__.figure(figsize=(9, 6), dpi=80)
 		__plt__.imshow(abs(MTF),cmap=__cm__.bwr)
@@ -303,6 +315,15 @@ class Coefficient(object):
 		else:
 			return 0
 
+	def mtfmatrix(self,r=1,lambda_1=632*10**(-9),z=0.1):
+		"""
+		Modulate Transfer function matrix, modulus of the OTF normalized
+		to 1 at zero frequency, no figure
+		"""
+		MTF = abs(self.otfmatrix(r=r,lambda_1=lambda_1,z=z))
+		MTF = MTF/MTF.max()
+		return MTF
+
 	def ptf(self):
 		"""
 		Phase transfer function
@@ -311,11 +332,8 @@ class Coefficient(object):
 		PTF = __fftshift__(__fft2__(PSF))
 		PTF = __np__.angle(PTF)
 		b = 400
-		R = (200)**2
-		for i in range(b):
-			for j in range(b):
-				if (i-b/2)**2+(j-b/2)**2>R:
-					PTF[i][j] = 0
+		# (i-b/2)**2+(j-b/2)**2 > 200**2
+		PTF[__tools__.__outsidemask__(-b/2,b/2-1,b,200)] = 0
 		__plt__.imshow(abs(PTF),cmap=__cm__.rainbow)
 		__plt__.colorbar()
 		__plt__.show()
@@ -407,7 +425,8 @@ def fitting(Z,n,remain3D=False,remain2D=False,barchart=False,interferogram=False
 	fitting(Z,n)
 
 	Fitting an aberration to several orthonormal Zernike
-	polynomials.
+	polynomials, least squares over the pupil points where Z
+	is finite (see lstsqfit).
 
 	Return: n-th Zernike coefficients for a fitting surface aberration
 			Zernike coefficients barchart
@@ -427,31 +446,22 @@ def fitting(Z,n,remain3D=False,remain2D=False,barchart=False,interferogram=False
 	"""
 
 
-	fitlist = []
 	l = len(Z)
 	x2 = __np__.linspace(-1, 1, l)
-	y2 = __np__.linspace(-1, 1, l)
-	[X2,Y2] = __np__.meshgrid(x2,y2)
-	r = __np__.sqrt(X2**2 + Y2**2)
-	u = __np__.arctan2(Y2, X2)
-	for i in range(n):
-		C = [0]*i+[1]+[0]*(37-i-1)
-		ZF = __interferometer__.__zernikepolar__(C,r,u)
-		for i in range(l):
-			for j in range(l):
-				if x2[i]**2+y2[j]**2>1:
-					ZF[i][j]=0
-		a = sum(sum(Z*ZF))*2*2/l/l/__np__.pi
-		fitlist.append(round(a,3))
+	[X2,Y2] = __np__.meshgrid(x2,x2)
+	Z = __np__.asarray(Z,dtype=float)
+	outside = __tools__.__outsidemask__(-1,1,l,1)
+	design = __design__(~outside & __np__.isfinite(Z),x2,n)
+	index,Q,R = design
+	fitlist = [round(a,3) for a in __solve__(design,Z)]
 
 
 	l1 = len(fitlist)
 	fitlist = fitlist+[0]*(37-l1)
-	Z_new = Z - __interferometer__.__zernikepolar__(fitlist,r,u)
-	for i in range(l):
-		for j in range(l):
-			if x2[i]**2+y2[j]**2>1:
-				Z_new[i][j]=0
+	# zero outside the pupil, nan where Z is not defined
+	Z_new = __np__.where(outside,0,__np__.nan)
+	# design matrix times the rounded coefficients, A = Q R
+	Z_new.flat[index] = Z.flat[index] - __np__.dot(Q,__np__.dot(R,fitlist[:n]))
 
 	#plot bar chart of zernike
 	if barchart == True:
@@ -518,6 +528,92 @@ def fitting(Z,n,remain3D=False,remain2D=False,barchart=False,interferogram=False
 	__tools__.zernikeprint(fitlist)
 	return fitlist,C
 
+# QR factors of the design matrices of the last pupils fitted,
+# at most MAX_DESIGNS of them and MAX_DESIGN_BYTES together
+__designs__ = {}
+MAX_DESIGNS = 4
+MAX_DESIGN_BYTES = 256*2**20
+
+def __design__(mask,x,n):
+	"""
+	QR factorization of the Zernike design matrix, cached per (mask, grid, n)
+
+	mask: (l,l) points used in the fit, [y,x] indexed
+	x: (l,) normalized pupil coordinates of the columns (and rows)
+	n: number of terms
+	Return: index: flat indices of the mask points
+			Q: (points,n) orthonormal columns
+			R: (n,n) upper triangular, Q R is the design matrix with
+			   Z1..Zn at the mask points as columns
+	The QR factorization keeps the accuracy on annular, partial or
+	vignetted pupils where the normal equations are ill conditioned.
+	"""
+	key = (mask.shape,__np__.packbits(mask).tobytes(),x.tobytes(),n)
+	design = __designs__.get(key)
+	if design is None:
+		index = __np__.flatnonzero(mask)
+		if len(index) < n:
+			raise Exception('Only %d pupil points to fit %d Zernike terms' % (len(index),n))
+		X = __np__.broadcast_to(x[None,:],mask.shape).ravel()[index]
+		Y = __np__.broadcast_to(x[:,None],mask.shape).ravel()[index]
+		r = __np__.sqrt(X**2 + Y**2)
+		u = __np__.arctan2(Y,X)
+		angular = {}
+		A = __np__.empty((len(index),n))
+		for j in range(n):
+			A[:,j] = __interferometer__.__zernikepolarterm__(j,r,u,angular)
+		Q,R = __np__.linalg.qr(A)
+		design = (index,Q,R)
+		if Q.nbytes <= MAX_DESIGN_BYTES:
+			__designs__[key] = design
+			while len(__designs__) > MAX_DESIGNS or sum(d[1].nbytes for d in __designs__.values()) > MAX_DESIGN_BYTES:
+				del __designs__[next(iter(__designs__))]
+	return design
+
+def lstsqfit(Z,n=37,mask=None,x=None):
+	"""
+	------------------------------------------------
+	lstsqfit(Z,n=37,mask=None,x=None)
+
+	Least squares Zernike coefficients of one surface or a stack of
+	surfaces sampled on the same grid
+
+	Return: (n,) coefficients, or (N,n) for a (N,l,l) stack
+	Input:
+	Z: (l,l) or (N,l,l) surfaces, [y,x] indexed
+	n: number of Zernike terms, up to 37
+	mask: (l,l) points to fit, default inside the unit circle where
+		  every surface is finite
+	x: (l,) pupil coordinates of the columns (and rows), default
+	   linspace(-1,1,l) as in fitting
+
+	The QR factorization of the design matrix is kept for the next
+	calls with the same mask, grid and n, then a stack is one matrix
+	product and a n x n triangular solve
+	------------------------------------------------
+	"""
+	Z = __np__.asarray(Z,dtype=float)
+	l = Z.shape[-1]
+	if x is None:
+		x = __np__.linspace(-1, 1, l)
+	x = __np__.asarray(x,dtype=float)
+	if mask is None:
+		mask = x[:,None]**2 + x[None,:]**2 <= 1
+		mask = mask & __np__.isfinite(Z.reshape((-1,l,l))).all(axis=0)
+	return __solve__(__design__(__np__.asarray(mask,dtype=bool),x,n),Z)
+
+def __solve__(design,Z):
+	"""
+	least squares coefficients (...,n) of the (...,l,l) surfaces Z
+	with a design from __design__
+	"""
+	index,Q,R = design
+	l = Z.shape[-1]
+	stack = Z.reshape((-1,l*l))[:,index]
+	# R C = Q.T Z
+	C = __np__.linalg.solve(R,__np__.dot(Q.T,stack.T)).T
+	return C.reshape(Z.shape[:-2]+(len(R),))
+
 def transform(zernikes, tx, ty, thetaR, scaling=1.0):
 	"""
 		------------------------------------------------
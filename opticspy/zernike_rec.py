@@ -8,10 +8,10 @@ import matplotlib.pyplot as __plt__
 from matplotlib import cm as __cm__
 from matplotlib.ticker import LinearLocator as __LinearLocator__
 from matplotlib.ticker import FormatStrFormatter as __FormatStrFormatter__
-from numpy.fft import fftshift as __fftshift__
-from numpy.fft import ifftshift as __ifftshift__
-from numpy.fft import fft2 as __fft2__
-from numpy.fft import ifft2 as __ifft2__
+from .fft_tools import fftshift as __fftshift__
+from .fft_tools import ifftshift as __ifftshift__
+from .fft_tools import fft2 as __fft2__
+from .fft_tools import ifft2 as __ifft2__
 from . import tools as __tools__
 
 
@@ -98,6 +98,12 @@ class Coefficient(object):
 		width: Exit pupil width
 		z: Distance from exit pupil to image plane
 		"""
+		# the PSF only depends on the coefficients and a, keep the last
+		# one for mtf and ptf
+		key = (tuple(self.__coefficients__),self.__a__)
+		cache = getattr(self,'__psfcache__',None)
+		if cache is not None and cache[0] == key:
+			return cache[1]
 		a = self.__a__
 		b = __sqrt__(1-a**2)
 		l1 = 100;
@@ -113,12 +119,10 @@ class Coefficient(object):
 		# __plt__.colorbar()
 		# __plt__.show()
 		abbe = __np__.exp(-1j*2*__np__.pi*A)
-		for i in range(len(abbe)):
-			for j in range(len(abbe)):
-				if abbe[i][j]==1:
-					abbe[i][j]=0
+		abbe[abbe==1] = 0
 		PSF = __fftshift__(__fft2__(__fftshift__(abbe)))**2
 		PSF = PSF/PSF.max()
+		self.__psfcache__ = (key,PSF)
 		return PSF
 
 	def psf(self,lambda_1=632*10**(-9),z=0.1):
@@ -4,10 +4,11 @@ setup(name='opticspy',
       keywords = ('optic', 'lens', 'zernike','raytracing'),
       description='Python optics module',
       license = 'MIT License',
-      install_requires = ['numpy>=1.9.3','matplotlib>=1.4.3','unwrap'],
+      install_requires = ['numpy>=1.20','matplotlib>=1.4.3','unwrap'],
       author='Xing Fan',
       author_email='marvin.fanxing@gmail.com',
       url='http://opticspy.org',
+      python_requires = '>=3.8',
       packages = find_packages(),
       include_package_data = True,
       #package_data = {'': ['*.md','ray_tracing/glass_database/*','ray_tracing/CodeV_examples/*'],},